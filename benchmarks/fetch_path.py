@@ -0,0 +1,90 @@
+"""
+Measures the allocations of Consumer.fetch() and the fetch-to-emit time
+of the bytewax input, against the in-process fake broker so that only
+the client's own overhead is measured. It runs against the checkout:
+
+    $ python benchmarks/fetch_path.py
+    $ python benchmarks/fetch_path.py --messages 100000 --batch-size 5000
+
+Allocations include the fake broker's NATS message objects, which a
+real connection allocates as well.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+# measure the checkout, which does not have to be installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memphis.testing import FakeBroker # pylint: disable=wrong-import-position
+
+STATION = "bench"
+
+
+async def measure_fetch_allocations(broker, batch_size):
+    memphis = broker.client()
+    await memphis.connect(host="localhost", username="bench", password="bench")
+    consumer = await memphis.consumer(station_name=STATION, consumer_name="alloc", batch_size=batch_size)
+    # the first fetch subscribes, only the following ones are measured
+    await consumer.fetch(batch_size)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    batch = await consumer.fetch(batch_size)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    count = len(batch)
+    await consumer.destroy()
+    await memphis.close()
+    return count, blocks, size
+
+
+def measure_fetch_to_emit(broker, messages, batch_size):
+    from memphis.connectors.bytewax import MemphisInput # pylint: disable=import-outside-toplevel
+
+    # the source runs its async calls on the thread's event loop
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    inp = MemphisInput("localhost", "bench", "bench", STATION, "emit",
+                       replay_range=(1, messages), batch_size=batch_size, backend=broker.client)
+    source = inp.build_part("0", None)
+    emitted = 0
+    started_at = time.perf_counter()
+    try:
+        while True:
+            if source.next() is not None:
+                emitted += 1
+    except StopIteration:
+        pass
+    elapsed = time.perf_counter() - started_at
+    source.close()
+    return emitted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--payload-size", type=int, default=100)
+    args = parser.parse_args()
+
+    broker = FakeBroker()
+    broker.add_messages(STATION, [bytes(args.payload_size)] * args.messages)
+
+    count, blocks, size = asyncio.run(measure_fetch_allocations(broker, args.batch_size))
+    print(f"fetch of {count} messages: {blocks} blocks retained "
+          f"({blocks / max(count, 1):.1f} per message), {size / max(count, 1):.0f} bytes per message")
+
+    emitted, elapsed = measure_fetch_to_emit(broker, args.messages, args.batch_size)
+    print(f"fetch to emit of {emitted} messages: {elapsed:.2f}s, "
+          f"{emitted / elapsed:.0f} msg/s, {elapsed / max(emitted, 1) * 1e6:.1f} us per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures the cold-start import time of the memphis packages.
+
+Every measurement runs in a fresh interpreter so that nothing is
+cached in sys.modules. It runs against the checkout:
+
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py --runs 20 memphis memphis._internal.memphis
+
+Pass --importtime to print the slowest imports reported by
+`python -X importtime` for each module.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# the imports are timed in the checkout, which does not have to be installed
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "memphis",
+    "memphis.connectors",
+    "memphis._internal",
+    "memphis._internal.memphis",
+    "memphis.connectors.bytewax",
+]
+
+TIMER = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def time_import(module, runs):
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", TIMER.format(module=module)],
+                             capture_output=True, check=True, text=True, cwd=REPO_ROOT)
+        timings.append(float(out.stdout) * 1000)
+    return timings
+
+
+def slowest_imports(module, top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         capture_output=True, check=True, text=True, cwd=REPO_ROOT)
+    rows = []
+    for line in out.stderr.splitlines()[1:]:
+        _, self_us, cumulative_us, name = line.split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'module':<32} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for module in args.modules:
+        timings = time_import(module, args.runs)
+        print(f"{module:<32} {statistics.median(timings):>10.1f} {min(timings):>10.1f} {max(timings):>10.1f}")
+
+    if args.importtime:
+        for module in args.modules:
+            print()
+            print(f"slowest imports for {module} (cumulative us, self us):")
+            for cumulative_us, self_us, name in slowest_imports(module, args.top):
+                print(f"  {cumulative_us:>10} {self_us:>10}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import connectors
+import importlib
 
 __all__ = ["connectors"]
+
+
+def __getattr__(name):
+    # submodules are imported on first access so that importing memphis
+    # does not pull in bytewax and nats (PEP 562)
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -12,10 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
+from typing import TYPE_CHECKING
+
 from .exceptions import MemphisConnectError
 from .exceptions import MemphisError
 from .exceptions import MemphisHeaderError
 from .exceptions import MemphisSchemaError
-from .memphis import Memphis
+
+if TYPE_CHECKING:
+    from .memphis import Memphis
+
+_LAZY_ATTRIBUTES = {
+    "Memphis": ".memphis",
+}
 
 __all__ = ["MemphisConnectError", "MemphisError", "MemphisHeaderError", "MemphisSchemaError", "Memphis"]
+
+
+def __getattr__(name):
+    # Memphis is imported on first access, see PEP 562
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,91 @@
+import json
+import math
+import os
+import time
+
+DEFAULT_LAG_DRAIN_SEC = 60
+DEFAULT_LOAD_STALE_SEC = 300
+
+_LOAD_SUFFIX = ".load.json"
+
+
+def write_load(load_dir: str, part: str, station: str, stats: dict):
+    """Saves the load a partition measured, replacing its previous load."""
+    load = {"station": station,
+            "pending": stats["pending"],
+            "fetch_rate": stats["fetch_rate"],
+            "updated_at": time.time()}
+    path = os.path.join(load_dir, part.replace("/", "_") + _LOAD_SUFFIX)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(load, f)
+    os.replace(tmp_path, path)
+
+
+def read_station_loads(load_dir: str, stale_sec: float = DEFAULT_LOAD_STALE_SEC, saved_before: float = None):
+    """
+    Returns the {"pending", "fetch_rate"} of each station, combined from
+    the loads its partitions saved. Loads saved more than stale_sec
+    before the latest one are left out, they come from partitions that
+    no longer exist. With saved_before, a time.time() value, loads saved
+    at or after it are left out as well.
+    """
+    if not os.path.isdir(load_dir):
+        return {}
+    loads = []
+    for name in os.listdir(load_dir):
+        if not name.endswith(_LOAD_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(load_dir, name), encoding="utf-8") as f:
+                load = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if saved_before is None or load["updated_at"] < saved_before:
+            loads.append(load)
+    if len(loads) == 0:
+        return {}
+
+    newest = max(load["updated_at"] for load in loads)
+    stations = {}
+    for load in loads:
+        if load["updated_at"] < newest - stale_sec:
+            continue
+        station = stations.setdefault(load["station"], {"pending": 0, "fetch_rate": 0.0})
+        # the partitions of a station share a consumer group, they all
+        # see the group's pending count but fetch their own messages
+        station["pending"] = max(station["pending"], load["pending"])
+        station["fetch_rate"] += load["fetch_rate"]
+    return stations
+
+
+def load_score(load: dict, lag_drain_sec: float = DEFAULT_LAG_DRAIN_SEC) -> float:
+    """Messages per second a station needs to keep up and drain its lag in lag_drain_sec."""
+    return load["fetch_rate"] + load["pending"] / lag_drain_sec
+
+
+def split_consumers(weights: dict, consumers: int):
+    """
+    Splits consumers among stations in proportion to their weights, at
+    least one per station, by largest remainder so the split is stable.
+    """
+    stations = sorted(weights)
+    consumers = max(consumers, len(stations))
+    total = sum(max(weights[station], 0.0) for station in stations)
+    if total <= 0:
+        total = len(stations)
+        weights = {station: 1.0 for station in stations}
+
+    shares = {station: max(weights[station], 0.0) / total * consumers for station in stations}
+    split = {station: max(1, math.floor(shares[station])) for station in stations}
+    # stations rounded down get the remaining consumers, largest share first
+    by_remainder = sorted(stations, key=lambda station: (split[station] - shares[station], station))
+    index = 0
+    while sum(split.values()) < consumers:
+        split[by_remainder[index % len(by_remainder)]] += 1
+        index += 1
+    # stations raised to one consumer are paid for by the largest ones
+    while sum(split.values()) > consumers:
+        largest = max(stations, key=lambda station: (split[station], station))
+        split[largest] -= 1
+    return split
@@ -0,0 +1,96 @@
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+
+from .exceptions import MemphisError
+
+CAPTURE_SUFFIX = ".mcap"
+
+_MAGIC = b"MCAP0001"
+# a batch is the time it was fetched at, relative to the first batch,
+# and its number of messages
+_BATCH = struct.Struct("<qI")
+# a message is its sequence, deliveries, pending count, store time (-1
+# if unknown) and the length of its headers (JSON) and data
+_MESSAGE = struct.Struct("<QIIqII")
+
+CapturedMessage = namedtuple("CapturedMessage", ["seq", "num_delivered", "num_pending", "stored_at_ns", "headers", "data"])
+
+
+def capture_path(directory: str, part: str) -> str:
+    return os.path.join(directory, f"part-{part}{CAPTURE_SUFFIX}")
+
+
+def list_captured_parts(directory: str):
+    """Returns the parts captured in a directory."""
+    return {name[len("part-"):-len(CAPTURE_SUFFIX)] for name in os.listdir(directory)
+            if name.startswith("part-") and name.endswith(CAPTURE_SUFFIX)}
+
+
+class CaptureWriter:
+    """
+    Writes fetched batches to a capture file, as fetched: raw (possibly
+    compressed or chunked) payloads, headers, sequence numbers, delivery
+    counts and the time between batches.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb") # pylint: disable=consider-using-with
+        self._file.write(_MAGIC)
+        self._started_at_ns = None
+
+    def write_batch(self, batch):
+        now_ns = time.monotonic_ns()
+        if self._started_at_ns is None:
+            self._started_at_ns = now_ns
+        parts = [_BATCH.pack(now_ns - self._started_at_ns, len(batch))]
+        for msg in batch:
+            headers = json.dumps(msg.get_headers() or {}).encode("utf-8")
+            data = msg.message.data
+            stored_at = msg.get_timestamp()
+            stored_at_ns = int(stored_at.timestamp() * 1e9) if stored_at is not None else -1
+            parts.append(_MESSAGE.pack(msg.get_sequence_number(), msg.get_num_delivered() or 0,
+                                       msg.get_num_pending() or 0, stored_at_ns, len(headers), len(data)))
+            parts.append(headers)
+            parts.append(data)
+        self._file.write(b"".join(parts))
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path: str):
+    """
+    Yields the (elapsed_ns, messages) batches of a capture file, where
+    elapsed_ns is the time since the first batch was fetched.
+    Raises:
+        MemphisError: the file is not a capture file.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise MemphisError(f"{path} is not a capture file")
+    offset = len(_MAGIC)
+    # a batch cut short by a crash while capturing is left out
+    while offset + _BATCH.size <= len(data):
+        elapsed_ns, count = _BATCH.unpack_from(data, offset)
+        batch_offset = offset + _BATCH.size
+        messages = []
+        for _ in range(count):
+            if batch_offset + _MESSAGE.size > len(data):
+                return
+            seq, num_delivered, num_pending, stored_at_ns, headers_len, data_len = _MESSAGE.unpack_from(data, batch_offset)
+            start = batch_offset + _MESSAGE.size
+            end = start + headers_len + data_len
+            if end > len(data):
+                return
+            headers = json.loads(data[start:start + headers_len])
+            messages.append(CapturedMessage(seq, num_delivered, num_pending,
+                                            stored_at_ns if stored_at_ns >= 0 else None,
+                                            headers, data[start + headers_len:end]))
+            batch_offset = end
+        offset = batch_offset
+        yield elapsed_ns, messages
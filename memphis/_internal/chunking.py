@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from .compression import decompress_payload
+
+CHUNK_ID_HEADER = "$memphis_chunk_id"
+CHUNK_INDEX_HEADER = "$memphis_chunk_index"
+CHUNK_COUNT_HEADER = "$memphis_chunk_count"
+
+DEFAULT_CHUNK_BUFFER_BYTES = 64 * 1024 * 1024
+DEFAULT_CHUNK_TIMEOUT_SEC = 60
+
+# room left for the chunk headers and the NATS header line, which the
+# server counts against the max payload along with the data
+_CHUNK_HEADROOM = 256
+
+
+def max_chunk_size(max_payload: int, headers: dict) -> int:
+    """Returns the largest payload that can be sent with headers."""
+    headers_size = sum(len(key) + len(str(value)) + 4 for key, value in headers.items())
+    return max_payload - headers_size - _CHUNK_HEADROOM
+
+
+def split_payload(data, chunk_size: int):
+    """Splits data into chunk_size views, without copying it."""
+    view = memoryview(data)
+    return [view[offset:offset + chunk_size] for offset in range(0, len(view), chunk_size)]
+
+
+def get_chunk_info(headers):
+    """Returns the (id, index, count) of a chunk, or None for whole messages."""
+    if not headers or CHUNK_ID_HEADER not in headers:
+        return None
+    return headers[CHUNK_ID_HEADER], int(headers[CHUNK_INDEX_HEADER]), int(headers[CHUNK_COUNT_HEADER])
+
+
+class ChunkedMessage:
+    """
+    A message reassembled from its chunks. Acking it acks every chunk;
+    the other accessors describe the first chunk, which carries the
+    producer's headers. The payload is kept as it was stored, it is
+    compressed before it is split into chunks.
+    """
+
+    __slots__ = ("parts", "data")
+
+    def __init__(self, parts, data):
+        self.parts = parts
+        self.data = data
+
+    async def ack(self):
+        await asyncio.gather(*[part.ack() for part in self.parts])
+
+    def get_data(self):
+        return bytearray(decompress_payload(self.data, self.get_headers()))
+
+    def get_raw_data(self):
+        return self.data
+
+    def get_headers(self):
+        return self.parts[0].get_headers()
+
+    def get_sequence_number(self):
+        return self.parts[0].get_sequence_number()
+
+    def get_sequence_numbers(self):
+        return [part.get_sequence_number() for part in self.parts]
+
+    def get_num_pending(self):
+        return self.parts[-1].get_num_pending()
+
+    def get_num_delivered(self):
+        return max(part.get_num_delivered() or 0 for part in self.parts)
+
+    def get_timestamp(self):
+        return self.parts[0].get_timestamp()
+
+    def get_produced_at_ns(self):
+        return self.parts[0].get_produced_at_ns()
+
+
+class _PartialMessage:
+    def __init__(self, count):
+        self.parts = [None] * count
+        self.received = 0
+        self.size = 0
+        self.started_at = time.monotonic()
+
+
+class ChunkAssembler:
+    """
+    Reassembles chunked messages as their chunks are fetched.
+
+    Incomplete messages are buffered up to max_bytes of chunk data and
+    for at most timeout_sec. Messages that go over either limit are
+    evicted without acking their chunks, so the broker redelivers them
+    once their ack wait expires and reassembly starts over.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CHUNK_BUFFER_BYTES, timeout_sec: float = DEFAULT_CHUNK_TIMEOUT_SEC):
+        self.max_bytes = max_bytes
+        self.timeout_sec = timeout_sec
+        self.buffered_bytes = 0
+        self.evicted = 0
+        self._partial = OrderedDict()
+
+    def __len__(self):
+        return len(self._partial)
+
+    def add(self, msg, chunk_info):
+        """
+        Buffers a chunk. Returns the ChunkedMessage once all of its
+        chunks arrived, None otherwise.
+        """
+        chunk_id, index, count = chunk_info
+        partial = self._partial.get(chunk_id)
+        if partial is None:
+            partial = _PartialMessage(count)
+            self._partial[chunk_id] = partial
+
+        data = msg.message.data
+        previous = partial.parts[index]
+        if previous is None:
+            partial.received += 1
+        else:
+            # a redelivery, keep the latest delivery so its ack is valid
+            partial.size -= len(previous.message.data)
+            self.buffered_bytes -= len(previous.message.data)
+        partial.parts[index] = msg
+        partial.size += len(data)
+        self.buffered_bytes += len(data)
+
+        if partial.received == count:
+            self._remove(chunk_id)
+            return ChunkedMessage(partial.parts, b"".join(part.message.data for part in partial.parts))
+
+        while self.buffered_bytes > self.max_bytes and len(self._partial) > 0:
+            self._remove(next(iter(self._partial)))
+            self.evicted += 1
+        return None
+
+    def expire(self):
+        """Evicts the incomplete messages older than timeout_sec."""
+        deadline = time.monotonic() - self.timeout_sec
+        while len(self._partial) > 0:
+            chunk_id, partial = next(iter(self._partial.items()))
+            if partial.started_at > deadline:
+                return
+            self._remove(chunk_id)
+            self.evicted += 1
+
+    def clear(self):
+        self._partial.clear()
+        self.buffered_bytes = 0
+
+    def _remove(self, chunk_id):
+        partial = self._partial.pop(chunk_id)
+        self.buffered_bytes -= partial.size
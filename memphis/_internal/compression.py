@@ -0,0 +1,130 @@
+import gzip
+import warnings
+
+from .exceptions import MemphisError
+
+COMPRESSION_HEADER = "$memphis_compression"
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+GZIP = "gzip"
+LZ4 = "lz4"
+ZSTD = "zstd"
+
+
+class _GzipCodec:
+    name = GZIP
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=6)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+
+class _Lz4Codec:
+    name = LZ4
+
+    def __init__(self):
+        import lz4.frame # pylint: disable=import-outside-toplevel,import-error
+        self._frame = lz4.frame
+
+    def compress(self, data):
+        return self._frame.compress(data)
+
+    def decompress(self, data):
+        return self._frame.decompress(data)
+
+
+class _ZstdCodec:
+    name = ZSTD
+
+    def __init__(self):
+        import zstandard # pylint: disable=import-outside-toplevel,import-error
+        # compressor/decompressor objects are reusable and much cheaper
+        # than the module-level helpers when called once per message
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+
+_CODEC_CLASSES = {
+    GZIP: _GzipCodec,
+    LZ4: _Lz4Codec,
+    ZSTD: _ZstdCodec,
+}
+
+_codecs = {}
+
+
+def get_codec(name: str):
+    """Get a (cached) codec by name.
+    Args:
+        name (str): one of gzip, lz4 or zstd.
+    Raises:
+        MemphisError: the codec is unknown or its library is not installed.
+    """
+    codec = _codecs.get(name)
+    if codec is not None:
+        return codec
+    codec_class = _CODEC_CLASSES.get(name)
+    if codec_class is None:
+        raise MemphisError(f"Unknown compression codec {name}")
+    try:
+        codec = codec_class()
+    except ImportError as e:
+        raise MemphisError(f"Compression codec {name} is not installed") from e
+    _codecs[name] = codec
+    return codec
+
+
+def resolve_codec(name):
+    """Resolve the codec used on the produce side.
+
+    Falls back to gzip, which is always available, when the requested
+    codec's library is not installed.
+    """
+    if name is None:
+        return None
+    try:
+        return get_codec(name)
+    except MemphisError as e:
+        if name not in _CODEC_CLASSES:
+            raise e
+        warnings.warn(f"memphis: {name} is not installed, falling back to {GZIP} compression")
+        return get_codec(GZIP)
+
+
+def compress_payload(codec, data, threshold: int = DEFAULT_COMPRESSION_THRESHOLD):
+    """Compress data if it is larger than threshold.
+
+    Returns the payload to send and the codec name to put in the
+    compression header, or None if the payload was left as is.
+    """
+    if codec is None or len(data) < threshold:
+        return data, None
+    compressed = codec.compress(bytes(data))
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, codec.name
+
+
+def decompress_payload(data, headers):
+    """Decompress data according to the compression header, if any.
+    Raises:
+        MemphisError: the codec is not installed or the payload is corrupt.
+    """
+    if not headers:
+        return data
+    name = headers.get(COMPRESSION_HEADER)
+    if name is None:
+        return data
+    codec = get_codec(name)
+    try:
+        return codec.decompress(data)
+    except Exception as e:
+        raise MemphisError(f"Payload can not be decompressed with {name}: {e}") from e
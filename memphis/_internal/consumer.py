@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import asyncio
 import json
 
 from .exceptions import MemphisError
 from .utils import default_error_handler, get_internal_name
 from .message import Message
+from .tracing import is_enabled as tracing_enabled, start_span
 
 
 class Consumer:
@@ -37,6 +39,7 @@ class Consumer:
         self.ping_consumer_interval_ms = 30000
         if error_callback is None:
             error_callback = default_error_handler
+        self.error_callback = error_callback
         self.start_consume_from_sequence = start_consume_from_sequence
         self.last_messages = last_messages
         self.context = {}
@@ -44,6 +47,8 @@ class Consumer:
         self.dls_current_index = 0
         self.dls_callback_func = None
         self.t_consume = None
+        self.psub = None
+        self.pending_acks = set()
 
     def set_context(self, context):
         """Set a context (dict) that will be passed to each message handler call."""
@@ -87,7 +92,9 @@ class Consumer:
                                  username,
                                  password,
                                  station))
-        
+
+        See batches() and messages() for iterating over the station
+        without writing the fetch loop by hand.
         """
         messages = []
         if self.connection.is_connection_active:
@@ -107,20 +114,22 @@ class Consumer:
                         self.dls_current_index -= len(messages)
                     return messages
 
-                durable_name = ""
-                if self.consumer_group != "":
-                    durable_name = get_internal_name(self.consumer_group)
-                else:
-                    durable_name = get_internal_name(self.consumer_name)
-                subject = get_internal_name(self.station_name)
-                self.psub = await self.connection.broker_connection.pull_subscribe(
-                    subject + ".final", durable=durable_name
-                )
-                msgs = await self.psub.fetch(batch_size)
-                for msg in msgs:
-                    messages.append(
-                        Message(msg, self.connection, self.consumer_group))
-                return messages
+                if self.psub is None:
+                    # subscribing looks the stream and consumer up on the
+                    # broker, the subscription is reused by later fetches
+                    subject = get_internal_name(self.station_name)
+                    self.psub = await self.connection.broker_connection.pull_subscribe(
+                        subject + ".final", durable=self.get_durable_name(), stream=subject
+                    )
+                with start_span("memphis.fetch", {"memphis.station": self.station_name,
+                                                  "memphis.batch_size": batch_size}) as span:
+                    msgs = await self.psub.fetch(batch_size)
+                    if tracing_enabled():
+                        span.set_attribute("memphis.messages", len(msgs))
+                        span.set_attribute("memphis.bytes", sum(len(msg.data) for msg in msgs))
+                connection = self.connection
+                consumer_group = self.consumer_group
+                return [Message(msg, connection, consumer_group) for msg in msgs]
             except Exception as e:
                 if "timeout" not in str(e).lower():
                     raise MemphisError(str(e)) from e
@@ -128,9 +137,128 @@ class Consumer:
         return messages
 
 
+    def __aiter__(self):
+        return self.messages()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush_acks()
+        await self.destroy()
+
+    def ack_in_background(self, messages):
+        """Acks messages without waiting for the acks, see flush_acks()."""
+        task = asyncio.ensure_future(self.__ack_all(messages))
+        self.pending_acks.add(task)
+        task.add_done_callback(self.pending_acks.discard)
+
+    async def __ack_all(self, messages):
+        results = await asyncio.gather(*[msg.ack() for msg in messages], return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                self.error_callback(res)
+
+    async def flush_acks(self):
+        """Waits for the acks sent by ack_in_background()."""
+        if len(self.pending_acks) > 0:
+            await asyncio.gather(*list(self.pending_acks), return_exceptions=True)
+
+    async def __prefetch(self, queue: asyncio.Queue, batch_size: int):
+        try:
+            while self.pull_interval_ms is not None:
+                batch = await self.fetch(batch_size)
+                if len(batch) == 0:
+                    await asyncio.sleep(self.pull_interval_ms / 1000)
+                    continue
+                await queue.put(batch)
+        except Exception as e:
+            await queue.put(e)
+
+    async def batches(self, batch_size: int = None, prefetch: int = 2, auto_ack: bool = True):
+        """
+        Iterate over batches of messages.
+
+        The next batches are fetched in the background while the current
+        one is processed. With auto_ack, a batch is acked in the
+        background once the loop moves on to the next one, so a batch
+        whose processing raised, or that the loop broke out of, is
+        redelivered.
+
+        Example:
+
+            async with await memphis.consumer(station_name=station,
+                                              consumer_name="test-consumer") as consumer:
+                async for batch in consumer.batches(batch_size=100):
+                    for msg in batch:
+                        print("Message:", msg.get_data())
+
+        Args:
+            batch_size (int, optional): max batch size. Defaults to the consumer's batch size.
+            prefetch (int, optional): max number of batches fetched ahead. Defaults to 2.
+            auto_ack (bool, optional): ack the messages once processed. Defaults to True.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        queue = asyncio.Queue(maxsize=prefetch)
+        fetcher = asyncio.ensure_future(self.__prefetch(queue, batch_size))
+        try:
+            while True:
+                batch = await queue.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+                if auto_ack:
+                    self.ack_in_background(batch)
+        finally:
+            fetcher.cancel()
+            await self.flush_acks()
+
+    async def messages(self, batch_size: int = None, prefetch: int = 2, auto_ack: bool = True):
+        """
+        Iterate over messages, fetching batches in the background.
+        `async for msg in consumer` iterates with the defaults.
+
+        With auto_ack, a message is acked in the background once the
+        loop moves on to the next one.
+
+        Args:
+            batch_size (int, optional): max batch size. Defaults to the consumer's batch size.
+            prefetch (int, optional): max number of batches fetched ahead. Defaults to 2.
+            auto_ack (bool, optional): ack the messages once processed. Defaults to True.
+        """
+        async for batch in self.batches(batch_size=batch_size, prefetch=prefetch, auto_ack=False):
+            for msg in batch:
+                yield msg
+                if auto_ack:
+                    self.ack_in_background([msg])
+
+    def get_durable_name(self):
+        if self.consumer_group != "":
+            return get_internal_name(self.consumer_group)
+        return get_internal_name(self.consumer_name)
+
+    async def ping(self):
+        """Checks that the consumer still exists, reporting to the error callback if it does not."""
+        if not self.connection.is_connection_active:
+            return
+        try:
+            await self.connection.broker_connection.consumer_info(
+                get_internal_name(self.station_name), self.get_durable_name()
+            )
+        except Exception as e:
+            if "not found" in str(e).lower():
+                self.error_callback(MemphisError("station/consumer were not found"))
+
     async def destroy(self):
         """Destroy the consumer."""
         self.pull_interval_ms = None
+        if self.psub is not None:
+            try:
+                await self.psub.unsubscribe()
+            except Exception:
+                pass
+            self.psub = None
         try:
             destroy_consumer_req = {
                 "name": self.consumer_name,
@@ -149,6 +277,7 @@ class Consumer:
                 raise MemphisError(error)
             internal_station_name = get_internal_name(self.station_name)
             map_key = internal_station_name + "_" + self.consumer_name.lower()
+            self.connection.scheduler.cancel("consumer_ping_" + map_key)
             del self.connection.consumers_map[map_key]
         except Exception as e:
             raise MemphisError(str(e)) from e
@@ -0,0 +1,81 @@
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+
+MSG_ID = "msg_id"
+PAYLOAD = "payload"
+
+DEFAULT_DEDUP_TTL_SEC = 3600
+DEFAULT_DEDUP_MAX_ENTRIES = 100000
+
+_DIGEST_SIZE = 8
+_ENTRY = struct.Struct(f"<{_DIGEST_SIZE}sd")
+
+
+def digest(data) -> bytes:
+    """Returns the 8 byte blake2b digest of data."""
+    return hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest()
+
+
+def dedup_key(msg, payload, mode: str):
+    """
+    Returns the digest a message is deduplicated on: its msg-id header,
+    or its payload. Returns None for messages without a msg-id.
+    """
+    if mode == PAYLOAD:
+        return digest(payload)
+    headers = msg.get_headers()
+    if not headers or "msg-id" not in headers:
+        return None
+    return digest(headers["msg-id"].encode("utf-8"))
+
+
+class DedupCache:
+    """
+    Time-windowed set of message digests.
+
+    Digests are kept in insertion order with the time they were first
+    seen, so expired entries are evicted from the front in O(1). Past
+    max_entries the oldest entries are evicted early, which bounds the
+    memory use to about 100 bytes per entry.
+    """
+
+    def __init__(self, ttl_sec: float = DEFAULT_DEDUP_TTL_SEC, max_entries: int = DEFAULT_DEDUP_MAX_ENTRIES):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, key):
+        self.expire()
+        return key in self._seen
+
+    def add(self, key):
+        if key in self._seen:
+            return
+        self._seen[key] = time.time()
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+    def expire(self):
+        deadline = time.time() - self.ttl_sec
+        while len(self._seen) > 0:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at > deadline:
+                return
+            del self._seen[key]
+
+    def dump(self) -> bytes:
+        """Packs the entries into 16 bytes each, e.g. for a resume state."""
+        self.expire()
+        return b"".join(_ENTRY.pack(key, seen_at) for key, seen_at in self._seen.items())
+
+    def load(self, data: bytes):
+        for key, seen_at in _ENTRY.iter_unpack(data):
+            self._seen[key] = seen_at
+        self.expire()
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
@@ -0,0 +1,98 @@
+import asyncio
+from collections import deque
+
+DEFAULT_MAX_IN_FLIGHT = 256
+
+
+class KeyedLanes:
+    """
+    Publishes items in order per key, and concurrently across keys.
+
+    Each key has a lane, a queue drained by its own task one item at a
+    time, so an item is only published once the previous item of its
+    key was. At most max_in_flight items are queued or publishing across
+    all lanes; put() waits for room beyond that.
+
+    When publishing an item fails, its lane stops: the rest of its queue
+    and later items of the key are dropped, and the error is kept in
+    failed. Other keys are not affected.
+    """
+
+    def __init__(self, publish, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.failed = {}
+        self.dropped = 0
+        self._publish = publish
+        self._lanes = {}
+        self._tasks = {}
+        self._in_flight = 0
+        self._room = None
+
+    @property
+    def in_flight(self) -> int:
+        """Number of items queued or publishing."""
+        return self._in_flight
+
+    async def put(self, key, item):
+        """Queues an item on its key's lane, waiting for room if needed."""
+        if key in self.failed:
+            self.dropped += 1
+            return
+        if self._room is None:
+            self._room = asyncio.Event()
+        while self._in_flight >= self.max_in_flight:
+            self._room.clear()
+            await self._room.wait()
+            if key in self.failed:
+                self.dropped += 1
+                return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = deque()
+            self._lanes[key] = lane
+        lane.append(item)
+        self._in_flight += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(self._drain(key, lane))
+        # let the lanes make progress while items are being written
+        await asyncio.sleep(0)
+
+    async def join(self, timeout_sec: float = None) -> bool:
+        """Waits for every queued item to be published or dropped. Returns whether they were."""
+        tasks = list(self._tasks.values())
+        if len(tasks) == 0:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout_sec)
+        return len(pending) == 0
+
+    def cancel(self):
+        """Drops every queued item."""
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def _drain(self, key, lane):
+        try:
+            while len(lane) > 0:
+                try:
+                    await self._publish(lane[0])
+                except Exception as e:
+                    self.failed[key] = e
+                    self.dropped += len(lane) - 1
+                    self._release(len(lane))
+                    lane.clear()
+                    return
+                lane.popleft()
+                self._release(1)
+        finally:
+            self._release(len(lane))
+            lane.clear()
+            del self._lanes[key]
+            del self._tasks[key]
+
+    def _release(self, count):
+        if count == 0:
+            return
+        self._in_flight -= count
+        if self._room is not None:
+            self._room.set()
@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+PRODUCED_AT_HEADER = "$memphis_produced_at_ns"
+
+LatencyStamp = namedtuple("LatencyStamp", ["produced_at_ns", "stored_at_ns", "fetched_at_ns"])
+LatencyStamp.__doc__ = """
+Times a message went through on its way to the flow, in nanoseconds
+since the epoch. produced_at_ns is None if the producer did not stamp
+the message.
+"""
+
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS
+    return _SUB_BUCKET_COUNT + (shift - 1) * _SUB_BUCKET_HALF + (value >> shift) - _SUB_BUCKET_HALF
+
+
+def _bucket_value(index: int) -> int:
+    """Returns the middle of the range of values counted in a bucket."""
+    if index < _SUB_BUCKET_COUNT:
+        return index
+    shift = (index - _SUB_BUCKET_COUNT) // _SUB_BUCKET_HALF + 1
+    mantissa = (index - _SUB_BUCKET_COUNT) % _SUB_BUCKET_HALF + _SUB_BUCKET_HALF
+    return (mantissa << shift) + (1 << (shift - 1))
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds.
+
+    Values are counted in log-linear buckets: exact below 128us and with
+    a relative error under 1% above, so recording is O(1) and the
+    memory use only grows with the range of values, not their number.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_us):
+        value_us = max(int(value_us), 0)
+        index = _bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_us
+        self.max = max(self.max, value_us)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(percentile / 100 * self.count, 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_bucket_value(index), self.max)
+        return self.max
+
+    def report(self):
+        """Returns the count, mean, p50, p99, p999 and max in microseconds."""
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count if self.count > 0 else 0,
+            "p50_us": self.percentile(50),
+            "p99_us": self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us": self.max,
+        }
@@ -13,17 +13,18 @@
 # limitations under the License.
 
 import asyncio
-import copy
 import json
 import ssl
-import uuid
-
-import nats as broker
+from typing import Union
 
+from .compression import DEFAULT_COMPRESSION_THRESHOLD
 from .consumer import Consumer
-from .exceptions import MemphisConnectError, MemphisError
+from .exceptions import MemphisConnectError, MemphisError, MemphisSchemaError
 from .producer import Producer
-from .utils import get_internal_name, random_bytes
+from .schemaverse import GRAPHQL, JSON, PROTOBUF, MissingValidatorError, compile_validator, warn_missing_validator
+from .servers import DEFAULT_PROBE_TIMEOUT_MS, parse_servers, rank_servers
+from .tracing import start_span
+from .utils import Scheduler, get_internal_name, parse_rfc3339, random_bytes
 
 
 class Memphis:
@@ -32,6 +33,10 @@ class Memphis:
 
     def __init__(self):
         self.is_connection_active = False
+        self.is_connection_closed = False
+        self.disconnections = 0
+        self.connection_listeners = []
+        self.broker_manager = None
         self.schema_updates_data = {}
         self.schema_updates_subs = {}
         self.producers_per_station = {}
@@ -41,12 +46,25 @@ class Memphis:
         self.json_schemas = {}
         self.cluster_configurations = {}
         self.station_schemaverse_to_dls = {}
-        self.update_configurations_sub = {}
-        self.configuration_tasks = {}
+        self.update_configurations_sub = None
+        self.configuration_tasks = None
         self.producers_map = {}
         self.consumers_map = {}
+        self.scheduler = Scheduler()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
 
     async def get_broker_manager_connection(self, connection_opts):
+        # nats is the most expensive import of the package, it is only
+        # needed once a connection is made
+        import copy # pylint: disable=import-outside-toplevel
+        import nats as broker # pylint: disable=import-outside-toplevel
+
+        on_localhost = any("localhost" in server for server in connection_opts["servers"])
         if "user" in connection_opts:
             async def ping_error_cb(e):
                 if "authorization violation" not in (str(e)).lower():
@@ -65,7 +83,7 @@ class Memphis:
             except Exception as e:
                 if "authorization violation" in str(e).lower():
                     try:
-                        if "localhost" in connection_opts['servers']: # for handling bad quality networks like port fwd
+                        if on_localhost: # for handling bad quality networks like port fwd
                             await asyncio.sleep(1)
                         ping_connection_opts["user"] = self.username
                         ping_connection_opts["error_cb"] = error_cb
@@ -77,14 +95,66 @@ class Memphis:
                 else:
                     raise e
 
-        if "localhost" in connection_opts['servers']:
+        if on_localhost:
             await asyncio.sleep(1) # for handling bad quality networks like port fwd
 
-        return await broker.connect(**connection_opts)
+        return await broker.connect(**connection_opts,
+                                    disconnected_cb=self.__on_disconnected,
+                                    reconnected_cb=self.__on_reconnected,
+                                    closed_cb=self.__on_closed)
+
+    def add_connection_listener(self, listener):
+        """Registers a function that is called on connection state changes.
+        Args:
+            listener (callable): function or coroutine function called with "disconnected", "reconnected" or "closed".
+        """
+        self.connection_listeners.append(listener)
+
+    async def __notify_connection_listeners(self, state: str):
+        for listener in self.connection_listeners:
+            try:
+                res = listener(state)
+                if asyncio.iscoroutine(res):
+                    await res
+            except Exception as e:
+                print(MemphisError(f"connection listener failed: {e}"))
+
+    async def __on_disconnected(self):
+        if not self.is_connection_active:
+            return
+        self.is_connection_active = False
+        self.disconnections += 1
+        await self.__notify_connection_listeners("disconnected")
+
+    async def __on_reconnected(self):
+        self.is_connection_active = True
+        await self.__notify_connection_listeners("reconnected")
+
+    async def __on_closed(self):
+        if self.is_connection_closed:
+            return
+        self.is_connection_active = False
+        self.is_connection_closed = True
+        await self.__notify_connection_listeners("closed")
+
+    async def wait_for_connection(self, timeout_sec: float) -> bool:
+        """Waits for a lost connection to be re-established.
+        Args:
+            timeout_sec (float): max time in seconds to wait.
+        Returns:
+            bool: whether the connection is active.
+        """
+        interval_sec = min(0.05, timeout_sec)
+        deadline = asyncio.get_event_loop().time() + timeout_sec
+        while not self.is_connection_active and not self.is_connection_closed:
+            if asyncio.get_event_loop().time() >= deadline:
+                break
+            await asyncio.sleep(interval_sec)
+        return self.is_connection_active
 
     async def connect(
         self,
-        host: str,
+        host: Union[str, list],
         username: str,
         account_id: int = 1,
         connection_token: str = "",
@@ -97,10 +167,12 @@ class Memphis:
         cert_file: str = "",
         key_file: str = "",
         ca_file: str = "",
+        probe_servers: bool = True,
+        probe_timeout_ms: int = DEFAULT_PROBE_TIMEOUT_MS,
     ):
         """Creates connection with Memphis.
         Args:
-            host (str): memphis host.
+            host (str | list): memphis host, or a list of the hosts of a cluster's nodes, each optionally with a ":port".
             username (str): user of type root/application.
             account_id (int): You can find it on the profile page in the Memphis UI. This field should be sent only on the cloud version of Memphis, otherwise it will be ignored
             connection_token (str): connection token.
@@ -113,8 +185,13 @@ class Memphis:
             key_file (string): path to tls key file.
             cert_file (string): path to tls cert file.
             ca_file (string): path to tls ca file.
+            probe_servers (bool, optional): with several hosts, measure the round trip to each of them and connect to the closest, spreading connections over equally close ones. The others are failed over to in order of their round trip. Defaults to True.
+            probe_timeout_ms (int, optional): how long a host has to accept a probe. Defaults to 500.
         """
-        self.host = self.__normalize_host(host)
+        import uuid # pylint: disable=import-outside-toplevel
+
+        servers = parse_servers(host, port)
+        self.host = servers[0][0]
         self.username = username
         self.account_id = account_id
         self.connection_token = connection_token
@@ -126,6 +203,8 @@ class Memphis:
         self.timeout_ms = timeout_ms
         self.connection_id = str(uuid.uuid4())
         try:
+            if probe_servers and len(servers) > 1:
+                servers = await self.__rank_servers(servers, probe_timeout_ms)
             if self.connection_token != "" and self.password != "":
                 raise MemphisConnectError(
                     "You have to connect with one of the following methods: connection token / password")
@@ -134,7 +213,9 @@ class Memphis:
                     "You have to connect with one of the following methods: connection token / password")
 
             connection_opts = {
-                "servers": self.host + ":" + str(self.port),
+                "servers": [server_host + ":" + str(server_port) for server_host, server_port in servers],
+                # fail over in the order the servers were ranked in
+                "dont_randomize": True,
                 "allow_reconnect": self.reconnect,
                 "reconnect_time_wait": self.reconnect_interval_ms / 1000,
                 "connect_timeout": self.timeout_ms / 1000,
@@ -153,73 +234,276 @@ class Memphis:
                 ssl_ctx.load_verify_locations(ca_file)
                 ssl_ctx.load_cert_chain(certfile=cert_file, keyfile=key_file)
                 connection_opts["tls"] = ssl_ctx
-                connection_opts["tls_hostname"] = self.host
+                if len(servers) == 1:
+                    connection_opts["tls_hostname"] = self.host
             if self.connection_token != "":
                 connection_opts["token"] = self.connection_token
             else:
                 connection_opts["user"] = self.username + "$" + str(self.account_id)
                 connection_opts["password"] = self.password
 
-            self.broker_manager = await self.get_broker_manager_connection(connection_opts)
+            with start_span("memphis.connect", {"memphis.host": self.host}):
+                self.broker_manager = await self.get_broker_manager_connection(connection_opts)
             self.broker_connection = self.broker_manager.jetstream()
             self.is_connection_active = True
+            self.is_connection_closed = False
+            await self.listen_for_sdk_clients_updates()
         except Exception as e:
             raise MemphisError(str(e))
 
+    async def __rank_servers(self, servers, probe_timeout_ms):
+        import uuid # pylint: disable=import-outside-toplevel
+
+        with start_span("memphis.probe_servers", {"memphis.servers": len(servers)}):
+            servers = await rank_servers(servers, uuid.UUID(self.connection_id).int, probe_timeout_ms)
+        self.host = servers[0][0]
+        return servers
+
     async def close(self):
         """Close Memphis connection."""
         try:
-            if self.is_connection_active:
+            if self.broker_manager is not None and not self.is_connection_closed:
+                self.is_connection_closed = True
+                # subscriptions go away with the connection, only the
+                # tasks reading from them have to be stopped
+                self.scheduler.cancel_all()
                 await self.broker_manager.close()
                 self.connection_id = None
                 self.is_connection_active = False
-                keys_schema_updates_subs = self.schema_updates_subs.keys()
-                self.configuration_tasks.cancel()
-                for key in keys_schema_updates_subs:
-                    sub = self.schema_updates_subs.get(key)
-                    task = self.schema_tasks.get(key)
-                    if key in self.schema_updates_data:
-                        del self.schema_updates_data[key]
-                    if key in self.schema_updates_subs:
-                        del self.schema_updates_subs[key]
-                    if key in self.producers_per_station:
-                        del self.producers_per_station[key]
-                    if key in self.schema_tasks:
-                        del self.schema_tasks[key]
-                    if task is not None:
-                        task.cancel()
-                    if sub is not None:
-                        await sub.unsubscribe()
-                if self.update_configurations_sub is not None:
-                    await self.update_configurations_sub.unsubscribe()
+                self.schema_updates_data.clear()
+                self.schema_updates_subs.clear()
+                self.producers_per_station.clear()
+                self.schema_tasks.clear()
+                self.update_configurations_sub = None
+                self.configuration_tasks = None
                 self.producers_map.clear()
-                for consumer in self.consumers_map:
+                for consumer in self.consumers_map.values():
                     consumer.dls_messages.clear()
                 self.consumers_map.clear()
         except Exception:
             return
 
+    async def listen_for_sdk_clients_updates(self):
+        self.update_configurations_sub = await self.broker_manager.subscribe("$memphis_sdk_clients_updates")
+        self.configuration_tasks = self.scheduler.spawn(
+            "sdk_clients_updates", self.get_sdk_clients_updates(self.update_configurations_sub.messages)
+        )
+
+    async def get_sdk_clients_updates(self, iterable):
+        async for msg in iterable:
+            message = json.loads(msg.data.decode("utf-8"))
+            if message["type"] == "send_notification":
+                self.cluster_configurations[message["type"]] = message["update"]
+            elif message["type"] == "schemaverse_to_dls":
+                self.station_schemaverse_to_dls[get_internal_name(message["station_name"])] = message["update"]
+
+    def reset_station_schema(self, internal_station_name: str):
+        """Drops the station's cached validator, the next validation compiles the current schema."""
+        self.json_schemas.pop(internal_station_name, None)
+        self.proto_msgs.pop(internal_station_name, None)
+        self.graphql_schemas.pop(internal_station_name, None)
+
+    def get_validator(self, internal_station_name: str):
+        """Returns the validator of a station, compiling it on first use, or None if it has no schema.
+
+        Validation is skipped, with a warning, when the library validating
+        the schema type is not installed.
+        Raises:
+            MemphisSchemaError: the schema can not be compiled.
+        """
+        schema_update = self.schema_updates_data.get(internal_station_name)
+        if not schema_update:
+            return None
+        schema_type = schema_update.get("type", "")
+        if schema_type == JSON:
+            validators = self.json_schemas
+        elif schema_type == PROTOBUF:
+            validators = self.proto_msgs
+        elif schema_type == GRAPHQL:
+            validators = self.graphql_schemas
+        else:
+            return None
+        if internal_station_name not in validators:
+            try:
+                validators[internal_station_name] = compile_validator(schema_update)
+            except MissingValidatorError as e:
+                warn_missing_validator(e)
+                validators[internal_station_name] = None
+        return validators[internal_station_name]
+
+    def validate_batch(self, internal_station_name: str, messages):
+        """Validates a batch of messages against the station's schema.
+        Args:
+            internal_station_name (str): internal name of the station.
+            messages (list): payloads to validate.
+        Returns:
+            list: the validation error for every invalid message and None for every valid one.
+        """
+        validator = self.get_validator(internal_station_name)
+        if validator is None:
+            return [None] * len(messages)
+        errors = []
+        for message in messages:
+            try:
+                validator(message)
+                errors.append(None)
+            except MemphisSchemaError as e:
+                errors.append(e)
+        return errors
+
+    async def send_msg_to_dls(self, internal_station_name: str, producer_name: str, message, headers, error):
+        """Sends a message that failed schema validation to the station's dead-letter station."""
+        if not self.station_schemaverse_to_dls.get(internal_station_name, False):
+            return
+        if isinstance(message, dict):
+            message = json.dumps(message).encode("utf-8")
+        msg_to_send = {
+            "station_name": internal_station_name,
+            "producer": {
+                "name": producer_name,
+                "connection_id": self.connection_id,
+            },
+            "message": {
+                "data": bytes(message).hex(),
+                "headers": dict(headers) if headers is not None else {},
+            },
+            "validation_error": str(error),
+        }
+        await self.broker_manager.publish(
+            "$memphis_schemaverse_dls", json.dumps(msg_to_send).encode("utf-8")
+        )
+
+    async def start_listen_for_schema_updates(self, internal_station_name: str, schema_update_data):
+        self.schema_updates_data[internal_station_name] = schema_update_data
+        self.reset_station_schema(internal_station_name)
+
+        if internal_station_name in self.schema_updates_subs:
+            self.producers_per_station[internal_station_name] += 1
+            return
+
+        sub = await self.broker_manager.subscribe("$memphis_schema_updates_" + internal_station_name)
+        self.producers_per_station[internal_station_name] = 1
+        self.schema_updates_subs[internal_station_name] = sub
+        self.schema_tasks[internal_station_name] = self.scheduler.spawn(
+            "schema_updates_" + internal_station_name,
+            self.get_msg_schema_updates(internal_station_name, sub.messages)
+        )
+
+    async def stop_listen_for_schema_updates(self, internal_station_name: str):
+        if internal_station_name not in self.schema_updates_subs:
+            return
+        self.producers_per_station[internal_station_name] -= 1
+        if self.producers_per_station[internal_station_name] > 0:
+            return
+        sub = self.schema_updates_subs.pop(internal_station_name)
+        self.schema_tasks.pop(internal_station_name, None)
+        del self.producers_per_station[internal_station_name]
+        self.schema_updates_data.pop(internal_station_name, None)
+        self.reset_station_schema(internal_station_name)
+        self.scheduler.cancel("schema_updates_" + internal_station_name)
+        await sub.unsubscribe()
+
+    async def get_msg_schema_updates(self, internal_station_name: str, iterable):
+        async for msg in iterable:
+            message = json.loads(msg.data.decode("utf-8"))
+            if message["init"]["schema_name"] == "":
+                data = {}
+            else:
+                data = message["init"]
+            self.schema_updates_data[internal_station_name] = data
+            self.reset_station_schema(internal_station_name)
+
+    async def __get_next_stored_msg(self, internal_station_name: str, seq: int):
+        """Returns the sequence and store time of the first message at or after seq, or None."""
+        req = {"seq": seq, "next_by_subj": internal_station_name + ".final"}
+        res = await self.broker_manager.request(
+            "$JS.API.STREAM.MSG.GET." + internal_station_name, json.dumps(req).encode("utf-8"), timeout=5
+        )
+        res = json.loads(res.data.decode("utf-8"))
+        if "error" in res:
+            if res["error"].get("code") == 404:
+                return None
+            raise MemphisError(res["error"].get("description", "Failed getting message"))
+        return res["message"]["seq"], parse_rfc3339(res["message"]["time"])
+
+    async def get_sequence_at_time(self, station_name: str, timestamp) -> int:
+        """Finds the first message stored at or after a point in time.
+
+        Binary searches the station's sequences, which are stored in time order.
+        Args:
+            station_name (str): station name.
+            timestamp (datetime): naive datetimes are taken as local time.
+        Returns:
+            int: the sequence of the first message stored at or after timestamp,
+                or the sequence the next message will get if there is none.
+        """
+        try:
+            if not self.is_connection_active:
+                raise MemphisError("Connection is dead")
+            internal_station_name = get_internal_name(station_name)
+            stream_info = await self.broker_connection.stream_info(internal_station_name)
+            target = timestamp.timestamp()
+            lo = max(stream_info.state.first_seq, 1)
+            hi = stream_info.state.last_seq + 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                found = await self.__get_next_stored_msg(internal_station_name, mid)
+                if found is None:
+                    hi = mid
+                    continue
+                seq, stored_at = found
+                if stored_at.timestamp() < target:
+                    lo = seq + 1
+                else:
+                    hi = mid
+            found = await self.__get_next_stored_msg(internal_station_name, lo)
+            if found is None:
+                return stream_info.state.last_seq + 1
+            return found[0]
+        except Exception as e:
+            raise MemphisError(str(e)) from e
+
+    async def fetch_station_schema(self, station_name: str):
+        """Fetches and compiles the schema attached to a station.
+
+        Consumers are not told about the station's schema, so the schema
+        is fetched through a short-lived producer. Later schema changes are
+        picked up from the schema update notifications.
+        """
+        internal_station_name = get_internal_name(station_name)
+        if internal_station_name in self.schema_updates_subs:
+            self.producers_per_station[internal_station_name] += 1
+        else:
+            producer_name = self.__generate_random_suffix("schema-fetcher")
+            producer = await self.producer(station_name=station_name, producer_name=producer_name)
+            # keep listening for updates after the producer is gone
+            self.producers_per_station[internal_station_name] += 1
+            await producer.destroy()
+        # the caller validates, so a schema that does not compile fails now
+        self.get_validator(internal_station_name)
+
     def __generate_random_suffix(self, name: str) -> str:
         return name + "_" + random_bytes(8)
 
-    def __normalize_host(self, host):
-        if host.startswith("http://"):
-            return host.split("http://")[1]
-        if host.startswith("https://"):
-            return host.split("https://")[1]
-        return host
-
     async def producer(
         self,
         station_name: str,
         producer_name: str,
         generate_random_suffix: bool = False,
+        compression: Union[str, None] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        stamp_produce_time: bool = False,
+        rate_limiter=None,
     ):
         """Creates a producer.
         Args:
             station_name (str): station name to produce messages into.
             producer_name (str): name for the producer.
             generate_random_suffix (bool): false by default, if true concatenate a random suffix to producer's name
+            compression (str, optional): compress payloads with gzip, lz4 or zstd. Falls back to gzip when the codec is not installed. Defaults to None (no compression).
+            compression_threshold (int, optional): only payloads of at least this many bytes are compressed. Defaults to 1024.
+            stamp_produce_time (bool, optional): add a header with the produce time to every message, used to measure end-to-end latency. Defaults to False.
+            rate_limiter (RateLimiter, optional): throttles the producer's publishes, and backs off when the broker is slow or overloaded. Defaults to None (no limit).
         Raises:
             Exception: _description_
         Returns:
@@ -242,18 +526,30 @@ class Memphis:
             create_producer_req_bytes = json.dumps(create_producer_req, indent=2).encode(
                 "utf-8"
             )
-            create_res = await self.broker_manager.request(
-                "$memphis_producer_creations", create_producer_req_bytes, timeout=5
-            )
+            with start_span("memphis.create_producer", {"memphis.station": station_name}):
+                create_res = await self.broker_manager.request(
+                    "$memphis_producer_creations", create_producer_req_bytes, timeout=5
+                )
             create_res = create_res.data.decode("utf-8")
             create_res = json.loads(create_res)
             if create_res["error"] != "":
                 raise MemphisError(create_res["error"])
 
             internal_station_name = get_internal_name(station_name)
-            producer = Producer(self, producer_name, station_name, real_name)
+            self.station_schemaverse_to_dls[internal_station_name] = create_res.get("schemaverse_to_dls", False)
+            await self.start_listen_for_schema_updates(internal_station_name,
+                                                       create_res.get("schema_update", {}))
+
+            producer = Producer(self, producer_name, station_name, real_name,
+                                compression=compression,
+                                compression_threshold=compression_threshold,
+                                stamp_produce_time=stamp_produce_time,
+                                rate_limiter=rate_limiter)
             map_key = internal_station_name + "_" + real_name
             self.producers_map[map_key] = producer
+            self.scheduler.every("producer_ping_" + map_key,
+                                 producer.ping_producer_interval_ms / 1000,
+                                 producer.ping)
             return producer
 
         except Exception as e:
@@ -329,9 +625,10 @@ class Memphis:
             create_consumer_req_bytes = json.dumps(create_consumer_req, indent=2).encode(
                 "utf-8"
             )
-            err_msg = await self.broker_manager.request(
-                "$memphis_consumer_creations", create_consumer_req_bytes, timeout=5
-            )
+            with start_span("memphis.create_consumer", {"memphis.station": station_name}):
+                err_msg = await self.broker_manager.request(
+                    "$memphis_consumer_creations", create_consumer_req_bytes, timeout=5
+                )
             err_msg = err_msg.data.decode("utf-8")
 
             if err_msg != "":
@@ -353,6 +650,9 @@ class Memphis:
                 last_messages=last_messages,
             )
             self.consumers_map[map_key] = consumer
+            self.scheduler.every("consumer_ping_" + map_key,
+                                 consumer.ping_consumer_interval_ms / 1000,
+                                 consumer.ping)
             return consumer
         except Exception as e:
             raise MemphisError(str(e)) from e
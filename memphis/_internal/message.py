@@ -1,9 +1,16 @@
 import json
 
+from .compression import decompress_payload
 from .exceptions import MemphisConnectError
+from .latency import PRODUCED_AT_HEADER
+from .tracing import start_span
 
 
 class Message:
+    # thousands of messages are created per fetch, slots make them
+    # smaller and faster to create than dict-backed objects
+    __slots__ = ("message", "connection", "cg_name")
+
     def __init__(self, message, connection, cg_name):
         self.message = message
         self.connection = connection
@@ -12,7 +19,9 @@ class Message:
     async def ack(self):
         """Ack a message is done processing."""
         try:
-            await self.message.ack()
+            # traced as a child of the span that produced the message
+            with start_span("memphis.ack", headers=self.message.headers):
+                await self.message.ack()
         except Exception as e:
             if (
                 "$memphis_pm_id" in self.message.headers
@@ -34,9 +43,16 @@ class Message:
             return
 
     def get_data(self):
-        """Receive the message."""
+        """Receive the message, decompressing it if the producer compressed it."""
+        data = self.get_raw_data()
+        if data is None:
+            return
+        return bytearray(decompress_payload(data, self.get_headers()))
+
+    def get_raw_data(self):
+        """Receive the message as it was stored, still compressed if the producer compressed it."""
         try:
-            return bytearray(self.message.data)
+            return self.message.data
         except Exception:
             return
 
@@ -53,3 +69,31 @@ class Message:
             return self.message.metadata.sequence.stream
         except Exception:
             return
+
+    def get_num_pending(self):
+        """Get the number of messages in the station that were not delivered to the consumer yet."""
+        try:
+            return self.message.metadata.num_pending
+        except Exception:
+            return
+
+    def get_num_delivered(self):
+        """Get the number of times the message was delivered, higher than 1 for redeliveries."""
+        try:
+            return self.message.metadata.num_delivered
+        except Exception:
+            return
+
+    def get_timestamp(self):
+        """Get the time the message was stored in the station."""
+        try:
+            return self.message.metadata.timestamp
+        except Exception:
+            return
+
+    def get_produced_at_ns(self):
+        """Get the produce time stamped by the producer, in nanoseconds since the epoch."""
+        try:
+            return int(self.message.headers[PRODUCED_AT_HEADER])
+        except Exception:
+            return
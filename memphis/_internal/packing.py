@@ -0,0 +1,91 @@
+import json
+import struct
+from collections import deque
+
+from .exceptions import MemphisError
+
+PACKED_COUNT_HEADER = "$memphis_packed_count"
+
+DEFAULT_PACK_MAX_BYTES = 256 * 1024
+DEFAULT_PACK_LINGER_MS = 100
+
+# each record is prefixed with its length
+_LENGTH = struct.Struct("<I")
+
+
+def encode_record(record) -> bytes:
+    """Returns the bytes of a record that is packed with others."""
+    if isinstance(record, (bytes, bytearray, memoryview)):
+        return record
+    if isinstance(record, dict):
+        return json.dumps(record).encode("utf-8")
+    if isinstance(record, str):
+        return record.encode("utf-8")
+    raise MemphisError(f"Records of type {type(record).__name__} can not be packed")
+
+
+def pack_records(records) -> bytearray:
+    """Packs encoded records into a single payload."""
+    data = bytearray()
+    for record in records:
+        data += _LENGTH.pack(len(record))
+        data += record
+    return data
+
+
+def get_packed_count(headers):
+    """Returns the number of records packed in a message, or None for single records."""
+    if not headers or PACKED_COUNT_HEADER not in headers:
+        return None
+    return int(headers[PACKED_COUNT_HEADER])
+
+
+def unpack_records(data, count: int):
+    """
+    Returns the count records packed into data.
+    Raises:
+        MemphisError: data does not hold count records.
+    """
+    records = []
+    offset = 0
+    end = len(data)
+    while offset < end:
+        if offset + _LENGTH.size > end:
+            break
+        length = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        records.append(bytearray(data[offset:offset + length]))
+        offset += length
+    if offset != end or len(records) != count:
+        raise MemphisError(f"Packed message is corrupt, expected {count} records and found {len(records)}")
+    return records
+
+
+class PackProgress:
+    """
+    Tracks which records of a packed message are still to be handled,
+    by their index in the message. Records are emitted in order, but
+    the ones dropped (by schema validation or a batch transform) are
+    handled before the records in front of them are emitted.
+    """
+
+    __slots__ = ("count", "pending")
+
+    def __init__(self, count: int, first: int = 0):
+        self.count = count
+        self.pending = deque(range(first, count))
+
+    def done(self, position: int = 0) -> bool:
+        """
+        Marks the record at position among the pending ones as handled.
+        Returns True when no record is left.
+        """
+        if position == 0:
+            self.pending.popleft()
+        else:
+            del self.pending[position]
+        return len(self.pending) == 0
+
+    def next_index(self) -> int:
+        """Returns the index of the first record that is not handled yet."""
+        return self.pending[0] if len(self.pending) > 0 else self.count
@@ -0,0 +1,27 @@
+import concurrent.futures
+import os
+import threading
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_process_pool(processes: int = None) -> concurrent.futures.ProcessPoolExecutor:
+    """Get the process pool of that size shared by every input in this process, creating it on first use.
+
+    Pools are never shut down by their users, other partitions may still
+    be submitting to them; their processes exit with the interpreter.
+    Args:
+        processes (int): number of processes. Defaults to the number of CPUs.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    with _shared_pools_lock:
+        pool = _shared_pools.get(processes)
+        if pool is None:
+            import multiprocessing # pylint: disable=import-outside-toplevel
+            # forking the multi-threaded worker process is not safe
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                          mp_context=multiprocessing.get_context("spawn"))
+            _shared_pools[processes] = pool
+        return pool
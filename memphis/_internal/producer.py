@@ -2,18 +2,32 @@ from __future__ import annotations
 
 import asyncio
 import json
+import time
 from typing import Union
 
-from .exceptions import MemphisError
+from .chunking import CHUNK_COUNT_HEADER, CHUNK_ID_HEADER, CHUNK_INDEX_HEADER, max_chunk_size, split_payload
+from .compression import COMPRESSION_HEADER, DEFAULT_COMPRESSION_THRESHOLD, compress_payload, resolve_codec
+from .exceptions import MemphisError, MemphisSchemaError
 from .headers import Headers
-from .utils import get_internal_name
+from .latency import PRODUCED_AT_HEADER
+from .packing import PACKED_COUNT_HEADER, encode_record, pack_records
+from .tracing import inject as inject_trace_context, start_span
+from .utils import default_error_handler, get_internal_name, random_bytes
 
 schemaverse_fail_alert_type = "schema_validation_fail_alert"
 
 
 class Producer:
     def __init__(
-        self, connection, producer_name: str, station_name: str, real_name: str
+        self,
+        connection,
+        producer_name: str,
+        station_name: str,
+        real_name: str,
+        compression: Union[str, None] = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        stamp_produce_time: bool = False,
+        rate_limiter=None,
     ):
         self.connection = connection
         self.producer_name = producer_name.lower()
@@ -21,6 +35,17 @@ class Producer:
         self.internal_station_name = get_internal_name(self.station_name)
         self.loop = asyncio.get_running_loop()
         self.real_name = real_name
+        self.ping_producer_interval_ms = 30000
+        self.codec = resolve_codec(compression)
+        self.compression_threshold = compression_threshold
+        self.stamp_produce_time = stamp_produce_time
+        self.rate_limiter = rate_limiter
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.destroy()
 
     async def produce(
         self,
@@ -39,32 +64,167 @@ class Producer:
             Exception: _description_
         """
         try:
-            memphis_headers = {
-                "$memphis_producedBy": self.producer_name,
-                "$memphis_connectionId": self.connection.connection_id,
-            }
+            with start_span("memphis.produce", {"memphis.station": self.station_name}) as span:
+                headers = self.__build_headers(headers, msg_id)
+                await self.__validate(message, headers)
+
+                if isinstance(message, dict):
+                    message = json.dumps(message).encode("utf-8")
 
-            if msg_id is not None and msg_id != "":
-                memphis_headers["msg-id"] = msg_id
+                if isinstance(message, (bytes, bytearray)):
+                    span.set_attribute("memphis.bytes", len(message))
+                await self.__send(message, ack_wait_sec, headers)
+        except MemphisSchemaError as e:
+            raise e
+        except Exception as e:
+            raise self.__produce_error(e) from e
+
+    async def produce_records(
+        self,
+        records,
+        ack_wait_sec: int = 15,
+        headers: Union[Headers, None] = None,
+        msg_id: Union[str, None] = None,
+    ):
+        """Produces several records packed into a single message, which MemphisInput unpacks.
+        Args:
+            records (list): records to send into the station - bytearray/dict/string, validated one by one against the station's schema
+            ack_wait_sec (int, optional): max time in seconds to wait for an ack from memphis. Defaults to 15.
+            headers (dict, optional): Message headers, defaults to {}.
+            msg_id (string, optional): Attach msg-id header to the message in order to achieve idempotency
+        Raises:
+            MemphisSchemaError: records failed schema validation, the valid ones were still sent.
+        """
+        try:
+            with start_span("memphis.produce", {"memphis.station": self.station_name}) as span:
+                headers = self.__build_headers(headers, msg_id)
+                encoded = []
+                schema_error = None
+                for record in records:
+                    try:
+                        await self.__validate(record, headers)
+                    except MemphisSchemaError as e:
+                        schema_error = e
+                        continue
+                    encoded.append(encode_record(record))
 
-            if headers is not None:
-                headers = headers.headers
-                headers.update(memphis_headers)
-            else:
-                headers = memphis_headers
+                if len(encoded) > 0:
+                    headers[PACKED_COUNT_HEADER] = str(len(encoded))
+                    message = pack_records(encoded)
+                    span.set_attribute("memphis.records", len(encoded))
+                    span.set_attribute("memphis.bytes", len(message))
+                    await self.__send(message, ack_wait_sec, headers)
+        except MemphisSchemaError as e:
+            raise e
+        except Exception as e:
+            raise self.__produce_error(e) from e
+        if schema_error is not None:
+            raise schema_error
 
+    def __build_headers(self, headers, msg_id):
+        memphis_headers = {
+            "$memphis_producedBy": self.producer_name,
+            "$memphis_connectionId": self.connection.connection_id,
+        }
+
+        if msg_id is not None and msg_id != "":
+            memphis_headers["msg-id"] = msg_id
+
+        if self.stamp_produce_time:
+            memphis_headers[PRODUCED_AT_HEADER] = str(time.time_ns())
+
+        # carries the produce span's context to the consumers
+        inject_trace_context(memphis_headers)
+
+        if headers is not None:
+            headers = headers.headers
+            headers.update(memphis_headers)
+            return headers
+        return memphis_headers
+
+    async def __validate(self, message, headers):
+        validator = self.connection.get_validator(self.internal_station_name)
+        if validator is None:
+            return
+        try:
+            validator(message)
+        except MemphisSchemaError as e:
+            await self.connection.send_msg_to_dls(self.internal_station_name, self.producer_name,
+                                                  message, headers, e)
+            raise e
+
+    async def __send(self, message, ack_wait_sec, headers):
+        """Compresses a message and publishes it, in chunks if it is too large."""
+        if self.codec is not None and isinstance(message, (bytes, bytearray)):
+            message, codec_name = compress_payload(self.codec, message, self.compression_threshold)
+            if codec_name is not None:
+                headers[COMPRESSION_HEADER] = codec_name
+
+        chunk_size = max_chunk_size(self.connection.broker_manager.max_payload, headers)
+        if isinstance(message, (bytes, bytearray)) and len(message) > chunk_size:
+            await self.__produce_chunks(message, chunk_size, ack_wait_sec, headers)
+            return
+
+        await self.__publish(message, ack_wait_sec, headers)
+
+    def __produce_error(self, e):
+        # pylint: disable-next=no-member
+        if hasattr(e, "status_code") and e.status_code == "503":
+            if self.rate_limiter is not None:
+                self.rate_limiter.record_overload()
+            return MemphisError(
+                "Produce operation has failed, please check whether Station/Producer still exist"
+            )
+        return MemphisError(str(e))
+
+    async def __produce_chunks(self, message, chunk_size, ack_wait_sec, headers):
+        """
+        Publishes a message larger than the broker's max payload as a
+        series of chunks, which MemphisInput reassembles. Each chunk gets
+        its own msg-id so that deduplication still applies per chunk.
+        """
+        chunks = split_payload(message, chunk_size)
+        chunk_id = random_bytes(16)
+        msg_id = headers.get("msg-id")
+        for index, chunk in enumerate(chunks):
+            chunk_headers = dict(headers)
+            chunk_headers[CHUNK_ID_HEADER] = chunk_id
+            chunk_headers[CHUNK_INDEX_HEADER] = str(index)
+            chunk_headers[CHUNK_COUNT_HEADER] = str(len(chunks))
+            if msg_id is not None:
+                chunk_headers["msg-id"] = f"{msg_id}-{index}"
+            await self.__publish(bytes(chunk), ack_wait_sec, chunk_headers)
+
+    async def __publish(self, message, ack_wait_sec, headers):
+        if self.rate_limiter is None:
             await self.connection.broker_connection.publish(
                 self.internal_station_name + ".final",
                 message,
                 timeout=ack_wait_sec,
                 headers=headers,
             )
-        except Exception as e: # pylint: disable-next=no-member
-            if hasattr(e, "status_code") and e.status_code == "503":
-                raise MemphisError(
-                    "Produce operation has failed, please check whether Station/Producer still exist"
-                )
-            raise MemphisError(str(e)) from e
+            return
+
+        size = len(message) if isinstance(message, (bytes, bytearray, str)) else 0
+        await self.rate_limiter.acquire(size)
+        published_at = time.monotonic()
+        await self.connection.broker_connection.publish(
+            self.internal_station_name + ".final",
+            message,
+            timeout=ack_wait_sec,
+            headers=headers,
+        )
+        self.rate_limiter.record_ack_latency(time.monotonic() - published_at)
+
+    async def ping(self):
+        """Checks that the producer's station still exists."""
+        if not self.connection.is_connection_active:
+            return
+        try:
+            await self.connection.broker_connection.stream_info(self.internal_station_name)
+        except Exception as e:
+            if "not found" in str(e).lower():
+                default_error_handler(MemphisError("station was not found"))
 
     async def destroy(self):
         """Destroy the producer."""
@@ -86,8 +246,10 @@ class Producer:
                 raise Exception(error)
 
             internal_station_name = get_internal_name(self.station_name)
+            await self.connection.stop_listen_for_schema_updates(internal_station_name)
 
             map_key = internal_station_name + "_" + self.real_name
+            self.connection.scheduler.cancel("producer_ping_" + map_key)
             del self.connection.producers_map[map_key]
 
         except Exception as e:
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+from .exceptions import MemphisError
+
+DEFAULT_TARGET_ACK_LATENCY_MS = 500
+
+# the limits are never throttled below this fraction of their configured value
+_MIN_FACTOR = 1 / 64
+_INCREASE_STEP = 0.05
+_INCREASE_INTERVAL_SEC = 1
+
+
+class TokenBucket:
+    """
+    Token bucket that holds up to one second of tokens. Reservations may
+    take more tokens than available, the bucket then goes into debt and
+    later callers wait for it to be paid back, so requests larger than
+    the bucket still go through at the configured rate.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated_at = time.monotonic()
+
+    def reserve(self, amount: float, factor: float = 1.0) -> float:
+        """Takes amount tokens and returns how long to wait before using them."""
+        rate = self.rate * factor
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated_at) * rate)
+        self._updated_at = now
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / rate
+
+
+class RateLimiter:
+    """
+    Limits publishes to msgs_per_sec messages and bytes_per_sec bytes.
+
+    The limits back off while the broker is struggling: they are halved
+    when a publish ack takes longer than target_ack_latency_ms or the
+    broker rejects a publish, at most once per target latency, and grow
+    back by 5% of the configured limits every second of healthy
+    publishes.
+
+    The limiter can be shared by producers on different threads.
+    """
+
+    def __init__(self, msgs_per_sec: float = None, bytes_per_sec: float = None,
+                 target_ack_latency_ms: float = DEFAULT_TARGET_ACK_LATENCY_MS):
+        if msgs_per_sec is not None and msgs_per_sec <= 0 or bytes_per_sec is not None and bytes_per_sec <= 0:
+            raise MemphisError("Rate limits have to be positive")
+        self.msgs_per_sec = msgs_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.target_ack_latency_ms = target_ack_latency_ms
+        self.factor = 1.0
+        self._msgs = TokenBucket(msgs_per_sec) if msgs_per_sec is not None else None
+        self._bytes = TokenBucket(bytes_per_sec) if bytes_per_sec is not None else None
+        self._adjusted_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self, size: int):
+        """Waits until a publish of size bytes fits in the limits."""
+        with self._lock:
+            delay = 0.0
+            if self._msgs is not None:
+                delay = self._msgs.reserve(1, self.factor)
+            if self._bytes is not None:
+                delay = max(delay, self._bytes.reserve(size, self.factor))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_ack_latency(self, latency_sec: float):
+        now = time.monotonic()
+        with self._lock:
+            if self.target_ack_latency_ms is not None and latency_sec * 1000 > self.target_ack_latency_ms:
+                self._back_off(now)
+            elif self.factor < 1 and now - self._adjusted_at >= _INCREASE_INTERVAL_SEC:
+                self.factor = min(self.factor + _INCREASE_STEP, 1.0)
+                self._adjusted_at = now
+
+    def record_overload(self):
+        """Records a publish the broker rejected."""
+        with self._lock:
+            self._back_off(time.monotonic())
+
+    def _back_off(self, now):
+        # one slow period usually slows down several in-flight publishes,
+        # they should only count once
+        interval_sec = (self.target_ack_latency_ms or DEFAULT_TARGET_ACK_LATENCY_MS) / 1000
+        if now - self._adjusted_at < interval_sec:
+            return
+        self.factor = max(self.factor / 2, _MIN_FACTOR)
+        self._adjusted_at = now
+
+
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(group: str, msgs_per_sec: float = None, bytes_per_sec: float = None,
+                            target_ack_latency_ms: float = DEFAULT_TARGET_ACK_LATENCY_MS) -> RateLimiter:
+    """Get the rate limiter shared by every producer of a group in this process.
+    Raises:
+        MemphisError: the group already exists with other limits.
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(group)
+        if limiter is None:
+            limiter = RateLimiter(msgs_per_sec, bytes_per_sec, target_ack_latency_ms)
+            _shared_limiters[group] = limiter
+        elif (limiter.msgs_per_sec, limiter.bytes_per_sec, limiter.target_ack_latency_ms) != \
+                (msgs_per_sec, bytes_per_sec, target_ack_latency_ms):
+            raise MemphisError(f"Rate limit group {group} is already configured with other limits")
+        return limiter
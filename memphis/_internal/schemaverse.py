@@ -0,0 +1,144 @@
+import json
+import warnings
+
+from .exceptions import MemphisSchemaError
+
+JSON = "json"
+PROTOBUF = "protobuf"
+GRAPHQL = "graphql"
+
+_warned_missing = set()
+
+
+class MissingValidatorError(MemphisSchemaError):
+    """The library validating a schema type is not installed."""
+
+
+def warn_missing_validator(error: MissingValidatorError):
+    """Warns, once per message, that validation is skipped because a library is missing."""
+    if error.message in _warned_missing:
+        return
+    _warned_missing.add(error.message)
+    warnings.warn(f"memphis: {error.message}, skipping schema validation")
+
+
+def _compile_json(schema_content):
+    schema = json.loads(schema_content)
+    try:
+        import fastjsonschema # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        fastjsonschema = None
+
+    if fastjsonschema is not None:
+        compiled = fastjsonschema.compile(schema)
+
+        def validate_compiled(obj):
+            try:
+                compiled(obj)
+            except fastjsonschema.JsonSchemaException as e:
+                raise MemphisSchemaError(f"Schema validation has failed: {e.message}")
+        return validate_compiled
+
+    try:
+        import jsonschema # pylint: disable=import-outside-toplevel,import-error
+    except ImportError:
+        raise MissingValidatorError("Validating json schemas requires fastjsonschema or jsonschema to be installed")
+
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    validator = validator_class(schema)
+
+    def validate(obj):
+        error = jsonschema.exceptions.best_match(validator.iter_errors(obj))
+        if error is not None:
+            raise MemphisSchemaError(f"Schema validation has failed: {error.message}")
+    return validate
+
+
+def _compile_protobuf(active_version):
+    try:
+        # pylint: disable-next=import-outside-toplevel,import-error
+        from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    except ImportError:
+        raise MissingValidatorError("Validating protobuf schemas requires protobuf to be installed")
+
+    desc_set = descriptor_pb2.FileDescriptorSet()
+    desc_set.ParseFromString(str.encode(active_version["descriptor"]))
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(desc_set.file[0])
+    pkg_name = desc_set.file[0].package
+    msg_name = active_version["message_struct_name"]
+    if pkg_name != "":
+        msg_name = pkg_name + "." + msg_name
+    meta = pool.FindMessageTypeByName(msg_name)
+    if hasattr(message_factory, "GetMessageClass"):
+        proto_class = message_factory.GetMessageClass(meta)
+    else:
+        proto_class = message_factory.MessageFactory(pool).GetPrototype(meta)
+
+    def validate(data):
+        try:
+            proto_class().ParseFromString(bytes(data))
+        except Exception as e:
+            raise MemphisSchemaError(f"Schema validation has failed: {e}")
+    return validate
+
+
+def _compile_graphql(schema_content):
+    try:
+        # pylint: disable-next=import-outside-toplevel,import-error
+        from graphql import build_schema, parse, validate as validate_document
+    except ImportError:
+        raise MissingValidatorError("Validating graphql schemas requires graphql-core to be installed")
+
+    schema = build_schema(schema_content)
+
+    def validate(data):
+        try:
+            document = parse(bytes(data).decode("utf-8"))
+        except Exception as e:
+            raise MemphisSchemaError(f"Schema validation has failed: {e}")
+        errors = validate_document(schema, document)
+        if len(errors) > 0:
+            raise MemphisSchemaError(f"Schema validation has failed: {errors[0].message}")
+    return validate
+
+
+def compile_validator(schema_update):
+    """Compile the validator for a station's active schema version.
+    Args:
+        schema_update (dict): schema update data as sent by the broker.
+    Returns:
+        A function that raises MemphisSchemaError for invalid messages,
+        or None if no schema is attached to the station.
+    Raises:
+        MissingValidatorError: the library validating the schema type is not installed.
+        MemphisSchemaError: the schema can not be compiled.
+    """
+    if not schema_update or schema_update.get("type", "") == "":
+        return None
+    schema_type = schema_update["type"]
+    active_version = schema_update["active_version"]
+    try:
+        if schema_type == JSON:
+            validate_obj = _compile_json(active_version["schema_content"])
+
+            def validate(message):
+                if isinstance(message, dict):
+                    obj = message
+                else:
+                    try:
+                        obj = json.loads(message)
+                    except Exception:
+                        raise MemphisSchemaError("Expecting Json format")
+                validate_obj(obj)
+            return validate
+        if schema_type == PROTOBUF:
+            return _compile_protobuf(active_version)
+        if schema_type == GRAPHQL:
+            return _compile_graphql(active_version["schema_content"])
+    except MemphisSchemaError as e:
+        raise e
+    except Exception as e:
+        raise MemphisSchemaError(f"Failed compiling {schema_type} schema: {e}") from e
+    raise MemphisSchemaError(f"Unsupported schema type {schema_type}")
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+DEFAULT_PROBE_TIMEOUT_MS = 500
+# servers whose round trip is within this factor (plus NEAR_EQUAL_MS)
+# of the fastest one are treated as equally close
+NEAR_EQUAL_FACTOR = 1.5
+NEAR_EQUAL_MS = 1.0
+
+
+def parse_servers(host, port: int):
+    """
+    Returns the (host, port) of each server in host, a hostname or a
+    list of them, each optionally with its own ":port".
+    """
+    hosts = [host] if isinstance(host, str) else list(host)
+    servers = []
+    for server in hosts:
+        for prefix in ("http://", "https://"):
+            if server.startswith(prefix):
+                server = server[len(prefix):]
+        name, sep, server_port = server.rpartition(":")
+        if sep and server_port.isdigit() and not name.endswith(":"):
+            servers.append((name, int(server_port)))
+        else:
+            servers.append((server, port))
+    return servers
+
+
+async def probe(host: str, port: int, timeout_sec: float):
+    """Returns how long opening a TCP connection to a server takes in seconds, or None if it failed."""
+    started = time.perf_counter()
+    try:
+        # IPv6 addresses are bracketed in server URLs only
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host.strip("[]"), port), timeout_sec)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    rtt = time.perf_counter() - started
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return rtt
+
+
+async def rank_servers(servers, spread_key: int = 0, timeout_ms: float = DEFAULT_PROBE_TIMEOUT_MS):
+    """
+    Probes servers concurrently and orders them closest first,
+    unreachable ones last. Servers about as close as the closest one are
+    rotated by spread_key, so connections with different keys (e.g.
+    connection ids) are spread over them instead of all picking one.
+    """
+    if len(servers) < 2:
+        return list(servers)
+    rtts = await asyncio.gather(*(probe(host, port, timeout_ms / 1000) for host, port in servers))
+    reachable = sorted((rtt, index) for index, rtt in enumerate(rtts) if rtt is not None)
+    unreachable = [servers[index] for index, rtt in enumerate(rtts) if rtt is None]
+    if len(reachable) == 0:
+        return list(servers)
+
+    limit = reachable[0][0] * NEAR_EQUAL_FACTOR + NEAR_EQUAL_MS / 1000
+    near = [servers[index] for rtt, index in reachable if rtt <= limit]
+    far = [servers[index] for rtt, index in reachable if rtt > limit]
+    shift = spread_key % len(near)
+    return near[shift:] + near[:shift] + far + unreachable
@@ -0,0 +1,174 @@
+import json
+import mmap
+import os
+import struct
+
+from .exceptions import MemphisError
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_SPILL_MAX_BYTES = 1024 * 1024 * 1024
+
+_SEGMENT_SUFFIX = ".spill"
+# a segment starts with the offset of its first unread record
+_HEADER = struct.Struct("<Q")
+# records are the length of the kind byte and data, the kind and the data;
+# segments are zero filled so a length of 0 marks the end of the records
+_RECORD = struct.Struct("<IB")
+
+_BYTES = 0
+_JSON = 1
+_STR = 2
+
+
+def _encode(item):
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return _BYTES, item
+    if isinstance(item, dict):
+        return _JSON, json.dumps(item).encode("utf-8")
+    if isinstance(item, str):
+        return _STR, item.encode("utf-8")
+    raise MemphisError(f"Items of type {type(item).__name__} can not be spilled")
+
+
+def _decode(kind, data):
+    if kind == _JSON:
+        return json.loads(bytes(data))
+    if kind == _STR:
+        return bytes(data).decode("utf-8")
+    return bytearray(data)
+
+
+class _Segment:
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, "wb") as f:
+                f.truncate(size)
+        with open(path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        self.size = len(self._map)
+        self.read_offset = max(_HEADER.unpack_from(self._map, 0)[0], _HEADER.size)
+        self.unread = 0
+        self.write_offset = self.read_offset
+        while self.write_offset + _RECORD.size <= self.size:
+            length = _RECORD.unpack_from(self._map, self.write_offset)[0]
+            if length == 0:
+                break
+            self.write_offset += 4 + length
+            self.unread += 1
+
+    def append(self, kind, data) -> bool:
+        end = self.write_offset + _RECORD.size + len(data)
+        if end > self.size:
+            return False
+        _RECORD.pack_into(self._map, self.write_offset, len(data) + 1, kind)
+        self._map[self.write_offset + _RECORD.size:end] = data
+        self.write_offset = end
+        self.unread += 1
+        return True
+
+    def read(self, limit):
+        """Returns up to limit of the unread items."""
+        items = []
+        offset = self.read_offset
+        while offset < self.write_offset and len(items) < limit:
+            length, kind = _RECORD.unpack_from(self._map, offset)
+            start = offset + _RECORD.size
+            offset = offset + 4 + length
+            items.append(_decode(kind, self._map[start:offset]))
+        return items
+
+    def commit(self, limit) -> int:
+        """Marks up to limit records as read and returns how many were."""
+        offset = self.read_offset
+        count = 0
+        while offset < self.write_offset and count < limit:
+            offset += 4 + _RECORD.unpack_from(self._map, offset)[0]
+            count += 1
+        self.read_offset = offset
+        self.unread -= count
+        _HEADER.pack_into(self._map, 0, offset)
+        return count
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+    def delete(self):
+        self._map.close()
+        os.remove(self.path)
+
+
+class SpillLog:
+    """
+    Append-only log of items that could not be published, kept in
+    memory-mapped segment files under directory.
+
+    Items are read back in order with read() and dropped with commit()
+    once they were published. The offset of the first unread record is
+    stored in each segment, so a log that was not fully drained is
+    picked up again by the next SpillLog on the same directory. Appending
+    fails with MemphisError once the segments would take more than
+    max_bytes.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+                 max_bytes: int = DEFAULT_SPILL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._segments = []
+        self._next_segment_id = 0
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(_SEGMENT_SUFFIX):
+                self._segments.append(_Segment(os.path.join(directory, name)))
+                self._next_segment_id = int(name[:-len(_SEGMENT_SUFFIX)]) + 1
+        while len(self._segments) > 0 and self._segments[0].unread == 0:
+            self._segments.pop(0).delete()
+
+    def __len__(self):
+        return sum(segment.unread for segment in self._segments)
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+    def append(self, item):
+        kind, data = _encode(item)
+        if len(self._segments) > 0 and self._segments[-1].append(kind, data):
+            return
+        size = max(self.segment_bytes, _HEADER.size + _RECORD.size + len(data))
+        if self.size + size > self.max_bytes:
+            raise MemphisError(f"Spill log {self.directory} is full ({self.max_bytes} bytes)")
+        path = os.path.join(self.directory, f"{self._next_segment_id:012d}{_SEGMENT_SUFFIX}")
+        self._next_segment_id += 1
+        segment = _Segment(path, size)
+        segment.append(kind, data)
+        self._segments.append(segment)
+
+    def read(self, limit: int):
+        """Returns up to limit of the oldest unread items."""
+        if len(self._segments) == 0:
+            return []
+        return self._segments[0].read(limit)
+
+    def commit(self, count: int):
+        """Drops the count oldest unread items, as returned by read()."""
+        while count > 0 and len(self._segments) > 0:
+            segment = self._segments[0]
+            count -= segment.commit(count)
+            if segment.unread == 0:
+                self._segments.pop(0).delete()
+
+    def flush(self):
+        for segment in self._segments:
+            segment.flush()
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
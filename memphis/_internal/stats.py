@@ -0,0 +1,99 @@
+import time
+
+
+class ConsumerStats:
+    """
+    Lag and throughput of a consumer, computed from the metadata of
+    fetched batches so that no extra requests are made to the broker.
+    """
+
+    def __init__(self):
+        self.fetched = 0
+        self.emitted = 0
+        self.redelivered = 0
+        self.filtered = 0
+        self.duplicates = 0
+        self.undecodable = 0
+        self.num_pending = 0
+        self._window_started = time.monotonic()
+        self._window_fetched = 0
+        self._window_emitted = 0
+        self._window_redelivered = 0
+        self._window_filtered = 0
+
+    def record_batch(self, batch):
+        """Records a fetched batch of messages."""
+        if len(batch) == 0:
+            return
+        redelivered = 0
+        for msg in batch:
+            num_delivered = msg.get_num_delivered()
+            if num_delivered is not None and num_delivered > 1:
+                redelivered += 1
+        self.fetched += len(batch)
+        self.redelivered += redelivered
+        self._window_fetched += len(batch)
+        self._window_redelivered += redelivered
+        # the last message of a batch knows how many messages are left after it
+        num_pending = batch[-1].get_num_pending()
+        if num_pending is not None:
+            self.num_pending = num_pending
+
+    def record_filtered(self, count: int):
+        """Records messages that were dropped before being decoded."""
+        self.filtered += count
+        self._window_filtered += count
+
+    def record_duplicates(self, count: int):
+        """Records messages that were dropped as duplicates."""
+        self.duplicates += count
+
+    def record_undecodable(self, count: int):
+        """Records messages that were dropped because they could not be decompressed."""
+        self.undecodable += count
+
+    def record_emitted(self, count: int = 1):
+        """Records messages that were handed to the flow."""
+        self.emitted += count
+        self._window_emitted += count
+
+    def report(self, buffered: int = 0, oldest_timestamp=None):
+        """
+        Returns the consumer's stats and starts a new rate window.
+
+        Args:
+            buffered (int): messages fetched but not emitted yet.
+            oldest_timestamp (datetime): store time of the oldest unprocessed message.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._window_started, 1e-9)
+        oldest_age_sec = 0.0
+        if oldest_timestamp is not None:
+            oldest_age_sec = max(time.time() - oldest_timestamp.timestamp(), 0.0)
+        redelivery_rate = 0.0
+        if self._window_fetched > 0:
+            redelivery_rate = self._window_redelivered / self._window_fetched
+
+        stats = {
+            "pending": self.num_pending,
+            "buffered": buffered,
+            "lag": self.num_pending + buffered,
+            "oldest_unprocessed_age_sec": oldest_age_sec,
+            "redelivery_rate": redelivery_rate,
+            "fetch_rate": self._window_fetched / elapsed,
+            "emit_rate": self._window_emitted / elapsed,
+            "filter_rate": self._window_filtered / elapsed,
+            "fetched": self.fetched,
+            "emitted": self.emitted,
+            "redelivered": self.redelivered,
+            "filtered": self.filtered,
+            "duplicates": self.duplicates,
+            "undecodable": self.undecodable,
+        }
+
+        self._window_started = now
+        self._window_fetched = 0
+        self._window_emitted = 0
+        self._window_redelivered = 0
+        self._window_filtered = 0
+        return stats
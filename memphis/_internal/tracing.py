@@ -0,0 +1,251 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+TRACEPARENT_HEADER = "traceparent"
+
+_exporter = None
+_current_span = contextvars.ContextVar("memphis_current_span", default=None)
+
+
+class SpanContext:
+    """Identifies a span across processes."""
+
+    __slots__ = ("trace_id", "span_id")
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+def parse_traceparent(value):
+    """Returns the SpanContext of a traceparent header, or None if it is malformed."""
+    parts = value.split("-") if isinstance(value, str) else ()
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        if int(parts[1], 16) == 0 or int(parts[2], 16) == 0:
+            return None
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+
+class Span:
+    """A timed operation with attributes, used as a context manager."""
+
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_span_id",
+                 "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, name: str, attributes: dict, parent: SpanContext = None):
+        self.name = name
+        self.attributes = attributes
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_span_id = parent.span_id
+        else:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_span_id = None
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {"name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent_span_id,
+                "start_ns": self.start_ns,
+                "end_ns": self.end_ns,
+                "attributes": self.attributes,
+                "error": self.error}
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        start = getattr(_exporter, "start", None)
+        if start is not None:
+            # before the span becomes current, so children and injected
+            # traceparents see the ids the exporter gave it
+            start(self)
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(self)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def set_exporter(exporter):
+    """
+    Turns tracing on with an exporter, or off with None. Spans are
+    passed to the exporter's export() method as they end, and to its
+    start() method, if it has one, as they start.
+    """
+    global _exporter # pylint: disable=global-statement
+    _exporter = exporter
+
+
+def is_enabled() -> bool:
+    return _exporter is not None
+
+
+def start_span(name: str, attributes: dict = None, headers: dict = None):
+    """
+    Returns a span to use as a context manager. Its parent is the span
+    whose context is in the traceparent of headers if given, the current
+    span otherwise.
+    """
+    if _exporter is None:
+        return _NOOP_SPAN
+    parent = None
+    if headers is not None and TRACEPARENT_HEADER in headers:
+        parent = parse_traceparent(headers[TRACEPARENT_HEADER])
+    if parent is None:
+        current = _current_span.get()
+        if current is not None:
+            parent = current.context
+    return Span(name, dict(attributes) if attributes is not None else {}, parent)
+
+
+def inject(headers: dict):
+    """Adds the traceparent of the current span to message headers."""
+    if _exporter is None:
+        return
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.context.traceparent
+
+
+class InMemoryExporter:
+    """Keeps the ended spans in a list, e.g. for tests and notebooks."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class FileExporter:
+    """Appends the ended spans to a file as JSON lines."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8") # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetryExporter:
+    """
+    Re-emits the spans through OpenTelemetry, which needs the
+    opentelemetry-api package and a configured tracer provider.
+
+    Each span is started as an OpenTelemetry span when it starts, as a
+    child of its Memphis parent, or of the current OpenTelemetry span for
+    root spans, and takes over the trace and span ids OpenTelemetry
+    assigns. Children and the traceparent headers of produced messages
+    therefore refer to ids that are exported, and traces join up across
+    producers and consumers.
+    """
+
+    def __init__(self, tracer_provider=None):
+        from opentelemetry import trace # pylint: disable=import-outside-toplevel,import-error
+        self._trace = trace
+        self._tracer = trace.get_tracer("memphis", tracer_provider=tracer_provider)
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def start(self, span):
+        otel_span = self._start(span)
+        context = otel_span.get_span_context()
+        parent_span_id = int(span.parent_span_id, 16) if span.parent_span_id is not None else 0
+        if context.is_valid and context.span_id != parent_span_id:
+            # without an SDK, the API does not create spans of its own
+            span.trace_id = format(context.trace_id, "032x")
+            span.span_id = format(context.span_id, "016x")
+            parent = getattr(otel_span, "parent", None)
+            if parent is not None:
+                span.parent_span_id = format(parent.span_id, "016x")
+        with self._lock:
+            self._started[span.span_id] = otel_span
+
+    def export(self, span):
+        with self._lock:
+            otel_span = self._started.pop(span.span_id, None)
+        if otel_span is None:
+            # started before this exporter was set
+            otel_span = self._start(span)
+        otel_span.set_attributes(span.attributes)
+        if span.error is not None:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.end_ns)
+
+    def _start(self, span):
+        trace = self._trace
+        context = None
+        if span.parent_span_id is not None:
+            with self._lock:
+                parent = self._started.get(span.parent_span_id)
+            if parent is None:
+                # a remote parent, from the traceparent of a message
+                parent = trace.NonRecordingSpan(trace.SpanContext(
+                    trace_id=int(span.trace_id, 16),
+                    span_id=int(span.parent_span_id, 16),
+                    is_remote=True,
+                    trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED)))
+            context = trace.set_span_in_context(parent)
+        return self._tracer.start_span(span.name, context=context,
+                                       attributes=span.attributes,
+                                       start_time=span.start_ns)
@@ -0,0 +1,97 @@
+class CompletionTracker:
+    """
+    Tracks which fetched messages are done processing so that messages
+    can complete out of order while the resume state stays exact.
+
+    Dispatched but incomplete sequences are kept in a bitmap starting at
+    the lowest sequence that may still be pending; leading bytes are
+    dropped as soon as all their messages complete, so memory is bound
+    by the spread of in-flight sequences. Sequences that were never
+    dispatched (deleted messages, other consumers' messages) do not
+    hold the watermark back.
+    """
+
+    def __init__(self, start_sequence: int = 1):
+        self._base = start_sequence
+        self._bitmap = bytearray()
+        self._pending = 0
+        self._highest_completed = start_sequence - 1
+
+    @property
+    def pending(self) -> int:
+        """Number of dispatched messages that did not complete yet."""
+        return self._pending
+
+    def dispatch(self, seq: int):
+        """Marks a fetched message as in progress."""
+        if seq < self._base:
+            # a redelivery of a message that already completed
+            return
+        if self._pending == 0:
+            # nothing in between is in progress, start the bitmap at seq
+            self._base = seq
+            self._bitmap = bytearray()
+        offset = seq - self._base
+        index = offset >> 3
+        if index >= len(self._bitmap):
+            self._bitmap.extend(bytes(index + 1 - len(self._bitmap)))
+        bit = 1 << (offset & 7)
+        if not self._bitmap[index] & bit:
+            self._bitmap[index] |= bit
+            self._pending += 1
+
+    def complete(self, seq: int) -> bool:
+        """Marks a message as done. Returns False if it was not in progress."""
+        offset = seq - self._base
+        if offset < 0:
+            return False
+        index = offset >> 3
+        bit = 1 << (offset & 7)
+        if index >= len(self._bitmap) or not self._bitmap[index] & bit:
+            return False
+        self._bitmap[index] &= ~bit
+        self._pending -= 1
+        self._highest_completed = max(self._highest_completed, seq)
+        self._compact()
+        return True
+
+    def _compact(self):
+        if self._pending == 0:
+            self._base = max(self._base, self._highest_completed + 1)
+            self._bitmap = bytearray()
+            return
+        leading = 0
+        while self._bitmap[leading] == 0:
+            leading += 1
+        if leading > 0:
+            del self._bitmap[:leading]
+            self._base += leading * 8
+
+    def first_pending(self):
+        """Returns the lowest sequence still in progress, or None."""
+        if self._pending == 0:
+            return None
+        index = 0
+        while self._bitmap[index] == 0:
+            index += 1
+        first = self._bitmap[index]
+        return self._base + index * 8 + (first & -first).bit_length() - 1
+
+    def watermark(self):
+        """
+        Returns the highest sequence such that every dispatched message
+        up to it completed, or None if no message completed yet.
+        """
+        if self._pending == 0:
+            seq = self._highest_completed
+        else:
+            first = self._bitmap[0] if len(self._bitmap) > 0 else 0
+            index = 0
+            while first == 0:
+                index += 1
+                first = self._bitmap[index]
+            seq = self._base + index * 8 + ((first & -first).bit_length() - 1) - 1
+            seq = min(seq, self._highest_completed)
+        if seq <= 0:
+            return None
+        return seq
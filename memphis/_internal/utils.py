@@ -1,20 +1,89 @@
+import asyncio
+import datetime
 import random
-from threading import Timer
+import re
 from typing import Callable
 
 
-class set_interval:
-    def __init__(self, func: Callable, sec: int):
-        def func_wrapper():
-            self.t = Timer(sec, func_wrapper)
-            self.t.start()
-            func()
+class _Job:
+    def __init__(self, interval_sec: float, func: Callable, due: float):
+        self.interval_sec = interval_sec
+        self.func = func
+        self.due = due
+        self.task = None
 
-        self.t = Timer(sec, func_wrapper)
-        self.t.start()
 
-    def cancel(self):
-        self.t.cancel()
+class Scheduler:
+    """
+    Runs the periodic jobs and background tasks of a connection as
+    asyncio tasks on its event loop, instead of a timer thread per job.
+
+    A single runner task wakes up when the next job is due. A job is
+    skipped for a round while its previous run is still in progress.
+    """
+
+    def __init__(self, error_handler: Callable = None):
+        self.error_handler = error_handler if error_handler is not None else default_error_handler
+        self._jobs = {}
+        self._tasks = {}
+        self._runner = None
+        self._wakeup = None
+
+    def every(self, key: str, interval_sec: float, func: Callable):
+        """Runs the coroutine function func every interval_sec seconds, replacing any job with the same key."""
+        loop = asyncio.get_event_loop()
+        self._jobs[key] = _Job(interval_sec, func, loop.time() + interval_sec)
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = loop.create_task(self._run_jobs())
+        else:
+            self._wakeup.set()
+
+    def spawn(self, key: str, coro):
+        """Runs a long-lived coroutine, e.g. a subscription listener, until it is cancelled."""
+        self.cancel(key)
+        task = asyncio.get_event_loop().create_task(coro)
+        self._tasks[key] = task
+        return task
+
+    def cancel(self, key: str):
+        job = self._jobs.pop(key, None)
+        if job is not None and job.task is not None:
+            job.task.cancel()
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self):
+        for key in list(self._jobs.keys()) + list(self._tasks.keys()):
+            self.cancel(key)
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    async def _run_job(self, func: Callable):
+        try:
+            await func()
+        except Exception as e:
+            self.error_handler(e)
+
+    async def _run_jobs(self):
+        loop = asyncio.get_event_loop()
+        while len(self._jobs) > 0:
+            now = loop.time()
+            next_due = None
+            for job in self._jobs.values():
+                if job.due <= now:
+                    job.due = now + job.interval_sec
+                    if job.task is None or job.task.done():
+                        job.task = loop.create_task(self._run_job(job.func))
+                if next_due is None or job.due < next_due:
+                    next_due = job.due
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(next_due - now, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
 
 
 def default_error_handler(e):
@@ -30,3 +99,17 @@ def random_bytes(amount: int) -> str:
     lst = [random.choice("0123456789abcdef") for n in range(amount)]
     s = "".join(lst)
     return s
+
+
+_RFC3339_FRACTION = re.compile(r"\.(\d+)")
+
+
+def parse_rfc3339(value: str) -> datetime.datetime:
+    """Parse an RFC 3339 timestamp as sent by the broker, e.g. 2023-07-31T23:10:18.331608123Z.
+
+    datetime.fromisoformat() accepts neither nanoseconds nor a Z suffix
+    before Python 3.11, so the fraction is cut to microseconds first.
+    """
+    value = value.replace("Z", "+00:00")
+    value = _RFC3339_FRACTION.sub(lambda m: "." + m.group(1)[:6].ljust(6, "0"), value, count=1)
+    return datetime.datetime.fromisoformat(value)
@@ -11,6 +11,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import bytewax
+import importlib
 
 __all__ = ["bytewax"]
+
+
+def __getattr__(name):
+    # importing a connector imports its streaming engine, so only do it
+    # once the connector is used (PEP 562)
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
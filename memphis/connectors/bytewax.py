@@ -1,4 +1,9 @@
+# pylint: disable=too-many-lines
 import asyncio
+import concurrent.futures
+import os
+import threading
+import time
 from collections import deque
 
 from bytewax.inputs import PartitionedInput
@@ -7,8 +12,28 @@ from bytewax.outputs import DynamicOutput
 from bytewax.outputs import StatelessSink
 
 from .._internal import Memphis
+from .._internal import MemphisError
+from .._internal import MemphisSchemaError
+from .._internal.balance import DEFAULT_LAG_DRAIN_SEC, load_score, read_station_loads, split_consumers, write_load
+from .._internal.capture import CaptureWriter, capture_path, list_captured_parts
+from .._internal.chunking import DEFAULT_CHUNK_BUFFER_BYTES, DEFAULT_CHUNK_TIMEOUT_SEC, ChunkAssembler, ChunkedMessage, get_chunk_info
+from .._internal.compression import decompress_payload
+from .._internal.dedup import DEFAULT_DEDUP_MAX_ENTRIES, DEFAULT_DEDUP_TTL_SEC, MSG_ID, PAYLOAD, DedupCache, dedup_key
+from .._internal.lanes import DEFAULT_MAX_IN_FLIGHT, KeyedLanes
+from .._internal.latency import LatencyHistogram, LatencyStamp
+from .._internal.packing import DEFAULT_PACK_LINGER_MS, DEFAULT_PACK_MAX_BYTES, PackProgress, encode_record, get_packed_count, unpack_records
+from .._internal.pool import get_shared_process_pool
+from .._internal.ratelimit import DEFAULT_TARGET_ACK_LATENCY_MS, get_shared_rate_limiter
+from .._internal.spill import DEFAULT_SEGMENT_BYTES, DEFAULT_SPILL_MAX_BYTES, SpillLog
+from .._internal.stats import ConsumerStats
+from .._internal.tracing import start_span
+from .._internal.tracker import CompletionTracker
+from .._internal.utils import get_internal_name
 
-__all__ = ["MemphisInput", "MemphisOutput"]
+__all__ = ["MemphisInput", "MemphisOutput", "MemphisReplayInput"]
+
+# how often a sink makes progress on its own while nothing is written
+_IDLE_TICK_SEC = 0.1
 
 class _MemphisConsumerSource(StatefulSource):
     def _run(self, awaitable):
@@ -19,106 +44,1057 @@ class _MemphisConsumerSource(StatefulSource):
         loop = asyncio.get_event_loop()
         return loop.run_until_complete(awaitable)
 
-    def __init__(self, host, username, password, station, consumer_name, start_consume_from_sequence, pull_interval_ms=100):
+    def __init__(self, host, username, password, station, consumer_name, start_consume_from_sequence, pull_interval_ms=100, validate_schema=False, reconnect_timeout_sec=60, part=None, stats_callback=None, stats_interval_sec=10, last_messages=-1, start_from_timestamp=None, stop_at_sequence=None, latency_tracking=False, header_filter=None, chunk_buffer_bytes=DEFAULT_CHUNK_BUFFER_BYTES, chunk_timeout_sec=DEFAULT_CHUNK_TIMEOUT_SEC, dedup=None, dedup_ttl_sec=DEFAULT_DEDUP_TTL_SEC, dedup_max_entries=DEFAULT_DEDUP_MAX_ENTRIES, persist_dedup=False, dedup_state=None, backend=Memphis, batch_transform=None, transform_processes=None, transform_max_in_flight=4, skip_records=None, capture_dir=None, consumer_group=None, load_dir=None, batch_size=10):
+        self._backend = backend
+        self._capture = None
+        if capture_dir is not None:
+            os.makedirs(capture_dir, exist_ok=True)
+            self._capture = CaptureWriter(capture_path(capture_dir, part if part is not None else "0"))
         self._messages = deque()
-        self._current_seq_num = None
+        self._packs = {}
+        self._skips = dict(skip_records) if skip_records is not None else {}
+        self._batch_transform = batch_transform
+        self._transform_processes = transform_processes
+        self._transform_max_in_flight = transform_max_in_flight
+        self._transforms = deque()
+        self._chunks = ChunkAssembler(chunk_buffer_bytes, chunk_timeout_sec)
+        self._tracker = None
+        self._station = station
+        self._internal_station_name = get_internal_name(station)
+        self._consumer_name = consumer_name
+        self._consumer_group = consumer_group
+        self._start_consume_from_sequence = start_consume_from_sequence
+        self._last_messages = last_messages
+        self._start_from_timestamp = start_from_timestamp
+        self._stop_at_sequence = stop_at_sequence
+        self._latency_tracking = latency_tracking
+        self._header_filter = header_filter
+        self._dedup_mode = dedup
+        self._dedup = None
+        if dedup is not None:
+            self._dedup = DedupCache(dedup_ttl_sec, dedup_max_entries)
+            if dedup_state is not None:
+                self._dedup.load(dedup_state)
+        self._persist_dedup = persist_dedup
+        self._batch_fetched_at_ns = None
+        self._pull_interval_ms = pull_interval_ms
+        self._batch_size = batch_size
+        self._validate_schema = validate_schema
+        self._connect_args = {"host": host, "username": username, "password": password}
+        self._reconnect_timeout_sec = reconnect_timeout_sec
+        self._disconnected_since = None
+        self._part = part
+        self._stats = ConsumerStats()
+        self._stats_callback = stats_callback
+        self._stats_interval_sec = stats_interval_sec
+        self._stats_reported_at = time.monotonic()
+        self._load_dir = load_dir
+        if load_dir is not None:
+            os.makedirs(load_dir, exist_ok=True)
+
+        self._connect(start_consume_from_sequence, last_messages)
+
+    def _connect(self, start_consume_from_sequence, last_messages=-1):
+        memphis = self._backend()
+        self._run(memphis.connect(**self._connect_args))
+
+        try:
+            if start_consume_from_sequence is None:
+                start_consume_from_sequence = self._run(memphis.get_sequence_at_time(self._station,
+                                                                                     self._start_from_timestamp))
+                self._start_consume_from_sequence = start_consume_from_sequence
+            if self._tracker is None:
+                self._tracker = CompletionTracker(start_consume_from_sequence)
+
+            if self._validate_schema:
+                self._run(memphis.fetch_station_schema(self._station))
+
+            # create an entirely new consumer every time so that we can control the starting
+            # offset
+            consumer_name = f"{self._consumer_name}-{memphis.connection_id}"
+
+            # we are going to use 1 consumer per consumer group so we can
+            # more easily manage the lifecycle to support replaying events,
+            # unless the partition is one of several sharing a station
+            consumer_group = self._consumer_group or consumer_name
+
+            consumer = self._run(memphis.consumer(station_name=self._station,
+                                                  consumer_name=consumer_name,
+                                                  consumer_group=consumer_group,
+                                                  start_consume_from_sequence=start_consume_from_sequence,
+                                                  last_messages=last_messages,
+                                                  pull_interval_ms=self._pull_interval_ms,
+                                                  batch_size=self._batch_size))
+        except Exception as e:
+            self._run(memphis.close())
+            raise e
+
+        self._memphis = memphis
+        self._consumer = consumer
+
+    def _reconnect(self):
+        """
+        Re-establishes the connection and the consumer once NATS gave up
+        reconnecting. Consumption resumes right after the contiguous
+        completed messages; anything after them is fetched again.
+        """
+        start_consume_from_sequence = self._start_consume_from_sequence
+        last_messages = self._last_messages
+        watermark = self._tracker.watermark() if self._tracker is not None else None
+        if watermark is not None:
+            start_consume_from_sequence = watermark + 1
+            last_messages = -1
+        with start_span("memphis.reconnect", {"memphis.station": self._station}):
+            self._run(self._memphis.close())
+            self._connect(start_consume_from_sequence, last_messages)
+        for msg, progress in self._packs.items():
+            # packed messages are fetched again, without their handled records
+            if progress.next_index() > 0:
+                self._skips[msg.get_sequence_number()] = progress.next_index()
+        self._packs.clear()
+        self._messages.clear()
+        self._chunks.clear()
+        for _, _, future in self._transforms:
+            future.cancel()
+        self._transforms.clear()
+
+    def _ensure_connection(self):
+        """
+        Returns True once the connection can be used. While the broker
+        is unreachable the source pauses (returns None from next())
+        instead of failing, up to reconnect_timeout_sec.
+        """
+        if self._memphis.is_connection_active:
+            self._disconnected_since = None
+            return True
+
+        now = time.monotonic()
+        if self._disconnected_since is None:
+            self._disconnected_since = now
+        elif now - self._disconnected_since > self._reconnect_timeout_sec:
+            raise MemphisError(f"Connection could not be re-established within {self._reconnect_timeout_sec} seconds")
+
+        if self._memphis.is_connection_closed:
+            try:
+                self._reconnect()
+            except MemphisError:
+                self._run(asyncio.sleep(self._pull_interval_ms / 1000))
+                return False
+        else:
+            self._run(self._memphis.wait_for_connection(self._pull_interval_ms / 1000))
+
+        if self._memphis.is_connection_active:
+            self._disconnected_since = None
+            return True
+        return False
+
+    async def _drop_invalid(self, batch, payloads, errors):
+        """
+        Routes the messages that failed schema validation to the
+        dead-letter station and acks them so they are not redelivered.
+        """
+        kept = {}
+        for msg, payload, error in zip(batch, payloads, errors):
+            if error is None:
+                kept[msg] = kept.get(msg, 0) + 1
+                continue
+            await self._memphis.send_msg_to_dls(self._internal_station_name,
+                                                self._consumer.consumer_name,
+                                                payload,
+                                                msg.get_headers(),
+                                                error)
+            if self._record_done(msg, kept.get(msg, 0)):
+                await self._complete(msg)
+
+    async def _complete(self, msg):
+        """Acks a message and marks it as done in the tracker."""
+        await msg.ack()
+        self._mark_completed(msg)
+
+    async def _complete_all(self, msgs):
+        await asyncio.gather(*[msg.ack() for msg in msgs])
+        for msg in msgs:
+            self._mark_completed(msg)
+
+    def _mark_completed(self, msg):
+        self._packs.pop(msg, None)
+        if isinstance(msg, ChunkedMessage):
+            for seq in msg.get_sequence_numbers():
+                self._tracker.complete(seq)
+            return
+        self._tracker.complete(msg.get_sequence_number())
+
+    def _filter_batch(self, batch):
+        """
+        Drops the messages rejected by the header filter before their
+        payloads are copied or decompressed, acking them in bulk.
+        """
+        kept = []
+        dropped = []
+        for msg in batch:
+            headers = msg.get_headers()
+            if self._header_filter(headers if headers is not None else {}):
+                kept.append(msg)
+            else:
+                dropped.append(msg)
+        if len(dropped) > 0:
+            self._run(self._complete_all(dropped))
+            self._stats.record_filtered(len(dropped))
+        return kept
+
+    def _reassemble(self, batch):
+        """
+        Replaces the chunks of large messages by the reassembled messages.
+        Chunks of incomplete messages are held, unacked, by the assembler.
+        """
+        self._chunks.expire()
+        messages = []
+        for msg in batch:
+            chunk_info = get_chunk_info(msg.get_headers())
+            if chunk_info is None:
+                messages.append(msg)
+                continue
+            if self._consumer_group is not None:
+                # the broker may hand the other chunks to another consumer
+                # of the group, the message could never be reassembled
+                raise MemphisError(f"Message {msg.get_sequence_number()} of station {self._station} is chunked, "
+                                   "chunked messages can not be consumed by several consumers of a station")
+            chunked = self._chunks.add(msg, chunk_info)
+            if chunked is not None:
+                messages.append(chunked)
+        return messages
+
+    def _decompress_batch(self, batch):
+        """
+        Decompresses the payloads of a batch. Messages that can not be
+        decompressed, because their codec is not installed or they are
+        corrupt, would fail again on every redelivery: they are sent to
+        the dead-letter station and acked instead.
+        """
+        kept = []
+        payloads = []
+        undecodable = []
+        for msg in batch:
+            raw = msg.get_raw_data()
+            try:
+                payloads.append(bytearray(decompress_payload(raw, msg.get_headers())))
+            except MemphisError as e:
+                undecodable.append((msg, raw, e))
+                continue
+            kept.append(msg)
+        if len(undecodable) > 0:
+            self._run(self._drop_undecodable(undecodable))
+            self._stats.record_undecodable(len(undecodable))
+        return kept, payloads
+
+    async def _drop_undecodable(self, undecodable):
+        for msg, raw, error in undecodable:
+            await self._memphis.send_msg_to_dls(self._internal_station_name,
+                                                self._consumer.consumer_name,
+                                                raw,
+                                                msg.get_headers(),
+                                                error)
+            await self._complete(msg)
+
+    def _drop_duplicates(self, batch, payloads):
+        """
+        Drops the messages that were already emitted within the dedup
+        window, or that appear twice in the batch, and acks them.
+        """
+        kept = []
+        kept_payloads = []
+        kept_keys = []
+        duplicates = []
+        batch_keys = set()
+        for msg, payload in zip(batch, payloads):
+            key = dedup_key(msg, payload, self._dedup_mode)
+            if key is not None:
+                if key in batch_keys or key in self._dedup:
+                    duplicates.append(msg)
+                    continue
+                batch_keys.add(key)
+            kept.append(msg)
+            kept_payloads.append(payload)
+            kept_keys.append(key)
+        if len(duplicates) > 0:
+            self._run(self._complete_all(duplicates))
+            self._stats.record_duplicates(len(duplicates))
+        return kept, kept_payloads, kept_keys
+
+    def _unpack(self, batch, payloads, keys):
+        """
+        Replaces each packed message by an entry per record, leaving out
+        the records handled before a restart. The message's dedup key
+        goes with its last record, which acks the message.
+        """
+        records_batch = []
+        records = []
+        records_keys = []
+        done = []
+        for msg, payload, key in zip(batch, payloads, keys):
+            count = get_packed_count(msg.get_headers())
+            if count is None:
+                records_batch.append(msg)
+                records.append(payload)
+                records_keys.append(key)
+                continue
+            skip = self._skips.pop(msg.get_sequence_number(), 0)
+            unpacked = unpack_records(payload, count)[skip:]
+            if len(unpacked) == 0:
+                done.append(msg)
+                continue
+            self._packs[msg] = PackProgress(count, skip)
+            records_batch.extend([msg] * len(unpacked))
+            records.extend(unpacked)
+            records_keys.extend([None] * (len(unpacked) - 1))
+            records_keys.append(key)
+        if len(done) > 0:
+            self._run(self._complete_all(done))
+        return records_batch, records, records_keys
+
+    def _record_done(self, msg, position=0):
+        """
+        Marks a record of a packed message as handled, the one at
+        position among the message's records that are not handled yet.
+        Returns True when no record of the message is left, and it has
+        to be acked.
+        """
+        progress = self._packs.get(msg)
+        if progress is None:
+            return True
+        return progress.done(position)
+
+    def _partial_pack(self):
+        """
+        Returns the sequence and the index of the first record not handled
+        yet of the packed message in progress if it is the first
+        incomplete message, None otherwise.
+        """
+        first_pending = self._tracker.first_pending()
+        for msg, progress in self._packs.items():
+            if progress.next_index() > 0 and msg.get_sequence_number() == first_pending:
+                return first_pending, progress.next_index()
+        return None
+
+    def stats(self):
+        """
+        Returns the partition's lag and throughput since the last call:
+        pending messages, the age of the oldest unprocessed message,
+        the redelivery rate and fetch/emit rates.
+        """
+        oldest_timestamp = None
+        if len(self._messages) > 0:
+            oldest_timestamp = self._messages[0][0].get_timestamp()
+        return self._stats.report(buffered=len(self._messages), oldest_timestamp=oldest_timestamp)
+
+    def _report_stats(self):
+        now = time.monotonic()
+        if now - self._stats_reported_at < self._stats_interval_sec:
+            return
+        self._stats_reported_at = now
+        stats = self.stats()
+        if self._stats_callback is not None:
+            self._stats_callback(self._part, stats)
+        if self._load_dir is not None:
+            write_load(self._load_dir, self._part, self._station, stats)
 
-        self._memphis = Memphis()
-        self._run(self._memphis.connect(host=host, username=username, password=password))
+    def _fetch_batch(self):
+        """
+        Fetches a batch and buffers its messages that should be emitted,
+        after filtering, reassembly and schema validation.
+        """
+        try:
+            batch = self._run(self._consumer.fetch(self._batch_size))
+        except MemphisError as e:
+            if self._memphis.is_connection_active:
+                raise e
+            return
+        if batch is None or len(batch) == 0:
+            return
+        self._batch_fetched_at_ns = time.time_ns()
+        if self._capture is not None:
+            self._capture.write_batch(batch)
+        self._stats.record_batch(batch)
+        for msg in batch:
+            self._tracker.dispatch(msg.get_sequence_number())
+
+        if self._header_filter is not None:
+            try:
+                batch = self._filter_batch(batch)
+            except MemphisError as e:
+                if self._memphis.is_connection_active:
+                    raise e
+                return
+            if len(batch) == 0:
+                return
+
+        batch = self._reassemble(batch)
+        if len(batch) == 0:
+            return
+
+        # after filtering so filtered messages are never decompressed, and
+        # after reassembly since payloads are compressed before they are
+        # split into chunks
+        try:
+            batch, payloads = self._decompress_batch(batch)
+        except MemphisError as e:
+            if self._memphis.is_connection_active:
+                raise e
+            return
+        if len(batch) == 0:
+            return
+        keys = [None] * len(batch)
+        if self._dedup is not None:
+            try:
+                batch, payloads, keys = self._drop_duplicates(batch, payloads)
+            except MemphisError as e:
+                if self._memphis.is_connection_active:
+                    raise e
+                return
+            if len(batch) == 0:
+                return
+
+        try:
+            batch, payloads, keys = self._unpack(batch, payloads, keys)
+        except MemphisError as e:
+            if self._memphis.is_connection_active:
+                raise e
+            return
+
+        if self._validate_schema:
+            errors = self._memphis.validate_batch(self._internal_station_name, payloads)
+            if any(error is not None for error in errors):
+                self._run(self._drop_invalid(batch, payloads, errors))
+                valid = [i for i, error in enumerate(errors) if error is None]
+                batch = [batch[i] for i in valid]
+                payloads = [payloads[i] for i in valid]
+                keys = [keys[i] for i in valid]
 
-        # create an entirely new consumer every time so that we can control the starting
-        # offset
-        consumer_name = f"{consumer_name}-{self._memphis.connection_id}"
+        self._buffer(batch, payloads, keys)
+
+    def _buffer(self, batch, payloads, keys):
+        """
+        Queues messages for emission, or hands their payloads to the
+        transform process pool first.
+        """
+        if len(batch) == 0:
+            return
+        if self._batch_transform is None:
+            self._messages.extend(zip(batch, payloads, keys))
+            return
+        future = get_shared_process_pool(self._transform_processes).submit(self._batch_transform, payloads)
+        self._transforms.append((batch, keys, future))
+
+    def _pump_transforms(self):
+        """
+        Keeps up to transform_max_in_flight batches in the process pool,
+        fetching ahead while the oldest one is transformed, and buffers
+        the oldest batch's results once they are ready, so messages are
+        emitted in fetch order.
+        """
+        if len(self._transforms) < self._transform_max_in_flight:
+            self._fetch_batch()
+        if len(self._transforms) == 0:
+            return
+        batch, keys, future = self._transforms[0]
+        # only block when there is no room to fetch ahead
+        timeout = 0
+        if len(self._transforms) >= self._transform_max_in_flight:
+            timeout = self._pull_interval_ms / 1000
+        done, _ = concurrent.futures.wait([future], timeout=timeout)
+        if len(done) == 0:
+            return
+        self._transforms.popleft()
+        results = future.result()
+        if len(results) != len(batch):
+            raise MemphisError(f"batch_transform returned {len(results)} results for {len(batch)} messages")
 
-        # we are going to use 1 consumer per consumer group so we can
-        # more easily manage the lifecycle to support replaying events
-        consumer_group = consumer_name
+        filtered = sum(1 for result in results if result is None)
+        dropped = []
+        kept = {}
+        for msg, result in zip(batch, results):
+            if result is not None:
+                kept[msg] = kept.get(msg, 0) + 1
+            elif self._record_done(msg, kept.get(msg, 0)):
+                dropped.append(msg)
+        if len(dropped) > 0:
+            try:
+                self._run(self._complete_all(dropped))
+            except MemphisError as e:
+                if self._memphis.is_connection_active:
+                    raise e
+        if filtered > 0:
+            self._stats.record_filtered(filtered)
+        self._messages.extend((msg, result, key)
+                              for msg, result, key in zip(batch, results, keys)
+                              if result is not None)
 
-        self._consumer = self._run(self._memphis.consumer(station_name=station,
-                                                          consumer_name=consumer_name,
-                                                          consumer_group=consumer_group,
-                                                          start_consume_from_sequence=start_consume_from_sequence,
-                                                          pull_interval_ms=pull_interval_ms))
     def next(self):
+        if self._stats_callback is not None or self._load_dir is not None:
+            self._report_stats()
+
+        if self._stop_at_sequence is not None:
+            watermark = self._tracker.watermark()
+            if watermark is not None and watermark >= self._stop_at_sequence:
+                raise StopIteration()
+
+        if not self._ensure_connection():
+            return None
+
         if len(self._messages) == 0:
-            batch = self._run(self._consumer.fetch())
-            if batch is None or len(batch) == 0:
-                return None
+            if self._batch_transform is not None:
+                self._pump_transforms()
             else:
-                self._messages.extend(batch)
+                self._fetch_batch()
+            if len(self._messages) == 0:
+                return None
+
+        msg, payload, key = self._messages[0]
+        if self._stop_at_sequence is not None and msg.get_sequence_number() > self._stop_at_sequence:
+            # the stop point was deleted from the station, everything up to it was consumed
+            raise StopIteration()
+        self._messages.popleft()
+        if self._record_done(msg):
+            try:
+                self._run(self._complete(msg))
+            except MemphisError as e:
+                if self._memphis.is_connection_active:
+                    raise e
+                # retry the ack once the connection is back
+                self._messages.appendleft((msg, payload, key))
+                return None
+        self._stats.record_emitted()
+        if key is not None:
+            # keys are only recorded once emitted, so that messages fetched
+            # again after a reconnect are not taken for duplicates
+            self._dedup.add(key)
 
-        msg = self._messages.popleft()
-        self._current_seq_num = msg.get_sequence_number()
-        self._run(msg.ack())
+        if self._latency_tracking:
+            stored_at = msg.get_timestamp()
+            stored_at_ns = int(stored_at.timestamp() * 1e9) if stored_at is not None else None
+            return (payload, LatencyStamp(msg.get_produced_at_ns(), stored_at_ns, self._batch_fetched_at_ns))
 
-        return msg.get_data()
+        return payload
 
     def snapshot(self):
-        return self._current_seq_num
+        if self._consumer_group is not None:
+            # the next run resumes from the group's acks on the broker;
+            # the watermark would skip the messages of the other consumers
+            return None
+        state = {}
+        seq = self._tracker.watermark()
+        partial_pack = self._partial_pack()
+        if partial_pack is not None:
+            # resume within the packed message, after its handled records
+            seq, state["skip"] = partial_pack
+        elif (seq or 0) + 1 in self._skips:
+            # the packed message after the watermark was not fetched again
+            # since the restart or reconnect, its handled records still are
+            seq = (seq or 0) + 1
+            state["skip"] = self._skips[seq]
+        if self._persist_dedup and self._dedup is not None:
+            state["dedup"] = self._dedup.dump()
+        if len(state) == 0:
+            return seq
+        state["seq"] = seq
+        return state
 
     def close(self):
-        self._run(self._consumer.destroy())
+        if self._capture is not None:
+            self._capture.close()
+        # the pool is shared with the other partitions, only this
+        # partition's batches are dropped
+        for _, _, future in self._transforms:
+            future.cancel()
+        self._transforms.clear()
+        if self._load_dir is not None:
+            write_load(self._load_dir, self._part, self._station, self.stats())
+        # destroying the last consumer of a shared group would delete the
+        # group, and with it the position the next run resumes at
+        if self._consumer_group is None:
+            self._run(self._consumer.destroy())
+        # also stops the client's keepalive and update tasks
+        self._run(self._memphis.close())
 
 class MemphisInput(PartitionedInput):
     """
     Use a Memphis.dev station as an input.
 
     Currently, this input connector supports:
-    * 1 consumer per station: Adding partitions to Memphis is ongoing work.
-      When available, we will update the connector to support 1 consumer
-      per station partition.
+    * Consumers: A single station is consumed by a single partition, or
+      split over several with consumers (see skew-aware assignment).
     * At-least once semantics: If the Bytewax flow is killed and restarted,
-      the connector will restart from the last messaged processed before the
+      the connector will restart after the last message processed before the
       resume state was saved. All messages processed since the resume state
       will be reprocessed.
     * Replaying messages: If replay_messages is set to True, consumption
       will start at the first message in the station.
+    * Bounded replay: Instead of the whole station, consumption can start
+      at the first message stored at or after replay_from_timestamp
+      (found by a binary search over the station's sequences), at the
+      last replay_last_messages messages, or at the start of
+      replay_range, an inclusive (start, stop) pair of sequence numbers.
+      With a stop sequence, the input completes once it is reached.
+      Unlike replay_messages, these options only apply when there is no
+      resume state, so a restarted backfill continues where it stopped.
+    * Schema validation: If validate_schema is set to True, the schema
+      attached to the station is fetched and compiled once, and refreshed
+      when it is updated. Fetched batches are validated before they are
+      emitted; invalid messages are sent to the dead-letter station.
+    * Reconnecting: If the connection to the broker is lost, the input
+      pauses until it is re-established. If the client gives up
+      reconnecting, the connection and consumer are recreated in place,
+      resuming after the last acked message.
+    * Out-of-order completion: Fetched messages are tracked in a compact
+      bitmap as they complete. The resume state is the highest sequence
+      up to which every fetched message completed, so messages can be
+      processed out of order without losing at-least once semantics.
+    * Lag telemetry: If stats_callback is set, it is called every
+      stats_interval_sec with the partition and its lag (pending messages,
+      age of the oldest unprocessed message, redelivery rate and rates),
+      computed from the metadata of fetched batches.
+    * Latency tracking: If latency_tracking is set to True, items are
+      emitted as (payload, LatencyStamp) tuples carrying the produce,
+      store and fetch times. Pass the stamp along with the record to a
+      MemphisOutput with latency_tracking to measure end-to-end latency.
+    * Header filtering: If header_filter is set, it is called with the
+      headers of every fetched message before its payload is touched.
+      Messages it returns False for are acked in bulk and never emitted,
+      which is much cheaper than a filter step in the flow when producers
+      put the filtered fields in headers. Filtered counts are reported in
+      the lag stats.
+    * Compression: Messages compressed by MemphisOutput are decompressed
+      after header filtering. Messages that can not be decompressed, e.g.
+      because their codec is not installed, are sent to the dead-letter
+      station and acked, and counted as undecodable in the lag stats.
+    * Large messages: Messages that MemphisOutput split into chunks
+      because they exceed the broker's max payload are reassembled before
+      they are emitted, and their chunks are acked once the whole message
+      was processed. Incomplete messages are buffered up to
+      chunk_buffer_bytes for at most chunk_timeout_sec; past either limit
+      they are dropped unacked and reassembled again when redelivered.
+    * Deduplication: If dedup is set to "msg_id" (or "payload"), the
+      msg-id headers (or payload hashes) of emitted messages are kept for
+      dedup_ttl_sec, up to dedup_max_entries, as 8 byte digests. Messages
+      seen again within that window, e.g. replayed after a restart, are
+      acked and dropped before they reach the flow. With persist_dedup the
+      digests are saved in the resume state so the window survives
+      restarts.
+    * Process pool transforms: If batch_transform is set, the payloads of
+      every fetched batch are passed to it in a process pool and its
+      results are emitted instead, in fetch order. Up to
+      transform_max_in_flight batches are fetched ahead while earlier
+      ones are transformed, so CPU-heavy decoding of a partition can use
+      several cores. The partitions of a process share one pool of
+      transform_processes processes, so the CPUs are not oversubscribed
+      by the number of partitions. Messages only count as processed in
+      the resume state once their result was emitted.
+    * Packed records: Messages that MemphisOutput packed several records
+      into are unpacked and their records emitted one by one. A packed
+      message is acked once all of its records were emitted or dropped,
+      and the resume state records the index of the first record that
+      was not, so a restart picks up right after the handled records.
+    * Capture: If capture_dir is set, every fetched batch is written to a
+      file per partition in capture_dir as it was fetched, with payloads,
+      headers, sequence numbers, delivery counts and the time between
+      batches. MemphisReplayInput feeds captured traffic back into a
+      flow, to benchmark changes against production load offline.
+    * Skew-aware assignment: station may be a list of stations, and
+      consumers the number of partitions to spread over them. Each
+      station gets a share of the partitions in proportion to its load,
+      at least one, and the partitions of a station share a durable
+      consumer group so the broker splits its messages among them. If
+      load_dir is set, every partition saves its load (pending messages
+      and fetch rate) there every stats_interval_sec, and the next run
+      splits the partitions by the loads of the last one, so hot stations
+      get more consumers after a restart. Without saved loads the split
+      follows station_weights, or is even. load_dir has to be storage
+      every worker sees. The split is computed once per run from the
+      loads saved before the input was created, so the loads the running
+      partitions save do not change it; workers that still disagree
+      build more or fewer partitions of a station, never the same one
+      twice. The consumers of a group resume from the group's acks on the
+      broker, so split partitions have no resume state, and messages
+      that were not acked are redelivered. The replay options,
+      persist_dedup and chunked messages are not supported with several
+      stations or consumers: the options are rejected, and a chunked
+      message fails the partition.
     
     Args:
 
-        host: The hostname of the Memphis broker.
+        host: The hostname of the Memphis broker, or a list of the
+                 hostnames of a cluster's nodes. Each worker connects to
+                 the closest node, spread over equally close ones, and
+                 fails over to the others.
 
         username: The username of the Memphis account.
 
         password: The password of the Memphis account.
 
-        station: The name of the Memphis station
+        station: The name of the Memphis station, or a list of station
+                 names to spread consumers over.
 
         consumer_prefix: The prefix for the consumer name that will show up
                  in the Memphis UI.
 
         replay_messages: Start consuming from first message in the station
 
+        replay_from_timestamp: Start consuming from the first message
+                 stored at or after this datetime.
+
+        replay_last_messages: Start consuming from the last N messages in
+                 the station.
+
+        replay_range: Consume the messages between two sequence numbers
+                 (inclusive) and stop. The stop may be None to keep
+                 consuming.
+
+        latency_tracking: Emit (payload, LatencyStamp) tuples instead of
+                 payloads.
+
+        header_filter: Function taking a message's headers (dict) and
+                 returning whether the message should be emitted.
+
+        chunk_buffer_bytes: Memory used at most for the chunks of
+                 messages that are not fully fetched yet.
+
+        chunk_timeout_sec: How long the chunks of an incomplete message
+                 are kept.
+
+        dedup: Drop duplicate messages by "msg_id" header or by "payload".
+                 Messages without a msg-id are never dropped with
+                 "msg_id". Defaults to no deduplication.
+
+        dedup_ttl_sec: How long an emitted message is remembered.
+
+        dedup_max_entries: How many emitted messages are remembered at
+                 most.
+
+        persist_dedup: Save the remembered messages in the resume state.
+
+        backend: Function creating the Memphis client, e.g. the client
+                 method of a memphis.testing.FakeBroker to run the flow
+                 without a broker. Defaults to Memphis.
+
+        batch_transform: Picklable function (defined at module level)
+                 taking a list of payloads and returning a list with a
+                 result per payload. None results are dropped.
+
+        transform_processes: Size of the process pool, which is shared by
+                 every partition of the process using the same size.
+                 Defaults to the number of CPUs.
+
+        transform_max_in_flight: How many batches are in the process pool
+                 at most.
+
+        capture_dir: Directory to capture the fetched batches to. Existing
+                 captures of the same partitions are overwritten.
+
+        consumers: How many partitions to split the stations into.
+                 Defaults to one per station.
+
+        station_weights: Dict of the relative load of each station, used
+                 until loads were saved to load_dir.
+
+        load_dir: Directory the partitions save their load to, and the
+                 split of the next run is computed from.
+
+        lag_drain_sec: How soon a station's pending messages should be
+                 drained, which weighs lag against the fetch rate when
+                 splitting.
+
+        batch_size: How many messages are fetched at once, up to 5000.
+
+        validate_schema: Validate messages against the station's schema
+                 and drop the invalid ones.
+
+        reconnect_timeout_sec: How long the input waits for a lost
+                 connection to come back before failing.
+
+        stats_callback: Function called with the partition name and a
+                 dict of lag stats, e.g. to drive autoscaling.
+
+        stats_interval_sec: How often stats_callback is called.
+
     """
 
-    def __init__(self, host, username, password, station, consumer_prefix, replay_messages=False):
+    def __init__(self, host, username, password, station, consumer_prefix, replay_messages=False, validate_schema=False, reconnect_timeout_sec=60, stats_callback=None, stats_interval_sec=10, replay_from_timestamp=None, replay_last_messages=None, replay_range=None, latency_tracking=False, header_filter=None, chunk_buffer_bytes=DEFAULT_CHUNK_BUFFER_BYTES, chunk_timeout_sec=DEFAULT_CHUNK_TIMEOUT_SEC, dedup=None, dedup_ttl_sec=DEFAULT_DEDUP_TTL_SEC, dedup_max_entries=DEFAULT_DEDUP_MAX_ENTRIES, persist_dedup=False, backend=Memphis, batch_transform=None, transform_processes=None, transform_max_in_flight=4, capture_dir=None, consumers=None, station_weights=None, load_dir=None, lag_drain_sec=DEFAULT_LAG_DRAIN_SEC, batch_size=10):
+        if dedup not in (None, MSG_ID, PAYLOAD):
+            raise MemphisError(f"dedup has to be None, {MSG_ID} or {PAYLOAD}")
+        replaying = self._check_replay_options(replay_messages, replay_from_timestamp, replay_last_messages, replay_range)
+        stations = [station] if isinstance(station, str) else list(station)
+        if len(stations) == 0:
+            raise MemphisError("station has to name at least one station")
+        if consumers is not None and consumers < len(stations):
+            raise MemphisError("consumers has to be at least the number of stations")
+        if lag_drain_sec <= 0:
+            raise MemphisError("lag_drain_sec has to be positive")
+        if batch_size < 1 or batch_size > Memphis.MAX_BATCH_SIZE:
+            raise MemphisError(f"batch_size has to be between 1 and {Memphis.MAX_BATCH_SIZE}")
+        if not isinstance(station, str) or (consumers or 1) > 1:
+            self._check_split_options(replaying, persist_dedup)
+
         self.host = host
         self.username = username
         self.password = password
         self.station = station
+        self.stations = stations
         self.consumer_prefix = consumer_prefix
         self.replay_messages = replay_messages
+        self.validate_schema = validate_schema
+        self.reconnect_timeout_sec = reconnect_timeout_sec
+        self.stats_callback = stats_callback
+        self.stats_interval_sec = stats_interval_sec
+        self.replay_from_timestamp = replay_from_timestamp
+        self.replay_last_messages = replay_last_messages
+        self.replay_range = replay_range
+        self.latency_tracking = latency_tracking
+        self.header_filter = header_filter
+        self.chunk_buffer_bytes = chunk_buffer_bytes
+        self.chunk_timeout_sec = chunk_timeout_sec
+        self.dedup = dedup
+        self.dedup_ttl_sec = dedup_ttl_sec
+        self.dedup_max_entries = dedup_max_entries
+        self.persist_dedup = persist_dedup
+        self.backend = backend
+        self.batch_transform = batch_transform
+        self.transform_processes = transform_processes
+        self.transform_max_in_flight = transform_max_in_flight
+        self.capture_dir = capture_dir
+        self.consumers = consumers
+        self.station_weights = station_weights
+        self.load_dir = load_dir
+        self.lag_drain_sec = lag_drain_sec
+        self.batch_size = batch_size
+        # loads saved from here on come from this run's partitions
+        self._started_at = time.time()
+        self._assignment = None
 
-    def list_parts(self):
+    @staticmethod
+    def _check_replay_options(replay_messages, replay_from_timestamp, replay_last_messages, replay_range):
+        """Raises if the replay options conflict, returns whether one is set."""
+        replay_options = [replay_messages, replay_from_timestamp is not None,
+                          replay_last_messages is not None, replay_range is not None]
+        if sum(1 for option in replay_options if option) > 1:
+            raise MemphisError("Only one of replay_messages, replay_from_timestamp, replay_last_messages and replay_range can be set")
+        if replay_range is not None:
+            start, stop = replay_range
+            if start <= 0 or (stop is not None and stop < start):
+                raise MemphisError("replay_range has to be a (start, stop) pair of positive sequence numbers with start <= stop")
+        return any(replay_options)
+
+    @staticmethod
+    def _check_split_options(replaying, persist_dedup):
+        # consumers sharing a group resume from the group's position on
+        # the broker, not from a resume state, and may never see a stop
+        # sequence
+        if replaying:
+            raise MemphisError("The replay options can not be combined with several stations or consumers")
+        if persist_dedup:
+            raise MemphisError("persist_dedup can not be combined with several stations or consumers")
+
+    def _is_split(self):
+        return not isinstance(self.station, str) or (self.consumers or 1) > 1
+
+    def station_loads(self):
         """
-        Only allowing one consumer to exist right now.
-        When Memphis supports partitions, we will create
-        a consumer group per partition.
+        Returns the load each station's partitions saved to load_dir
+        before this input was created, as a dict of station name to
+        {"pending", "fetch_rate"}.
         """
+        if self.load_dir is None:
+            return {}
+        return read_station_loads(self.load_dir, saved_before=self._started_at)
 
-        return { "0" }
+    def assignment(self):
+        """
+        Returns how many partitions each station gets. It is computed on
+        the first call and kept for the run, from the loads saved before
+        the input was created, so the loads the running partitions save
+        do not change it.
+        """
+        if self._assignment is None:
+            self._assignment = self._compute_assignment()
+        return dict(self._assignment)
+
+    def _compute_assignment(self):
+        loads = self.station_loads()
+        if all(station in loads for station in self.stations):
+            weights = {station: load_score(loads[station], self.lag_drain_sec) for station in self.stations}
+        elif self.station_weights is not None:
+            weights = {station: self.station_weights.get(station, 0.0) for station in self.stations}
+        else:
+            weights = {station: 1.0 for station in self.stations}
+        return split_consumers(weights, self.consumers or len(self.stations))
+
+    def list_parts(self):
+        """
+        A single station gets a single partition with a consumer group of
+        its own, so it can control where it starts consuming. Otherwise
+        every station is listed with as many partitions as it could be
+        assigned, named "<station>.<n>", so the parts are the same in
+        every worker and run. build_part() only builds the ones the
+        assignment gives the station, which share its consumer group.
+        """
+        if not self._is_split():
+            return { "0" }
+        most = (self.consumers or len(self.stations)) - len(self.stations) + 1
+        return {f"{station}.{i}" for station in self.stations for i in range(most)}
 
     def build_part(self, for_part, resume_state):
         start_consume_from_sequence = 1
-        if resume_state is not None and not self.replay_messages:
-            start_consume_from_sequence = resume_state
+        last_messages = -1
+        start_from_timestamp = None
+        stop_at_sequence = None
+        dedup_state = None
+        skip_records = None
+        station = self.station
+        consumer_group = None
+        if self._is_split():
+            station, index = for_part.rsplit(".", 1)
+            if int(index) >= self.assignment()[station]:
+                return None
+            consumer_group = self.consumer_prefix + "_" + station
+            # the group's acks on the broker are the resume state
+            resume_state = None
+
+        resume_from = None
+        if isinstance(resume_state, dict):
+            dedup_state = resume_state.get("dedup")
+            if resume_state.get("skip") is not None:
+                # the packed message is consumed again, without its handled records
+                skip_records = {resume_state["seq"]: resume_state["skip"]}
+                resume_from = resume_state["seq"]
+            resume_state = resume_state.get("seq")
+        if resume_from is None and resume_state is not None:
+            # every message up to the watermark completed
+            resume_from = resume_state + 1
+        if self.replay_range is not None:
+            start_consume_from_sequence, stop_at_sequence = self.replay_range
+
+        if self.replay_messages:
+            # replaying on purpose, nothing is a duplicate
+            dedup_state = None
+            skip_records = None
+
+        if resume_from is not None and not self.replay_messages:
+            start_consume_from_sequence = resume_from
+        elif self.replay_from_timestamp is not None:
+            # looked up once the source is connected
+            start_consume_from_sequence = None
+            start_from_timestamp = self.replay_from_timestamp
+        elif self.replay_last_messages is not None:
+            last_messages = self.replay_last_messages
 
         return _MemphisConsumerSource(self.host,
                                       self.username,
                                       self.password,
-                                      self.station,
+                                      station,
                                       self.consumer_prefix + "_part" + for_part,
-                                      start_consume_from_sequence)
+                                      start_consume_from_sequence,
+                                      validate_schema=self.validate_schema,
+                                      reconnect_timeout_sec=self.reconnect_timeout_sec,
+                                      part=for_part,
+                                      stats_callback=self.stats_callback,
+                                      stats_interval_sec=self.stats_interval_sec,
+                                      last_messages=last_messages,
+                                      start_from_timestamp=start_from_timestamp,
+                                      stop_at_sequence=stop_at_sequence,
+                                      latency_tracking=self.latency_tracking,
+                                      header_filter=self.header_filter,
+                                      chunk_buffer_bytes=self.chunk_buffer_bytes,
+                                      chunk_timeout_sec=self.chunk_timeout_sec,
+                                      dedup=self.dedup,
+                                      dedup_ttl_sec=self.dedup_ttl_sec,
+                                      dedup_max_entries=self.dedup_max_entries,
+                                      persist_dedup=self.persist_dedup,
+                                      dedup_state=dedup_state,
+                                      backend=self.backend,
+                                      batch_transform=self.batch_transform,
+                                      transform_processes=self.transform_processes,
+                                      transform_max_in_flight=self.transform_max_in_flight,
+                                      skip_records=skip_records,
+                                      capture_dir=self.capture_dir,
+                                      consumer_group=consumer_group,
+                                      load_dir=self.load_dir,
+                                      batch_size=self.batch_size)
+
+
+class _ReplaySource(_MemphisConsumerSource):
+    def next(self):
+        item = super().next()
+        if (item is None and self._memphis.broker.exhausted
+                and len(self._messages) == 0 and len(self._transforms) == 0):
+            raise StopIteration()
+        return item
+
+
+class MemphisReplayInput(PartitionedInput):
+    """
+    Replays the batches a MemphisInput captured with capture_dir, without
+    a broker.
+
+    Captured batches go through the same connector code as live ones:
+    decompression, header filtering, reassembly, unpacking,
+    deduplication and batch transforms, with the captured batch sizes,
+    payloads and redeliveries. With speed set to 1.0 batches arrive at
+    the pace they were captured at; with speed None they are replayed
+    as fast as the flow takes them, e.g. to measure throughput. The
+    input stops at the end of the capture, and always replays it from
+    the start.
+
+    Args:
+
+        capture_dir: Directory MemphisInput captured batches to.
+
+        speed: Replay speed relative to the capture, None for as fast
+                 as possible.
+
+        latency_tracking: Emit (payload, LatencyStamp) tuples instead of
+                 payloads.
+
+        header_filter: Function taking a message's headers (dict) and
+                 returning whether the message should be emitted.
+
+        dedup: Drop duplicate messages by "msg_id" header or by "payload".
+
+        batch_transform: Picklable function (defined at module level)
+                 taking a list of payloads and returning a list with a
+                 result per payload. None results are dropped.
+
+        transform_processes: Size of the process pool, which is shared by
+                 every partition of the process using the same size.
+                 Defaults to the number of CPUs.
+    """
+
+    def __init__(self, capture_dir, speed=1.0, latency_tracking=False, header_filter=None, dedup=None, batch_transform=None, transform_processes=None):
+        if dedup not in (None, MSG_ID, PAYLOAD):
+            raise MemphisError(f"dedup has to be None, {MSG_ID} or {PAYLOAD}")
+        self.capture_dir = capture_dir
+        self.speed = speed
+        self.latency_tracking = latency_tracking
+        self.header_filter = header_filter
+        self.dedup = dedup
+        self.batch_transform = batch_transform
+        self.transform_processes = transform_processes
+
+    def list_parts(self):
+        return list_captured_parts(self.capture_dir)
+
+    def build_part(self, for_part, resume_state):
+        # imported here so that the connectors do not depend on the fakes
+        from ..testing import ReplayBroker # pylint: disable=import-outside-toplevel
+
+        broker = ReplayBroker(capture_path(self.capture_dir, for_part), speed=self.speed)
+        return _ReplaySource("localhost", "replay", "replay", "replay", "replay_part" + for_part, 1,
+                             pull_interval_ms=1,
+                             part=for_part,
+                             latency_tracking=self.latency_tracking,
+                             header_filter=self.header_filter,
+                             dedup=self.dedup,
+                             backend=broker.client,
+                             batch_transform=self.batch_transform,
+                             transform_processes=self.transform_processes)
 
 
 class _MemphisProducerSink(StatelessSink):
@@ -127,22 +1103,412 @@ class _MemphisProducerSink(StatelessSink):
         Uses the event loop's run_until_complete() method to
         run an async function as if it were synchronous.
         """
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(awaitable)
+        return self._loop.run_until_complete(awaitable)
+
+    def __init__(self, host, username, password, station, producer_name, compression=None, compression_threshold=1024, reconnect_timeout_sec=60, stamp_produce_time=False, latency_tracking=False, latency_callback=None, latency_report_interval_sec=10, rate_limiter=None, spill_dir=None, spill_max_bytes=DEFAULT_SPILL_MAX_BYTES, spill_segment_bytes=DEFAULT_SEGMENT_BYTES, spill_drain_batch_size=100, backend=Memphis, pack_records=None, pack_max_bytes=DEFAULT_PACK_MAX_BYTES, pack_linger_ms=DEFAULT_PACK_LINGER_MS, keyed=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        # the sink has an event loop of its own, which is also run from
+        # the ticker thread while the worker's loop runs its inputs
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._ticker = None
+        self._ticker_error = None
+        self._backend = backend
+        self._connect_args = {"host": host, "username": username, "password": password}
+        self._producer_args = {"station_name": station,
+                               "producer_name": producer_name,
+                               "compression": compression,
+                               "compression_threshold": compression_threshold,
+                               "stamp_produce_time": stamp_produce_time,
+                               "rate_limiter": rate_limiter}
+        self._reconnect_timeout_sec = reconnect_timeout_sec
+        self._latency_tracking = latency_tracking
+        self._latency_callback = latency_callback
+        self._latency_report_interval_sec = latency_report_interval_sec
+        self._latency_reported_at = time.monotonic()
+        self._end_to_end = LatencyHistogram()
+        self._broker_dwell = LatencyHistogram()
+        self._spill = None
+        if spill_dir is not None:
+            self._spill = SpillLog(os.path.join(spill_dir, producer_name),
+                                   segment_bytes=spill_segment_bytes,
+                                   max_bytes=spill_max_bytes)
+        self._spill_drain_batch_size = spill_drain_batch_size
+        self._pack_records = pack_records
+        self._pack_max_bytes = pack_max_bytes
+        self._pack_linger_ms = pack_linger_ms
+        self._pack = []
+        self._pack_bytes = 0
+        self._pack_stamps = []
+        self._pack_started_at = None
+        self._lanes = KeyedLanes(self._produce_keyed, max_in_flight) if keyed else None
+        self._connect_attempted_at = time.monotonic()
+        self._connect()
+        if self._spill is not None or self._lanes is not None or self._pack_records is not None:
+            self._ticker = threading.Thread(target=self._tick_periodically, name="memphis-sink-ticker", daemon=True)
+            self._ticker.start()
+
+    def _connect(self):
+        memphis = self._backend()
+        self._run(memphis.connect(**self._connect_args))
+        try:
+            producer = self._run(memphis.producer(**self._producer_args))
+        except Exception as e:
+            self._run(memphis.close())
+            raise e
+        self._memphis = memphis
+        self._producer = producer
+
+    def _reconnect(self):
+        with start_span("memphis.reconnect", {"memphis.station": self._producer_args["station_name"]}):
+            self._connect()
+
+    def _wait_for_connection(self):
+        """
+        Waits for NATS to reconnect, or re-establishes the connection and
+        the producer once NATS gave up reconnecting.
+        """
+        if self._memphis.is_connection_closed:
+            try:
+                self._reconnect()
+            except MemphisError:
+                self._run(asyncio.sleep(1))
+        else:
+            self._run(self._memphis.wait_for_connection(1))
+
+    def _produce(self, item):
+        """
+        Produces an item, retrying it in place if the connection was lost
+        while producing. The item may be delivered twice when the
+        connection drops after the broker stored it.
+        """
+        deadline = time.monotonic() + self._reconnect_timeout_sec
+        while True:
+            disconnections = self._memphis.disconnections
+            try:
+                return self._run(self._send(item))
+            except MemphisSchemaError as e:
+                raise e
+            except MemphisError as e:
+                connection_lost = (not self._memphis.is_connection_active
+                                   or self._memphis.disconnections != disconnections)
+                if not connection_lost or time.monotonic() > deadline:
+                    raise e
+            while not self._memphis.is_connection_active and time.monotonic() <= deadline:
+                self._wait_for_connection()
+
+    def _send(self, item):
+        if isinstance(item, list):
+            return self._producer.produce_records(item)
+        return self._producer.produce(item)
+
+    def _publish_or_spill(self, item):
+        """
+        Produces an item, or appends it to the spill log if the connection
+        is down or anything was spilled before it, so that items keep
+        their order. Spilled items are drained before new items go out.
+        """
+        if not isinstance(item, (list, bytes, bytearray, dict)):
+            # it would be spilled and fail every drain
+            raise MemphisError(f"Items of type {type(item).__name__} can not be published")
+        if not self._memphis.is_connection_active:
+            self._try_reconnect()
+        if self._memphis.is_connection_active and len(self._spill) > 0:
+            self._drain_spill(self._spill_drain_batch_size)
+        if self._memphis.is_connection_active and len(self._spill) == 0:
+            disconnections = self._memphis.disconnections
+            try:
+                self._run(self._send(item))
+                return
+            except MemphisSchemaError as e:
+                raise e
+            except MemphisError as e:
+                if self._memphis.is_connection_active and self._memphis.disconnections == disconnections:
+                    raise e
+        if isinstance(item, list):
+            # packs are spilled record by record and drained unpacked, as
+            # the bytes they are packed as
+            for record in item:
+                self._spill.append(encode_record(record))
+        else:
+            self._spill.append(item)
+
+    def _try_reconnect(self):
+        # recreating the connection blocks for the connect timeout, so
+        # it is only attempted once a second while items are spilled
+        if not self._memphis.is_connection_closed:
+            return
+        now = time.monotonic()
+        if now - self._connect_attempted_at < 1:
+            return
+        self._connect_attempted_at = now
+        try:
+            self._reconnect()
+        except MemphisError:
+            pass
+
+    async def _produce_spilled(self, item):
+        try:
+            await self._producer.produce(item)
+        except MemphisSchemaError as e:
+            if not self._memphis.station_schemaverse_to_dls.get(self._producer.internal_station_name, False):
+                raise e
+
+    def _tick_periodically(self):
+        """
+        Makes progress while nothing is written, when the sink would
+        otherwise not run at all: publishes packs older than
+        pack_linger_ms and the items queued on keyed lanes, waits for the
+        broker to come back and republishes spilled items, so an idle
+        flow does not keep them until its next write.
+        Errors are raised by the next write or close.
+        """
+        while not self._closed.wait(_IDLE_TICK_SEC):
+            with self._lock:
+                if self._closed.is_set():
+                    return
+                try:
+                    self._tick()
+                except Exception as e:
+                    self._ticker_error = e
+                    return
+
+    def _tick(self):
+        if self._lanes is not None and self._lanes.in_flight > 0:
+            # the lanes' tasks only run while the loop does
+            self._run(self._lanes.join(_IDLE_TICK_SEC / 2))
+        if self._pack_lingered():
+            self._flush_pack()
+        if self._spill is None:
+            return
+        if not self._memphis.is_connection_active:
+            self._try_reconnect()
+        if not self._memphis.is_connection_active:
+            # NATS only reconnects while the loop runs
+            self._run(self._memphis.wait_for_connection(_IDLE_TICK_SEC / 2))
+        elif len(self._spill) > 0:
+            self._drain_spill(self._spill_drain_batch_size)
+
+    def _raise_ticker_error(self):
+        if self._ticker_error is not None:
+            error = self._ticker_error
+            self._ticker_error = None
+            raise error
+
+    def _drain_spill(self, limit):
+        """
+        Publishes up to limit of the oldest spilled items one at a time,
+        in order, and drops each from the log once it was published, so
+        no item is published twice. Stops at an item that failed because
+        the connection was lost, it is published again later. Any other
+        error is raised like a failed write.
+        """
+        while limit > 0 and len(self._spill) > 0 and self._memphis.is_connection_active:
+            for item in self._spill.read(limit):
+                disconnections = self._memphis.disconnections
+                try:
+                    self._run(self._produce_spilled(item))
+                except MemphisError as e:
+                    if not self._memphis.is_connection_active or self._memphis.disconnections != disconnections:
+                        return
+                    # the item can never be published, keeping it would
+                    # fail every later drain
+                    self._spill.commit(1)
+                    raise e
+                self._spill.commit(1)
+                limit -= 1
+
+    def latency_report(self):
+        """
+        Returns the end-to-end (produce to sink) and broker dwell (store
+        to fetch) latency percentiles since the last report.
+        """
+        report = {"end_to_end": self._end_to_end.report(),
+                  "broker_dwell": self._broker_dwell.report()}
+        self._end_to_end = LatencyHistogram()
+        self._broker_dwell = LatencyHistogram()
+        return report
+
+    def _record_latency(self, stamp):
+        now_ns = time.time_ns()
+        if stamp.produced_at_ns is not None:
+            self._end_to_end.record((now_ns - stamp.produced_at_ns) / 1000)
+        if stamp.stored_at_ns is not None and stamp.fetched_at_ns is not None:
+            self._broker_dwell.record((stamp.fetched_at_ns - stamp.stored_at_ns) / 1000)
 
-    def __init__(self, host, username, password, station, producer_name):
-        self._memphis = Memphis()
-        self._run(self._memphis.connect(host=host, username=username, password=password))
+        if self._latency_callback is not None:
+            now = time.monotonic()
+            if now - self._latency_reported_at >= self._latency_report_interval_sec:
+                self._latency_reported_at = now
+                self._latency_callback(self.latency_report())
+
+    def _write(self, item):
+        """Publishes an item, or a list of records packed together."""
+        try:
+            if self._spill is not None:
+                self._publish_or_spill(item)
+            else:
+                self._produce(item)
+        except MemphisSchemaError as e:
+            # the record was already routed to the dead-letter station
+            if not self._memphis.station_schemaverse_to_dls.get(self._producer.internal_station_name, False):
+                raise e
+
+    def _add_to_pack(self, item, stamp):
+        """
+        Buffers a record into the pack, which is published once it holds
+        pack_records records or pack_max_bytes, or its first record is
+        older than pack_linger_ms.
+        """
+        if len(self._pack) == 0:
+            self._pack_started_at = time.monotonic()
+        record = encode_record(item)
+        self._pack.append(record)
+        self._pack_bytes += len(record)
+        if stamp is not None:
+            self._pack_stamps.append(stamp)
+        if len(self._pack) >= self._pack_records or self._pack_bytes >= self._pack_max_bytes or self._pack_lingered():
+            self._flush_pack()
 
-        self._producer = self._run(self._memphis.producer(station_name=station,
-                                                          producer_name=producer_name))
+    def _pack_lingered(self):
+        return len(self._pack) > 0 and (time.monotonic() - self._pack_started_at) * 1000 >= self._pack_linger_ms
+
+    def _flush_pack(self):
+        if len(self._pack) == 0:
+            return
+        pack = self._pack
+        stamps = self._pack_stamps
+        self._pack = []
+        self._pack_bytes = 0
+        self._pack_stamps = []
+        self._write(pack)
+        for stamp in stamps:
+            self._record_latency(stamp)
+
+    async def _produce_keyed(self, entry):
+        """
+        Produces an item of a keyed lane, waiting in place for a lost
+        connection to come back like _produce() does.
+        """
+        item, stamp = entry
+        deadline = time.monotonic() + self._reconnect_timeout_sec
+        while True:
+            disconnections = self._memphis.disconnections
+            try:
+                await self._producer.produce(item)
+                break
+            except MemphisSchemaError as e:
+                # the record was already routed to the dead-letter station
+                if not self._memphis.station_schemaverse_to_dls.get(self._producer.internal_station_name, False):
+                    raise e
+                break
+            except MemphisError as e:
+                connection_lost = (not self._memphis.is_connection_active
+                                   or self._memphis.disconnections != disconnections)
+                if not connection_lost or time.monotonic() > deadline:
+                    raise e
+            # a closed connection is re-established by write() or close()
+            while not self._memphis.is_connection_active and time.monotonic() <= deadline:
+                await asyncio.sleep(0.05)
+        if stamp is not None:
+            self._record_latency(stamp)
+
+    def _write_keyed(self, item):
+        key, item = item
+        stamp = None
+        if self._latency_tracking:
+            item, stamp = item
+        if self._memphis.is_connection_closed:
+            self._wait_for_connection()
+        self._run(self._lanes.put(key, (item, stamp)))
+
+    def _close_lanes(self):
+        """
+        Waits for the keyed lanes to drain, then raises the errors of the
+        lanes that failed.
+        """
+        deadline = time.monotonic() + self._reconnect_timeout_sec
+        while not self._run(self._lanes.join(1)):
+            if time.monotonic() > deadline:
+                self._lanes.cancel()
+                self._run(self._lanes.join())
+                raise MemphisError(f"{self._lanes.in_flight} keyed items could not be published in time")
+            if self._memphis.is_connection_closed:
+                self._wait_for_connection()
+        if len(self._lanes.failed) > 0:
+            key, error = next(iter(self._lanes.failed.items()))
+            raise MemphisError(f"Publishing failed for {len(self._lanes.failed)} keys, "
+                               f"{self._lanes.dropped} items were dropped. Key {key!r} failed with: "
+                               f"{getattr(error, 'message', error)}") from error
 
     def write(self, item):
-        self._run(self._producer.produce(item))
+        with self._lock:
+            self._raise_ticker_error()
+            self._write_item(item)
+
+    def _write_item(self, item):
+        if self._lanes is not None:
+            self._write_keyed(item)
+            return
+        stamp = None
+        if self._latency_tracking:
+            item, stamp = item
+        if self._pack_records is not None:
+            self._add_to_pack(item, stamp)
+            return
+        self._write(item)
+        if stamp is not None:
+            self._record_latency(stamp)
 
     def close(self):
-        self._run(self._producer.destroy())
+        self._closed.set()
+        if self._ticker is not None:
+            self._ticker.join()
+        error = self._ticker_error
+        if self._lanes is not None:
+            try:
+                self._close_lanes()
+            except MemphisError as e:
+                error = e
+        self._flush_pack()
+        if self._latency_tracking and self._latency_callback is not None:
+            self._latency_callback(self.latency_report())
+        if self._spill is not None:
+            # whatever can not be published in time stays on disk and is
+            # drained by the next sink with the same spill directory
+            deadline = time.monotonic() + self._reconnect_timeout_sec
+            try:
+                while len(self._spill) > 0 and time.monotonic() <= deadline:
+                    if self._memphis.is_connection_active:
+                        self._drain_spill(self._spill_drain_batch_size)
+                    else:
+                        self._wait_for_connection()
+                if len(self._spill) > 0:
+                    raise MemphisError(f"{len(self._spill)} spilled items could not be published in time, "
+                                       f"they are kept in {self._spill.directory}")
+            except MemphisError as e:
+                if error is None:
+                    error = e
+            self._spill.close()
+        if self._spill is None or self._memphis.is_connection_active:
+            self._run(self._producer.destroy())
         self._run(self._memphis.close())
+        self._close_loop()
+        if error is not None:
+            raise error
+
+    def _close_loop(self):
+        # let the tasks the client leaves behind finish cancelling first
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._run(self._gather_cancelled(tasks))
+        self._run(self._loop.shutdown_asyncgens())
+        self._loop.close()
+
+    @staticmethod
+    async def _gather_cancelled(tasks):
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 class MemphisOutput(DynamicOutput):
     """
@@ -161,10 +1527,65 @@ class MemphisOutput(DynamicOutput):
       it may replay some messages.  If so, those messages will be delivered
       to the station multiple times.  See the Memphis station settings 
       that catch the delivery of multiple messages to filter out duplicates.
+    * Schema validation: Records are validated against the schema attached
+      to the station with a compiled, cached validator. Invalid records are
+      dropped if the station sends schema failures to the dead-letter
+      station and raise an error otherwise.
+    * Reconnecting: Writes that fail because the connection was lost are
+      retried once the connection is re-established, recreating the
+      connection and producer in place if the client gave up reconnecting.
+    * Latency tracking: If latency_tracking is set to True, items are
+      (payload, LatencyStamp) tuples as emitted by a MemphisInput with
+      latency_tracking. End-to-end and broker dwell latencies are
+      recorded into histograms and their p50/p99/p999 are passed to
+      latency_callback every latency_report_interval_sec. Set
+      stamp_produce_time to stamp the produced messages in turn.
+    * Compression: If compression is set, payloads of at least
+      compression_threshold bytes are compressed and marked with a header.
+      MemphisInput decompresses them transparently.
+    * Large messages: Payloads larger than the broker's max payload are
+      split into chunks that MemphisInput reassembles, so large records
+      do not need an external blob store.
+    * Rate limiting: max_msgs_per_sec and max_bytes_per_sec limit the
+      publishes of every sink of the rate_limit_group in the process
+      together, so a backfill cannot saturate the broker. The limits are
+      halved while publish acks take longer than target_ack_latency_ms or
+      the broker rejects publishes, and recover gradually after.
+    * Spilling: If spill_dir is set, writes made while the broker is
+      unreachable are appended to memory-mapped segment files under
+      spill_dir (up to spill_max_bytes per worker) instead of failing,
+      and the flow keeps running. Once the connection is back, spilled
+      items are published one at a time and in order before new ones,
+      a bounded number per write, and in the background
+      while nothing is written. An item that fails for another reason
+      than the connection is dropped and its error raised. close() keeps
+      publishing them for up to reconnect_timeout_sec; items left then
+      are kept on disk for the next run, and close() raises. Only
+      bytes, bytearrays and dictionaries can be written.
+    * Packed records: If pack_records is set, up to pack_records records
+      (bytes, strings or dictionaries) are packed into a single message
+      with a record count header, which MemphisInput unpacks. A pack is
+      published once it is full, holds pack_max_bytes, or its first
+      record is pack_linger_ms old, also while nothing is written. This
+      saves the per-message framing, headers and acks of small records.
+      Records are validated against the station's schema one by one.
+      Records still waiting in a pack when the worker crashes, at most
+      pack_linger_ms worth of them, are not published.
+    * Keyed ordering: If keyed is set to True, items are (key, payload)
+      tuples. Items of the same key are published one after the other,
+      in order, while different keys are published concurrently, with
+      up to max_in_flight items queued or publishing per worker. This
+      keeps e.g. the change events of a document in order without
+      publishing everything sequentially. If publishing an item fails,
+      only its key stops: its later items are dropped and the error is
+      raised when the output is closed.
 
     Args:
 
-        host: The hostname of the Memphis broker.
+        host: The hostname of the Memphis broker, or a list of the
+                 hostnames of a cluster's nodes. Each worker connects to
+                 the closest node, spread over equally close ones, and
+                 fails over to the others.
 
         username: The username of the Memphis account.
 
@@ -174,15 +1595,124 @@ class MemphisOutput(DynamicOutput):
 
         producer_prefix: The prefix for the producer name that will show up
                  in the Memphis UI.
+
+        compression: Codec used to compress payloads: "gzip", "lz4" or
+                 "zstd". lz4 and zstd need the lz4 and zstandard packages;
+                 gzip is used when they are not installed. Defaults to
+                 no compression.
+
+        compression_threshold: Payloads smaller than this many bytes are
+                 sent uncompressed.
+
+        reconnect_timeout_sec: How long a write waits for a lost
+                 connection to come back before failing.
+
+        stamp_produce_time: Add a produce time header to every message so
+                 downstream consumers can measure end-to-end latency.
+
+        latency_tracking: Expect (payload, LatencyStamp) items and record
+                 their latencies.
+
+        latency_callback: Function called with the latency report of a
+                 worker's sink.
+
+        latency_report_interval_sec: How often latency_callback is called.
+
+        max_msgs_per_sec: Messages published per second at most by the
+                 sinks of the rate limit group in this process.
+
+        max_bytes_per_sec: Bytes published per second at most by the sinks
+                 of the rate limit group in this process.
+
+        rate_limit_group: Name of the limits shared by sinks in a process.
+                 Outputs in the same group must set the same limits.
+
+        target_ack_latency_ms: Publish ack latency above which the limits
+                 back off. None to only back off on rejected publishes.
+
+        spill_dir: Directory to spill writes to while the broker is
+                 unreachable. Defaults to failing the write after
+                 reconnect_timeout_sec.
+
+        spill_max_bytes: Disk space used at most by a worker's spill log.
+
+        spill_segment_bytes: Size of the spill log's segment files.
+
+        backend: Function creating the Memphis client, e.g. the client
+                 method of a memphis.testing.FakeBroker to run the flow
+                 without a broker. Defaults to Memphis.
+
+        pack_records: Records packed into a message at most. Defaults to
+                 a message per record.
+
+        pack_max_bytes: Size of a pack above which it is published.
+
+        pack_linger_ms: Age of a pack's first record above which the pack
+                 is published, whether or not more records are written.
+
+        keyed: Expect (key, payload) items and keep the order per key
+                 only. Can not be combined with spill_dir or
+                 pack_records.
+
+        max_in_flight: Keyed items queued or publishing at most per
+                 worker. Queued items are kept in memory only and are
+                 lost if the worker crashes.
     """
 
-    def __init__(self, host, username, password, station, producer_prefix):
+    def __init__(self, host, username, password, station, producer_prefix, compression=None, compression_threshold=1024, reconnect_timeout_sec=60, stamp_produce_time=False, latency_tracking=False, latency_callback=None, latency_report_interval_sec=10, max_msgs_per_sec=None, max_bytes_per_sec=None, rate_limit_group="default", target_ack_latency_ms=DEFAULT_TARGET_ACK_LATENCY_MS, spill_dir=None, spill_max_bytes=DEFAULT_SPILL_MAX_BYTES, spill_segment_bytes=DEFAULT_SEGMENT_BYTES, backend=Memphis, pack_records=None, pack_max_bytes=DEFAULT_PACK_MAX_BYTES, pack_linger_ms=DEFAULT_PACK_LINGER_MS, keyed=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        if pack_records is not None and pack_records < 1:
+            raise MemphisError("pack_records has to be at least 1")
+        if keyed and (spill_dir is not None or pack_records is not None):
+            raise MemphisError("keyed can not be combined with spill_dir or pack_records")
         self.host = host
         self.username = username
         self.password = password
         self.station = station
         self.producer_prefix = producer_prefix
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.reconnect_timeout_sec = reconnect_timeout_sec
+        self.stamp_produce_time = stamp_produce_time
+        self.latency_tracking = latency_tracking
+        self.latency_callback = latency_callback
+        self.latency_report_interval_sec = latency_report_interval_sec
+        self.max_msgs_per_sec = max_msgs_per_sec
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.rate_limit_group = rate_limit_group
+        self.target_ack_latency_ms = target_ack_latency_ms
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_segment_bytes = spill_segment_bytes
+        self.backend = backend
+        self.pack_records = pack_records
+        self.pack_max_bytes = pack_max_bytes
+        self.pack_linger_ms = pack_linger_ms
+        self.keyed = keyed
+        self.max_in_flight = max_in_flight
 
     def build(self, worker_index, worker_count):
         producer_name = self.producer_prefix + "-" + str(worker_index)
-        return _MemphisProducerSink(self.host, self.username, self.password, self.station, producer_name)
+        rate_limiter = None
+        if self.max_msgs_per_sec is not None or self.max_bytes_per_sec is not None:
+            rate_limiter = get_shared_rate_limiter(self.rate_limit_group,
+                                                   msgs_per_sec=self.max_msgs_per_sec,
+                                                   bytes_per_sec=self.max_bytes_per_sec,
+                                                   target_ack_latency_ms=self.target_ack_latency_ms)
+        return _MemphisProducerSink(self.host, self.username, self.password, self.station, producer_name,
+                                    compression=self.compression,
+                                    compression_threshold=self.compression_threshold,
+                                    reconnect_timeout_sec=self.reconnect_timeout_sec,
+                                    stamp_produce_time=self.stamp_produce_time,
+                                    latency_tracking=self.latency_tracking,
+                                    latency_callback=self.latency_callback,
+                                    latency_report_interval_sec=self.latency_report_interval_sec,
+                                    rate_limiter=rate_limiter,
+                                    spill_dir=self.spill_dir,
+                                    spill_max_bytes=self.spill_max_bytes,
+                                    spill_segment_bytes=self.spill_segment_bytes,
+                                    backend=self.backend,
+                                    pack_records=self.pack_records,
+                                    pack_max_bytes=self.pack_max_bytes,
+                                    pack_linger_ms=self.pack_linger_ms,
+                                    keyed=self.keyed,
+                                    max_in_flight=self.max_in_flight)
@@ -0,0 +1,262 @@
+"""
+Load generator for Memphis stations, built on the producer API.
+
+Drives Producer.produce() at a target rate, or as fast as possible,
+with several producers and concurrent in-flight publishes, and reports
+the achieved rate and publish latency percentiles.
+
+Example:
+
+    $ python -m memphis.loadgen --host localhost --username testuser \\
+          --password "$PASSWORD" --station test-messages \\
+          --producers 4 --in-flight 32 --rate 20000 --duration 60 \\
+          --payload-size 512 --payload-distribution normal
+
+Run with -h for all options.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import random
+import time
+
+from ._internal import Memphis
+from ._internal.latency import LatencyHistogram
+
+FIXED = "fixed"
+UNIFORM = "uniform"
+NORMAL = "normal"
+
+DESCRIPTION_LENGTH = 20
+ASCII_START = 65 # uppercase A
+ASCII_END = 90 # uppercase Z
+
+
+class PayloadGenerator:
+    """Generates payloads of configurable size, or synthetic CDC events."""
+
+    def __init__(self, size: int, distribution: str = FIXED, max_size: int = None, cdc: bool = False):
+        self.size = size
+        self.distribution = distribution
+        self.max_size = max_size if max_size is not None else size * 2
+        self.cdc = cdc
+        # payloads are slices of one random buffer so that generating
+        # them does not limit the achievable rate
+        self._buffer = os.urandom(max(self.max_size, size) + 1)
+
+    def _next_size(self) -> int:
+        if self.distribution == UNIFORM:
+            return random.randint(1, self.max_size)
+        if self.distribution == NORMAL:
+            return min(max(int(random.gauss(self.size, self.size / 4)), 1), self.max_size)
+        return self.size
+
+    def _next_cdc_event(self) -> bytes:
+        creation_timestamp = dt.datetime.now()
+        todo_item = {
+            "creation_timestamp": creation_timestamp.isoformat(),
+            "due_date": None if random.random() >= 0.5 else creation_timestamp.date().isoformat(),
+            "description": "".join(chr(random.randint(ASCII_START, ASCII_END)) for i in range(DESCRIPTION_LENGTH)),
+            "completed": random.random() < 0.1,
+        }
+        cdc_event = {
+            "schema": None,
+            "payload": {
+                "before": json.dumps(todo_item),
+                "after": None,
+            },
+        }
+        return json.dumps(cdc_event).encode("utf-8")
+
+    def next(self) -> bytes:
+        if self.cdc:
+            return self._next_cdc_event()
+        return self._buffer[:self._next_size()]
+
+
+class LoadStats:
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.last_error = None
+
+    def record(self, size: int, latency_us: float):
+        self.sent += 1
+        self.bytes += size
+        self.latency.record(latency_us)
+
+
+class LoadGenerator:
+    """
+    Publishes messages from several producers, each with several
+    publishes in flight. With a target rate, message i is scheduled at
+    start + i / rate and its latency is measured from that point, so a
+    slow broker shows up in the percentiles instead of lowering the rate.
+    """
+
+    def __init__(self, producers, payloads: PayloadGenerator, rate: float = 0, in_flight: int = 1,
+                 count: int = None, duration_sec: float = None):
+        self.producers = producers
+        self.payloads = payloads
+        self.rate = rate
+        self.in_flight = in_flight
+        self.count = count
+        self.duration_sec = duration_sec
+        self.stats = LoadStats()
+        self._next_index = 0
+        self.started_at = None
+
+    def _take_index(self):
+        if self.count is not None and self._next_index >= self.count:
+            return None
+        if self.duration_sec is not None and time.perf_counter() - self.started_at >= self.duration_sec:
+            return None
+        index = self._next_index
+        self._next_index += 1
+        return index
+
+    async def _publish_loop(self, producer):
+        while True:
+            index = self._take_index()
+            if index is None:
+                return
+            scheduled_at = time.perf_counter()
+            if self.rate > 0:
+                scheduled_at = self.started_at + index / self.rate
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            payload = self.payloads.next()
+            try:
+                await producer.produce(payload)
+            except Exception as e:
+                self.stats.errors += 1
+                self.stats.last_error = e
+                continue
+            self.stats.record(len(payload), (time.perf_counter() - scheduled_at) * 1e6)
+
+    async def run(self):
+        self.started_at = time.perf_counter()
+        await asyncio.gather(*[self._publish_loop(producer)
+                               for producer in self.producers
+                               for _ in range(self.in_flight)])
+        return time.perf_counter() - self.started_at
+
+
+def format_report(stats: LoadStats, elapsed_sec: float) -> str:
+    elapsed_sec = max(elapsed_sec, 1e-9)
+    latency = stats.latency.report()
+    return (f"sent={stats.sent} errors={stats.errors} "
+            f"rate={stats.sent / elapsed_sec:.0f} msg/s "
+            f"throughput={stats.bytes / elapsed_sec / 1e6:.2f} MB/s "
+            f"latency p50={latency['p50_us'] / 1000:.2f}ms "
+            f"p99={latency['p99_us'] / 1000:.2f}ms "
+            f"p999={latency['p999_us'] / 1000:.2f}ms "
+            f"max={latency['max_us'] / 1000:.2f}ms")
+
+
+async def report_periodically(generator: LoadGenerator, interval_sec: float):
+    last_sent = 0
+    last_at = time.perf_counter()
+    while True:
+        await asyncio.sleep(interval_sec)
+        now = time.perf_counter()
+        sent = generator.stats.sent
+        print(f"[{now - generator.started_at:7.1f}s] {(sent - last_sent) / (now - last_at):.0f} msg/s, "
+              f"total sent={sent} errors={generator.stats.errors}")
+        last_sent = sent
+        last_at = now
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m memphis.loadgen",
+                                     description="Generate load on a Memphis station.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6666)
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", default="")
+    parser.add_argument("--connection-token", default="")
+    parser.add_argument("--account-id", type=int, default=1)
+    parser.add_argument("--station", required=True)
+    parser.add_argument("--producer-prefix", default="loadgen")
+    parser.add_argument("--producers", type=int, default=1, help="number of producers")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="number of connections the producers are spread over")
+    parser.add_argument("--in-flight", type=int, default=1, help="concurrent publishes per producer")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target messages per second over all producers, 0 for as fast as possible")
+    parser.add_argument("--count", type=int, default=None, help="number of messages to send")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run for")
+    parser.add_argument("--payload-size", type=int, default=256, help="payload size (mean size for normal)")
+    parser.add_argument("--payload-max-size", type=int, default=None,
+                        help="max payload size for uniform and normal, defaults to twice --payload-size")
+    parser.add_argument("--payload-distribution", choices=[FIXED, UNIFORM, NORMAL], default=FIXED)
+    parser.add_argument("--cdc", action="store_true", help="send synthetic JSON CDC events")
+    parser.add_argument("--compression", default=None, help="gzip, lz4 or zstd")
+    parser.add_argument("--stamp-produce-time", action="store_true",
+                        help="stamp messages for end-to-end latency tracking")
+    parser.add_argument("--report-interval", type=float, default=5, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+    if args.count is None and args.duration is None:
+        parser.error("one of --count or --duration is required")
+    return args
+
+
+async def run(args):
+    connections = []
+    try:
+        for _ in range(max(args.connections, 1)):
+            memphis = Memphis()
+            await memphis.connect(host=args.host,
+                                  port=args.port,
+                                  username=args.username,
+                                  password=args.password,
+                                  connection_token=args.connection_token,
+                                  account_id=args.account_id)
+            connections.append(memphis)
+
+        producers = []
+        for i in range(args.producers):
+            memphis = connections[i % len(connections)]
+            producers.append(await memphis.producer(station_name=args.station,
+                                                    producer_name=f"{args.producer_prefix}-{i}",
+                                                    generate_random_suffix=True,
+                                                    compression=args.compression,
+                                                    stamp_produce_time=args.stamp_produce_time))
+
+        payloads = PayloadGenerator(args.payload_size,
+                                    distribution=args.payload_distribution,
+                                    max_size=args.payload_max_size,
+                                    cdc=args.cdc)
+        generator = LoadGenerator(producers, payloads,
+                                  rate=args.rate,
+                                  in_flight=args.in_flight,
+                                  count=args.count,
+                                  duration_sec=args.duration)
+        reporter = asyncio.ensure_future(report_periodically(generator, args.report_interval))
+        try:
+            elapsed_sec = await generator.run()
+        finally:
+            reporter.cancel()
+
+        print(format_report(generator.stats, elapsed_sec))
+        if generator.stats.last_error is not None:
+            print("last error:", generator.stats.last_error)
+
+        for producer in producers:
+            await producer.destroy()
+    finally:
+        for memphis in connections:
+            await memphis.close()
+
+
+def main(argv=None):
+    asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
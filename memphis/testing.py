@@ -0,0 +1,454 @@
+"""
+In-process fake of a Memphis broker, for testing and profiling flows
+without a running broker or a network.
+
+FakeBroker keeps stations in memory and speaks the requests the client
+makes to the broker, so the real Memphis, Producer, Consumer and Message
+code runs on top of it: produce, fetch, ack, sequence numbers, headers,
+msg-id deduplication, redelivery after the ack wait, schema validation
+and dead-letter routing behave like against a broker. disconnect() and
+reconnect() simulate outages. ReplayBroker serves batches captured by
+MemphisInput instead.
+
+Example:
+
+    from memphis.connectors.bytewax import MemphisInput, MemphisOutput
+    from memphis.testing import FakeBroker
+
+    broker = FakeBroker()
+    broker.add_messages("in", [b"a", b"b"])
+
+    flow.input("inp", MemphisInput("localhost", "user", "pass", "in", "flow",
+                                   backend=broker.client))
+    flow.output("out", MemphisOutput("localhost", "user", "pass", "out", "flow",
+                                     backend=broker.client))
+
+    ...  # run the flow
+    assert broker.payloads("out") == [b"A", b"B"]
+"""
+# the fake client classes are the broker's other end and mirror the
+# signatures of the nats client, including arguments they ignore
+# pylint: disable=protected-access,unused-argument
+import asyncio
+import datetime as dt
+import json
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from ._internal.capture import read_capture
+from ._internal.memphis import Memphis
+from ._internal.utils import get_internal_name
+
+DEFAULT_MAX_PAYLOAD = 1024 * 1024
+
+_SequencePair = namedtuple("SequencePair", ["consumer", "stream"])
+_Metadata = namedtuple("Metadata", ["sequence", "num_pending", "num_delivered", "timestamp", "stream", "consumer", "domain"])
+_StreamState = namedtuple("StreamState", ["messages", "first_seq", "last_seq"])
+_StreamInfo = namedtuple("StreamInfo", ["state"])
+_ConsumerInfo = namedtuple("ConsumerInfo", ["stream_name", "name", "num_pending", "num_ack_pending"])
+_PubAck = namedtuple("PubAck", ["stream", "seq", "duplicate"])
+_Reply = namedtuple("Reply", ["data"])
+
+StoredMessage = namedtuple("StoredMessage", ["seq", "data", "headers", "time"])
+StoredMessage.__doc__ = "A message stored in a FakeBroker station."
+
+
+class FakeTimeoutError(Exception):
+    def __init__(self):
+        super().__init__("nats: timeout")
+
+
+class _Station:
+    def __init__(self, schema_update=None, schemaverse_to_dls=False):
+        self.messages = []
+        self.msg_ids = {}
+        self.first_seq = 1
+        self.consumers = {}
+        self.schema_update = schema_update if schema_update is not None else {}
+        self.schemaverse_to_dls = schemaverse_to_dls
+
+    @property
+    def last_seq(self):
+        return self.first_seq + len(self.messages) - 1
+
+    def get(self, seq):
+        index = seq - self.first_seq
+        if index < 0 or index >= len(self.messages):
+            return None
+        return self.messages[index]
+
+
+class _DurableConsumer:
+    def __init__(self, next_seq, max_ack_time_sec, max_deliveries):
+        self.next_seq = next_seq
+        self.delivered = 0
+        self.max_ack_time_sec = max_ack_time_sec
+        self.max_deliveries = max_deliveries
+        # seq -> [ack deadline, deliveries]
+        self.pending = {}
+
+
+class FakeBroker:
+    """
+    Stations, consumers and dead-letter messages of a fake broker.
+
+    A FakeBroker can be shared by clients on several threads, e.g. the
+    workers of a Bytewax flow.
+
+    Args:
+        max_payload (int): max payload size reported to clients.
+        fetch_wait_sec (float): how long a fetch waits for messages when
+            none are available before timing out.
+    """
+
+    def __init__(self, max_payload: int = DEFAULT_MAX_PAYLOAD, fetch_wait_sec: float = 0.01):
+        self.max_payload = max_payload
+        self.fetch_wait_sec = fetch_wait_sec
+        self.dls_messages = []
+        self.poison_messages = []
+        self.available = True
+        self._stations = {}
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def client(self):
+        """Returns a new Memphis client connected to this broker on connect()."""
+        return FakeMemphis(self)
+
+    def create_station(self, name: str, schema_update=None, schemaverse_to_dls: bool = False):
+        """Creates a station, optionally with a schema as sent to producers."""
+        with self._lock:
+            self._stations[get_internal_name(name)] = _Station(schema_update, schemaverse_to_dls)
+
+    def _station(self, internal_name):
+        station = self._stations.get(internal_name)
+        if station is None:
+            station = _Station()
+            self._stations[internal_name] = station
+        return station
+
+    def disconnect(self):
+        """
+        Makes the broker unreachable: requests fail and connected clients
+        see their connection as lost, like NATS reports it, until
+        reconnect() is called.
+        """
+        self.available = False
+        for memphis in list(self._connections):
+            if memphis.is_connection_active:
+                memphis.is_connection_active = False
+                memphis.disconnections += 1
+
+    def reconnect(self):
+        """Makes the broker reachable again, and reconnects the clients."""
+        self.available = True
+        for memphis in list(self._connections):
+            if not memphis.is_connection_closed:
+                memphis.is_connection_active = True
+
+    def add_messages(self, station_name: str, payloads, headers=None):
+        """Stores payloads in a station as if they were produced."""
+        with self._lock:
+            station = self._station(get_internal_name(station_name))
+            for payload in payloads:
+                self._store(station, bytes(payload), dict(headers or {}))
+
+    def messages(self, station_name: str):
+        """Returns the StoredMessages of a station."""
+        with self._lock:
+            return list(self._station(get_internal_name(station_name)).messages)
+
+    def payloads(self, station_name: str):
+        return [msg.data for msg in self.messages(station_name)]
+
+    def _store(self, station, data, headers):
+        msg_id = headers.get("msg-id")
+        if msg_id is not None and msg_id in station.msg_ids:
+            return station.msg_ids[msg_id], True
+        seq = station.last_seq + 1
+        station.messages.append(StoredMessage(seq, data, headers, dt.datetime.now(dt.timezone.utc)))
+        if msg_id is not None:
+            station.msg_ids[msg_id] = seq
+        return seq, False
+
+    def _publish(self, internal_name, data, headers):
+        with self._lock:
+            seq, duplicate = self._store(self._station(internal_name), bytes(data), dict(headers or {}))
+        return _PubAck(internal_name, seq, duplicate)
+
+    def _create_consumer(self, req):
+        with self._lock:
+            station = self._station(get_internal_name(req["station_name"]))
+            durable = get_internal_name(req["consumers_group"] or req["name"])
+            if durable in station.consumers:
+                return
+            next_seq = max(req["start_consume_from_sequence"], station.first_seq)
+            if req["last_messages"] >= 0:
+                next_seq = max(station.last_seq - req["last_messages"] + 1, station.first_seq)
+            station.consumers[durable] = _DurableConsumer(next_seq,
+                                                          req["max_ack_time_ms"] / 1000,
+                                                          req["max_msg_deliveries"])
+
+    def _fetch(self, client, internal_name, durable, batch_size):
+        with self._lock:
+            station = self._station(internal_name)
+            consumer = station.consumers.get(durable)
+            if consumer is None:
+                raise Exception("nats: consumer not found")
+            now = time.monotonic()
+            seqs = []
+            for seq, state in list(consumer.pending.items()):
+                if len(seqs) >= batch_size:
+                    break
+                if state[0] > now:
+                    continue
+                if state[1] >= consumer.max_deliveries:
+                    del consumer.pending[seq]
+                    self.poison_messages.append((internal_name, durable, station.get(seq)))
+                    continue
+                seqs.append(seq)
+            first_new_seq = consumer.next_seq
+            while len(seqs) < batch_size and consumer.next_seq <= station.last_seq:
+                seqs.append(consumer.next_seq)
+                consumer.pending[consumer.next_seq] = [0, 0]
+                consumer.next_seq += 1
+
+            msgs = []
+            for seq in seqs:
+                state = consumer.pending[seq]
+                state[0] = now + consumer.max_ack_time_sec
+                state[1] += 1
+                consumer.delivered += 1
+                stored = station.get(seq)
+                # messages after this one that were not delivered yet
+                num_pending = station.last_seq - max(seq, first_new_seq - 1)
+                metadata = _Metadata(_SequencePair(consumer.delivered, seq), num_pending,
+                                     state[1], stored.time, internal_name, durable, None)
+                msgs.append(_FakeMsg(client, internal_name, durable, stored, metadata))
+            return msgs
+
+    def _ack(self, internal_name, durable, seq):
+        with self._lock:
+            consumer = self._station(internal_name).consumers.get(durable)
+            if consumer is not None:
+                consumer.pending.pop(seq, None)
+
+    def _request(self, subject, data):
+        req = json.loads(data) if len(data) > 0 else {}
+        if subject == "$memphis_producer_creations":
+            with self._lock:
+                station = self._station(get_internal_name(req["station_name"]))
+                return json.dumps({"error": "",
+                                   "schema_update": station.schema_update,
+                                   "schemaverse_to_dls": station.schemaverse_to_dls}).encode("utf-8")
+        if subject == "$memphis_consumer_creations":
+            self._create_consumer(req)
+            return b""
+        if subject in ("$memphis_producer_destructions", "$memphis_consumer_destructions"):
+            return b""
+        if subject.startswith("$JS.API.STREAM.MSG.GET."):
+            with self._lock:
+                station = self._station(subject[len("$JS.API.STREAM.MSG.GET."):])
+                seq = max(req["seq"], station.first_seq)
+                stored = station.get(seq)
+            if stored is None:
+                return json.dumps({"error": {"code": 404, "description": "no message found"}}).encode("utf-8")
+            return json.dumps({"message": {"seq": stored.seq,
+                                           "time": stored.time.isoformat().replace("+00:00", "Z")}}).encode("utf-8")
+        raise Exception(f"nats: no responders available for request to {subject}")
+
+    def _handle_publish(self, subject, data):
+        if subject == "$memphis_schemaverse_dls":
+            with self._lock:
+                self.dls_messages.append(json.loads(data))
+
+    def _stream_info(self, internal_name):
+        with self._lock:
+            station = self._stations.get(internal_name)
+            if station is None:
+                raise Exception("nats: stream not found")
+            return _StreamInfo(_StreamState(len(station.messages), station.first_seq, station.last_seq))
+
+    def _consumer_info(self, internal_name, durable):
+        with self._lock:
+            station = self._stations.get(internal_name)
+            consumer = station.consumers.get(durable) if station is not None else None
+            if consumer is None:
+                raise Exception("nats: consumer not found")
+            return _ConsumerInfo(internal_name, durable, station.last_seq - consumer.next_seq + 1, len(consumer.pending))
+
+
+class ReplayBroker(FakeBroker):
+    """
+    A FakeBroker whose consumers get the batches of a capture file, as
+    written by MemphisInput with capture_dir, instead of stored messages.
+
+    Batches are fetched as they were captured, with their payloads,
+    headers, sequence numbers and delivery counts, whatever the station
+    or consumer. With speed set, a batch is only handed out once its
+    capture time, divided by speed, passed since the first fetch; with
+    speed None, batches are replayed as fast as they are fetched. Acks
+    are accepted and ignored.
+
+    Args:
+        path (str): the capture file.
+        speed (float): replay speed relative to the capture, None for as
+            fast as possible.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, max_payload: int = DEFAULT_MAX_PAYLOAD):
+        super().__init__(max_payload=max_payload, fetch_wait_sec=0.001)
+        self.speed = speed
+        self._batches = read_capture(path)
+        self._next_batch = next(self._batches, None)
+        self._started_at = None
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether every captured batch was fetched."""
+        return self._next_batch is None
+
+    def _fetch(self, client, internal_name, durable, batch_size):
+        with self._lock:
+            if self._next_batch is None:
+                return []
+            elapsed_ns, captured = self._next_batch
+            now = time.monotonic()
+            if self._started_at is None:
+                self._started_at = now
+            if self.speed is not None and now - self._started_at < elapsed_ns / 1e9 / self.speed:
+                return []
+            self._next_batch = next(self._batches, None)
+
+        msgs = []
+        for captured_msg in captured:
+            stored_at = None
+            if captured_msg.stored_at_ns is not None:
+                stored_at = dt.datetime.fromtimestamp(captured_msg.stored_at_ns / 1e9, dt.timezone.utc)
+            stored = StoredMessage(captured_msg.seq, captured_msg.data, captured_msg.headers, stored_at)
+            metadata = _Metadata(_SequencePair(captured_msg.seq, captured_msg.seq), captured_msg.num_pending,
+                                 captured_msg.num_delivered, stored_at, internal_name, durable, None)
+            msgs.append(_FakeMsg(client, internal_name, durable, stored, metadata))
+        return msgs
+
+
+class _FakeMsg:
+    def __init__(self, client, internal_name, durable, stored, metadata):
+        self._client = client
+        self._internal_name = internal_name
+        self._durable = durable
+        self.data = stored.data
+        self.headers = stored.headers
+        self.metadata = metadata
+
+    async def ack(self):
+        self._client.check_connected()
+        self._client.broker._ack(self._internal_name, self._durable, self.metadata.sequence.stream)
+
+
+class _FakeSubscription:
+    def __init__(self):
+        self._queue = asyncio.Queue()
+
+    @property
+    def messages(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            yield await self._queue.get()
+
+    async def unsubscribe(self):
+        return
+
+
+class _FakePullSubscription:
+    def __init__(self, client, internal_name, durable):
+        self._client = client
+        self._internal_name = internal_name
+        self._durable = durable
+
+    async def fetch(self, batch=1, timeout=5):
+        self._client.check_connected()
+        broker = self._client.broker
+        msgs = broker._fetch(self._client, self._internal_name, self._durable, batch)
+        if len(msgs) == 0:
+            await asyncio.sleep(min(broker.fetch_wait_sec, timeout))
+            msgs = broker._fetch(self._client, self._internal_name, self._durable, batch)
+        if len(msgs) == 0:
+            raise FakeTimeoutError()
+        return msgs
+
+    async def unsubscribe(self):
+        return
+
+
+class _FakeJetStream:
+    def __init__(self, client):
+        self._client = client
+
+    async def publish(self, subject, payload=b"", timeout=None, stream=None, headers=None):
+        self._client.check_connected()
+        return self._client.broker._publish(subject.rsplit(".", 1)[0], payload, headers)
+
+    async def pull_subscribe(self, subject, durable=None, stream=None, config=None):
+        self._client.check_connected()
+        return _FakePullSubscription(self._client, subject.rsplit(".", 1)[0], durable)
+
+    async def stream_info(self, name):
+        self._client.check_connected()
+        return self._client.broker._stream_info(name)
+
+    async def consumer_info(self, stream, consumer):
+        self._client.check_connected()
+        return self._client.broker._consumer_info(stream, consumer)
+
+
+class _FakeClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+
+    @property
+    def max_payload(self):
+        return self.broker.max_payload
+
+    def check_connected(self):
+        if self.is_closed:
+            raise Exception("nats: connection closed")
+        if not self.broker.available:
+            raise Exception("nats: timeout")
+
+    def jetstream(self):
+        return _FakeJetStream(self)
+
+    async def request(self, subject, payload=b"", timeout=0.5, headers=None):
+        self.check_connected()
+        return _Reply(self.broker._request(subject, payload))
+
+    async def publish(self, subject, payload=b"", reply="", headers=None):
+        self.check_connected()
+        self.broker._handle_publish(subject, payload)
+
+    async def subscribe(self, subject, queue="", cb=None):
+        self.check_connected()
+        return _FakeSubscription()
+
+    async def close(self):
+        self.is_closed = True
+
+
+class FakeMemphis(Memphis):
+    """A Memphis client that connects to a FakeBroker instead of a broker."""
+
+    def __init__(self, broker: FakeBroker = None):
+        super().__init__()
+        self.broker = broker if broker is not None else FakeBroker()
+
+    async def get_broker_manager_connection(self, connection_opts):
+        if not self.broker.available:
+            raise Exception("nats: no servers available for connection")
+        self.broker._connections.add(self)
+        return _FakeClient(self.broker)
@@ -0,0 +1,31 @@
+"""
+Tracing of the client's fetches, acks, produces, control plane requests
+and reconnects, to find where latency spikes of a flow come from.
+
+Tracing is off until an exporter is set; spans are then passed to the
+exporter as they end. While it is off, instrumented calls only pay for
+a function call and an empty with block.
+
+Trace context crosses the broker in a W3C traceparent header: produced
+messages carry the context of their produce span, and the acks of
+fetched messages are traced as its children.
+
+Example:
+
+    from memphis import tracing
+
+    exporter = tracing.InMemoryExporter()
+    tracing.set_exporter(exporter)
+
+    ...  # run the flow
+    for span in exporter.spans:
+        print(span.name, (span.end_ns - span.start_ns) / 1e6, span.attributes)
+
+Spans can be written to a file of JSON lines with FileExporter, or
+passed on to OpenTelemetry with OpenTelemetryExporter.
+"""
+from ._internal.tracing import (TRACEPARENT_HEADER, FileExporter, InMemoryExporter, OpenTelemetryExporter, Span,
+                                SpanContext, is_enabled, set_exporter, start_span)
+
+__all__ = ["TRACEPARENT_HEADER", "FileExporter", "InMemoryExporter", "OpenTelemetryExporter", "Span", "SpanContext",
+           "is_enabled", "set_exporter", "start_span"]
@@ -19,6 +19,11 @@ setup(
     url="https://github.com/memphisdev/memphis-bytewax-connectors",
     keywords=["message broker", "devtool", "streaming", "data"],
     install_requires=["asyncio", "nats-py >= 2.3.0", "bytewax >= 0.16.0"],
+    extras_require={
+        "lz4": ["lz4"],
+        "zstd": ["zstandard"],
+        "schemaverse": ["fastjsonschema", "graphql-core", "protobuf"],
+    },
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from memphis.testing import FakeBroker
+
+
+@pytest.fixture(name="loop", autouse=True)
+def event_loop_per_test():
+    # sources run on the thread's event loop, like in a Bytewax worker
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    # stop what the clients left running before closing the loop
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(_gather(tasks))
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+async def _gather(tasks):
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture(name="broker")
+def fake_broker():
+    return FakeBroker()
@@ -0,0 +1,37 @@
+import time
+
+from memphis.connectors.bytewax import MemphisInput, MemphisOutput
+
+
+def build_source(broker, station, resume_state=None, **kwargs):
+    return MemphisInput("localhost", "user", "pass", station, "test", backend=broker.client,
+                        **kwargs).build_part("0", resume_state)
+
+
+def build_sink(broker, station, **kwargs):
+    return MemphisOutput("localhost", "user", "pass", station, "test", backend=broker.client,
+                         **kwargs).build(0, 1)
+
+
+def read(source, count, timeout_sec=5):
+    """Returns the next count items a source emits."""
+    items = []
+    deadline = time.monotonic() + timeout_sec
+    while len(items) < count:
+        assert time.monotonic() < deadline, f"only {len(items)} of {count} items were emitted"
+        item = source.next()
+        if item is not None:
+            items.append(bytes(item))
+    return items
+
+
+def read_all(source, timeout_sec=0.3):
+    """Returns the items a source emits until it stays idle for timeout_sec."""
+    items = []
+    idle_since = time.monotonic()
+    while time.monotonic() - idle_since < timeout_sec:
+        item = source.next()
+        if item is not None:
+            items.append(bytes(item))
+            idle_since = time.monotonic()
+    return items
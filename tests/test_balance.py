@@ -0,0 +1,61 @@
+import pytest
+
+from memphis._internal import MemphisError
+from memphis._internal.balance import write_load
+from memphis.connectors.bytewax import MemphisInput
+from memphis.testing import FakeBroker
+
+from .helpers import build_sink, read_all
+
+
+def _split_input(broker, **kwargs):
+    return MemphisInput("localhost", "user", "pass", ["hot", "cold"], "test", backend=broker.client,
+                        consumers=4, **kwargs)
+
+
+def test_split_parts_are_fixed_for_a_run(broker, tmp_path):
+    write_load(str(tmp_path), "hot.0", "hot", {"pending": 6000, "fetch_rate": 50.0})
+    write_load(str(tmp_path), "cold.0", "cold", {"pending": 0, "fetch_rate": 5.0})
+    split = _split_input(broker, load_dir=str(tmp_path))
+    assert split.list_parts() == {"hot.0", "hot.1", "hot.2", "cold.0", "cold.1", "cold.2"}
+    assert split.assignment() == {"hot": 3, "cold": 1}
+
+    # loads the running partitions save only apply to the next run
+    write_load(str(tmp_path), "cold.0", "cold", {"pending": 90000, "fetch_rate": 50.0})
+    assert split.assignment() == {"hot": 3, "cold": 1}
+    assert _split_input(broker, load_dir=str(tmp_path)).assignment() == {"hot": 1, "cold": 3}
+
+
+def test_split_parts_share_their_station(broker):
+    broker.add_messages("hot", [b"h%d" % i for i in range(50)])
+    broker.add_messages("cold", [b"c%d" % i for i in range(10)])
+    split = _split_input(broker, station_weights={"hot": 3, "cold": 1})
+    parts = {part: split.build_part(part, 7) for part in sorted(split.list_parts())}
+    built = {part: source for part, source in parts.items() if source is not None}
+    assert sorted(built) == ["cold.0", "hot.0", "hot.1", "hot.2"]
+
+    emitted = []
+    for source in built.values():
+        emitted.extend(read_all(source))
+        # the group's acks on the broker are the resume state
+        assert source.snapshot() is None
+        source.close()
+    assert sorted(emitted) == sorted(broker.payloads("hot") + broker.payloads("cold"))
+
+
+def test_split_parts_reject_chunked_messages():
+    broker = FakeBroker(max_payload=1024)
+    sink = build_sink(broker, "hot")
+    sink.write(b"x" * 5000)
+    sink.close()
+    split = _split_input(broker)
+    source = split.build_part("hot.0", None)
+    with pytest.raises(MemphisError, match="chunked"):
+        read_all(source)
+
+
+@pytest.mark.parametrize("option", [{"replay_messages": True}, {"replay_last_messages": 10},
+                                    {"replay_range": (1, None)}, {"persist_dedup": True}])
+def test_split_rejects_resume_options(broker, option):
+    with pytest.raises(MemphisError, match="several stations or consumers"):
+        _split_input(broker, **option)
@@ -0,0 +1,64 @@
+import asyncio
+
+from memphis.testing import FakeBroker
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_produce_fetch_ack(broker):
+    async def run():
+        memphis = broker.client()
+        await memphis.connect(host="localhost", username="user", password="pass")
+        producer = await memphis.producer(station_name="events", producer_name="p")
+        for i in range(5):
+            await producer.produce(b"m%d" % i, headers=None)
+        consumer = await memphis.consumer(station_name="events", consumer_name="c", consumer_group="g")
+        batch = await consumer.fetch(batch_size=10)
+        for msg in batch:
+            await msg.ack()
+        again = await consumer.fetch(batch_size=10)
+        await memphis.close()
+        return batch, again
+
+    batch, again = _run(run())
+    assert [bytes(msg.get_data()) for msg in batch] == [b"m%d" % i for i in range(5)]
+    assert [msg.get_sequence_number() for msg in batch] == [1, 2, 3, 4, 5]
+    assert len(again) == 0
+    assert broker.payloads("events") == [b"m%d" % i for i in range(5)]
+
+
+def test_msg_id_deduplication(broker):
+    async def run():
+        memphis = broker.client()
+        await memphis.connect(host="localhost", username="user", password="pass")
+        producer = await memphis.producer(station_name="events", producer_name="p")
+        await producer.produce(b"first", msg_id="1")
+        await producer.produce(b"again", msg_id="1")
+        await producer.produce(b"second", msg_id="2")
+        await memphis.close()
+
+    _run(run())
+    assert broker.payloads("events") == [b"first", b"second"]
+
+
+def test_unacked_messages_are_redelivered():
+    broker = FakeBroker()
+    broker.add_messages("events", [b"a", b"b"])
+
+    async def run():
+        memphis = broker.client()
+        await memphis.connect(host="localhost", username="user", password="pass")
+        consumer = await memphis.consumer(station_name="events", consumer_name="c", consumer_group="g",
+                                          max_ack_time_ms=50)
+        first = await consumer.fetch(batch_size=10)
+        await first[0].ack()
+        await asyncio.sleep(0.1)
+        redelivered = await consumer.fetch(batch_size=10)
+        await memphis.close()
+        return redelivered
+
+    redelivered = _run(run())
+    assert [bytes(msg.get_data()) for msg in redelivered] == [b"b"]
+    assert redelivered[0].get_num_delivered() == 2
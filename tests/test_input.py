@@ -0,0 +1,273 @@
+import asyncio
+import json
+import sys
+import time
+
+import pytest
+
+from memphis._internal import MemphisError, MemphisSchemaError
+from memphis._internal import compression
+from memphis._internal.compression import COMPRESSION_HEADER
+from memphis.connectors.bytewax import MemphisInput
+from memphis.testing import FakeBroker
+
+from .helpers import build_sink, build_source, read, read_all
+
+# a schema for compile_validator to be called with, validators are patched in
+SCHEMA = {"type": "json", "active_version": {"schema_content": json.dumps({})}}
+
+
+@pytest.mark.parametrize("codec, module", [("gzip", "gzip"), ("lz4", "lz4.frame"), ("zstd", "zstandard")])
+def test_compressed_payloads_round_trip(broker, codec, module):
+    pytest.importorskip(module)
+    payloads = [b"record %d " % i * 50 for i in range(20)]
+    sink = build_sink(broker, "events", compression=codec, compression_threshold=100)
+    for payload in payloads:
+        sink.write(payload)
+    sink.close()
+
+    stored = broker.messages("events")
+    assert all(msg.headers.get(COMPRESSION_HEADER) == codec for msg in stored)
+    assert all(len(msg.data) < len(payload) for msg, payload in zip(stored, payloads))
+
+    source = build_source(broker, "events")
+    assert read(source, len(payloads)) == payloads
+    source.close()
+
+
+def test_undecodable_payloads_are_acked_and_skipped(broker, monkeypatch):
+    # the consumer does not have lz4 installed
+    monkeypatch.setitem(sys.modules, "lz4", None)
+    monkeypatch.setattr(compression, "_codecs", {})
+    broker.add_messages("events", [b"a"])
+    broker.add_messages("events", [b"lz4 frame"], headers={COMPRESSION_HEADER: "lz4"})
+    broker.add_messages("events", [b"corrupt gzip"], headers={COMPRESSION_HEADER: "gzip"})
+    broker.add_messages("events", [b"b"])
+
+    source = build_source(broker, "events")
+    assert read_all(source) == [b"a", b"b"]
+    assert source.stats()["undecodable"] == 2
+    # they are acked, a restart does not fetch them again
+    assert source.snapshot() == 4
+    source.close()
+
+
+def test_chunked_payloads_are_reassembled():
+    broker = FakeBroker(max_payload=1024)
+    payloads = [bytes([i]) * 5000 for i in range(3)] + [b"small"]
+    sink = build_sink(broker, "events")
+    for payload in payloads:
+        sink.write(payload)
+    sink.close()
+    assert len(broker.payloads("events")) > len(payloads)
+
+    source = build_source(broker, "events")
+    assert read(source, len(payloads)) == payloads
+    # every chunk was acked once its message was emitted
+    assert source.snapshot() == len(broker.payloads("events"))
+    source.close()
+
+
+def test_duplicate_payloads_are_dropped(broker):
+    broker.add_messages("events", [b"a", b"b", b"a", b"c", b"b"])
+    source = build_source(broker, "events", dedup="payload")
+    assert read_all(source) == [b"a", b"b", b"c"]
+    assert source.stats()["duplicates"] == 2
+    source.close()
+
+
+def test_dedup_window_survives_a_restart(broker):
+    broker.add_messages("events", [b"a", b"b"])
+    source = build_source(broker, "events", dedup="payload", persist_dedup=True)
+    assert read(source, 2) == [b"a", b"b"]
+    state = source.snapshot()
+    source.close()
+
+    broker.add_messages("events", [b"a", b"c"])
+    source = build_source(broker, "events", resume_state=state, dedup="payload", persist_dedup=True)
+    assert read_all(source) == [b"c"]
+    source.close()
+
+
+def test_header_filter_drops_messages_before_emitting(broker):
+    broker.add_messages("events", [b"keep 1"], headers={"type": "order"})
+    broker.add_messages("events", [b"drop 1", b"drop 2"], headers={"type": "audit"})
+    broker.add_messages("events", [b"keep 2"], headers={"type": "order"})
+    source = build_source(broker, "events", header_filter=lambda headers: headers.get("type") == "order")
+    assert read_all(source) == [b"keep 1", b"keep 2"]
+    assert source.stats()["filtered"] == 2
+    # filtered messages were acked, so they do not hold the resume state back
+    assert source.snapshot() == 4
+    source.close()
+
+
+def test_packed_records_resume_mid_pack(broker):
+    records = [b"r%d" % i for i in range(25)]
+    sink = build_sink(broker, "events", pack_records=10)
+    for record in records:
+        sink.write(record)
+    sink.close()
+    assert len(broker.payloads("events")) == 3
+
+    source = build_source(broker, "events")
+    assert read(source, 13) == records[:13]
+    state = source.snapshot()
+    source.close()
+
+    source = build_source(broker, "events", resume_state=state)
+    assert read_all(source) == records[13:]
+    source.close()
+
+
+def test_packed_records_resume_at_pack_boundary(broker):
+    records = [b"r%d" % i for i in range(20)]
+    sink = build_sink(broker, "events", pack_records=10)
+    for record in records:
+        sink.write(record)
+    sink.close()
+    assert len(broker.payloads("events")) == 2
+
+    source = build_source(broker, "events")
+    assert read(source, 10) == records[:10]
+    state = source.snapshot()
+    source.close()
+    # the whole first pack completed, the watermark is enough
+    assert state == 1
+
+    source = build_source(broker, "events", resume_state=state)
+    assert read_all(source) == records[10:]
+    source.close()
+
+
+def test_restarts_without_progress_keep_the_resume_state(broker):
+    broker.add_messages("events", [b"a", b"b", b"c"])
+    source = build_source(broker, "events")
+    assert read_all(source) == [b"a", b"b", b"c"]
+    state = source.snapshot()
+    source.close()
+    assert state == 3
+
+    for _ in range(3):
+        source = build_source(broker, "events", resume_state=state)
+        assert len(read_all(source)) == 0
+        assert source.snapshot() == state
+        source.close()
+
+
+def test_restarts_without_progress_keep_the_pack_resume_state(broker):
+    records = [b"r%d" % i for i in range(10)]
+    sink = build_sink(broker, "events", pack_records=10)
+    for record in records:
+        sink.write(record)
+    sink.close()
+
+    source = build_source(broker, "events")
+    assert read(source, 4) == records[:4]
+    state = source.snapshot()
+    source.close()
+    assert state["seq"] == 1
+
+    for _ in range(3):
+        # restarted before the packed message was fetched again
+        source = build_source(broker, "events", resume_state=state)
+        assert source.snapshot() == state
+        source.close()
+
+    source = build_source(broker, "events", resume_state=state)
+    assert read_all(source) == records[state["skip"]:]
+    source.close()
+
+
+def test_close_closes_the_connection(broker, loop):
+    broker.add_messages("events", [b"a"])
+    clients = []
+
+    def backend():
+        clients.append(broker.client())
+        return clients[-1]
+
+    source = MemphisInput("localhost", "user", "pass", "events", "test", backend=backend).build_part("0", None)
+    assert read(source, 1) == [b"a"]
+    source.close()
+    assert all(client.is_connection_closed for client in clients)
+    # cancelled tasks finish the next time the loop runs
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert len(asyncio.all_tasks(loop)) == 0
+
+
+def test_packed_records_resume_after_a_dropped_record(broker, monkeypatch):
+    def reject_r1(_schema_update):
+        def validate(message):
+            if bytes(message) == b"r1":
+                raise MemphisSchemaError("r1 is invalid")
+        return validate
+
+    # the output validates records too
+    monkeypatch.setattr("memphis._internal.memphis.compile_validator", lambda _schema_update: None)
+    broker.create_station("events", schema_update=SCHEMA)
+    records = [b"r%d" % i for i in range(10)]
+    sink = build_sink(broker, "events", pack_records=10)
+    for record in records:
+        sink.write(record)
+    sink.close()
+    monkeypatch.setattr("memphis._internal.memphis.compile_validator", reject_r1)
+
+    source = build_source(broker, "events", validate_schema=True)
+    assert read(source, 3) == [b"r0", b"r2", b"r3"]
+    state = source.snapshot()
+    source.close()
+    assert state == {"seq": 1, "skip": 4}
+
+    source = build_source(broker, "events", resume_state=state, validate_schema=True)
+    assert read_all(source) == records[4:]
+    source.close()
+
+
+def _read_until_stop(source, timeout_sec=5):
+    items = []
+    deadline = time.monotonic() + timeout_sec
+    with pytest.raises(StopIteration):
+        while time.monotonic() < deadline:
+            item = source.next()
+            if item is not None:
+                items.append(bytes(item))
+    return items
+
+
+def test_replay_range_stops_at_its_stop_sequence(broker):
+    payloads = [b"%d" % seq for seq in range(1, 11)]
+    broker.add_messages("events", payloads)
+    source = build_source(broker, "events", replay_range=(3, 6))
+    assert _read_until_stop(source) == payloads[2:6]
+    assert source.snapshot() == 6
+    source.close()
+
+
+def test_restarted_replay_range_continues_where_it_stopped(broker):
+    payloads = [b"%d" % seq for seq in range(1, 11)]
+    broker.add_messages("events", payloads)
+    source = build_source(broker, "events", replay_range=(3, 6))
+    assert read(source, 2) == payloads[2:4]
+    state = source.snapshot()
+    source.close()
+
+    source = build_source(broker, "events", resume_state=state, replay_range=(3, 6))
+    assert _read_until_stop(source) == payloads[4:6]
+    source.close()
+
+    # a finished backfill stops right away
+    source = build_source(broker, "events", resume_state=6, replay_range=(3, 6))
+    assert len(_read_until_stop(source)) == 0
+    source.close()
+
+
+def test_replay_range_without_stop_keeps_consuming(broker):
+    broker.add_messages("events", [b"a", b"b", b"c"])
+    source = build_source(broker, "events", replay_range=(2, None))
+    assert read_all(source) == [b"b", b"c"]
+    source.close()
+
+
+def test_replay_range_is_checked():
+    with pytest.raises(MemphisError):
+        MemphisInput("localhost", "user", "pass", "events", "test", replay_range=(5, 4))
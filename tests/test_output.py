@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from memphis._internal import MemphisError, MemphisSchemaError
+from memphis._internal.producer import Producer
+
+from .helpers import build_sink
+
+ORDER_SCHEMA = {
+    "type": "json",
+    "active_version": {"schema_content": json.dumps({"required": ["id"]})},
+}
+
+
+def _require_id(_schema_update):
+    def validate(message):
+        if "id" not in json.loads(message):
+            raise MemphisSchemaError("id is required")
+    return validate
+
+
+def _wait_for(condition, timeout_sec=5):
+    deadline = time.monotonic() + timeout_sec
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_failed_key_does_not_block_other_keys(broker, monkeypatch):
+    monkeypatch.setattr("memphis._internal.memphis.compile_validator", _require_id)
+    broker.create_station("orders", schema_update=ORDER_SCHEMA)
+    good = [b'{"id": %d}' % i for i in range(10)]
+    sink = build_sink(broker, "orders", keyed=True)
+    sink.write(("bad", b'{"name": "no id"}'))
+    for i, payload in enumerate(good):
+        sink.write(("a" if i % 2 == 0 else "b", payload))
+        sink.write(("bad", b'{"id": %d}' % (100 + i)))
+
+    _wait_for(lambda: len(broker.payloads("orders")) == len(good))
+    assert broker.payloads("orders") == good
+    with pytest.raises(MemphisError, match="failed for 1 keys, 10 items were dropped"):
+        sink.close()
+
+
+def test_keyed_items_are_published_while_idle(broker, monkeypatch):
+    produce = Producer.produce
+
+    async def slow_produce(self, *args, **kwargs):
+        await asyncio.sleep(0.01)
+        return await produce(self, *args, **kwargs)
+
+    monkeypatch.setattr(Producer, "produce", slow_produce)
+    payloads = [b"m%d" % i for i in range(10)]
+    sink = build_sink(broker, "events", keyed=True)
+    for payload in payloads:
+        sink.write(("key", payload))
+
+    _wait_for(lambda: len(broker.payloads("events")) == len(payloads))
+    assert broker.payloads("events") == payloads
+    sink.close()
+
+
+def test_lingering_pack_is_published_while_idle(broker):
+    sink = build_sink(broker, "events", pack_records=10, pack_linger_ms=50)
+    sink.write(b"only")
+
+    _wait_for(lambda: len(broker.payloads("events")) == 1)
+    sink.close()
+    assert len(broker.payloads("events")) == 1
@@ -0,0 +1,27 @@
+import time
+
+from .helpers import build_source, read, read_all
+
+
+def upper_without_multiples_of_three(payloads):
+    # run in the pool's processes, which import it from this module
+    if payloads[0] == b"r00":
+        # the first batch finishes after the ones fetched ahead of it
+        time.sleep(0.5)
+    return [None if int(payload[1:]) % 3 == 0 else payload.upper() for payload in payloads]
+
+
+def test_pool_results_are_emitted_in_fetch_order(broker):
+    payloads = [b"r%02d" % i for i in range(20)]
+    broker.add_messages("events", payloads)
+    source = build_source(broker, "events", batch_size=2, batch_transform=upper_without_multiples_of_three,
+                          transform_processes=2, transform_max_in_flight=4)
+
+    expected = [payload.upper() for i, payload in enumerate(payloads) if i % 3 != 0]
+    # the pool's processes take a while to start
+    assert read(source, len(expected), timeout_sec=30) == expected
+    assert len(read_all(source)) == 0
+    # records the transform dropped are acked too
+    assert source.stats()["filtered"] == 7
+    assert source.snapshot() == 20
+    source.close()
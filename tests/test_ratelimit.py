@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from memphis._internal import MemphisError
+from memphis._internal import ratelimit
+from memphis._internal.ratelimit import RateLimiter, TokenBucket, get_shared_rate_limiter
+
+from .helpers import build_sink
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture(name="clock")
+def fake_clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_bucket_goes_into_debt(clock):
+    bucket = TokenBucket(10)
+    assert bucket.reserve(10) == 0
+    # larger than the bucket, waits until it is paid back at the rate
+    assert bucket.reserve(20) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+def test_sinks_of_a_group_share_the_limits(broker):
+    limits = {"max_msgs_per_sec": 20, "rate_limit_group": "test_sinks_of_a_group_share_the_limits"}
+    sinks = [build_sink(broker, "events", **limits), build_sink(broker, "events", **limits)]
+    started_at = time.monotonic()
+    # the first second of tokens is free, the next 10 messages take half a second
+    for i in range(30):
+        sinks[i % 2].write(b"%d" % i)
+    elapsed = time.monotonic() - started_at
+    for sink in sinks:
+        sink.close()
+    assert len(broker.payloads("events")) == 30
+    assert elapsed >= 0.4
+
+
+def test_group_can_not_be_reconfigured():
+    group = "test_group_can_not_be_reconfigured"
+    limiter = get_shared_rate_limiter(group, msgs_per_sec=10)
+    assert get_shared_rate_limiter(group, msgs_per_sec=10) is limiter
+    with pytest.raises(MemphisError):
+        get_shared_rate_limiter(group, msgs_per_sec=20)
+
+
+def test_slow_acks_halve_the_limits_once_per_target_latency(clock):
+    limiter = RateLimiter(msgs_per_sec=100, target_ack_latency_ms=500)
+    clock.now += 1
+    limiter.record_ack_latency(0.6)
+    assert limiter.factor == 0.5
+    # the other publishes slowed down by the same period
+    limiter.record_ack_latency(0.6)
+    assert limiter.factor == 0.5
+    clock.now += 0.5
+    limiter.record_overload()
+    assert limiter.factor == 0.25
+
+
+def test_limits_recover_gradually(clock):
+    limiter = RateLimiter(msgs_per_sec=100)
+    clock.now += 1
+    limiter.record_overload()
+    assert limiter.factor == 0.5
+    limiter.record_ack_latency(0.01)
+    # less than a second of healthy publishes
+    assert limiter.factor == 0.5
+    for _ in range(10):
+        clock.now += 1
+        limiter.record_ack_latency(0.01)
+    assert limiter.factor == pytest.approx(1.0)
+    clock.now += 1
+    limiter.record_ack_latency(0.01)
+    assert limiter.factor == 1.0
+
+
+def test_limits_have_a_floor(clock):
+    limiter = RateLimiter(bytes_per_sec=1024)
+    for _ in range(20):
+        clock.now += 1
+        limiter.record_overload()
+    assert limiter.factor == pytest.approx(1 / 64)
@@ -0,0 +1,93 @@
+import asyncio
+
+from memphis._internal.utils import Scheduler
+
+
+def test_jobs_run_periodically(loop):
+    scheduler = Scheduler()
+    runs = {"fast": 0, "slow": 0}
+
+    async def fast():
+        runs["fast"] += 1
+
+    async def slow():
+        runs["slow"] += 1
+
+    scheduler.every("fast", 0.02, fast)
+    scheduler.every("slow", 0.2, slow)
+    loop.run_until_complete(asyncio.sleep(0.3))
+    scheduler.cancel_all()
+    assert runs["fast"] >= 5
+    assert runs["slow"] == 1
+
+
+def test_job_is_skipped_while_it_runs(loop):
+    scheduler = Scheduler()
+    running = []
+    overlaps = []
+
+    async def job():
+        overlaps.append(len(running))
+        running.append(None)
+        await asyncio.sleep(0.1)
+        running.pop()
+
+    scheduler.every("job", 0.01, job)
+    loop.run_until_complete(asyncio.sleep(0.35))
+    scheduler.cancel_all()
+    assert 2 <= len(overlaps) <= 4
+    assert set(overlaps) == {0}
+
+
+def test_errors_go_to_the_handler_and_the_job_keeps_running(loop):
+    errors = []
+    scheduler = Scheduler(error_handler=errors.append)
+
+    async def job():
+        raise ValueError("failed")
+
+    scheduler.every("job", 0.02, job)
+    loop.run_until_complete(asyncio.sleep(0.15))
+    scheduler.cancel_all()
+    assert len(errors) >= 3
+    assert all(isinstance(e, ValueError) for e in errors)
+
+
+def test_jobs_are_replaced_and_cancelled_by_key(loop):
+    scheduler = Scheduler()
+    runs = []
+
+    async def first():
+        runs.append("first")
+
+    async def second():
+        runs.append("second")
+
+    scheduler.every("job", 0.02, first)
+    scheduler.every("job", 0.02, second)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert len(runs) > 0
+    assert set(runs) == {"second"}
+
+    scheduler.cancel("job")
+    runs.clear()
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert len(runs) == 0
+    scheduler.cancel_all()
+
+
+def test_cancel_all_stops_spawned_tasks(loop):
+    scheduler = Scheduler()
+
+    async def listen():
+        await asyncio.Event().wait()
+
+    async def job():
+        pass
+
+    task = scheduler.spawn("listener", listen())
+    scheduler.every("job", 0.02, job)
+    loop.run_until_complete(asyncio.sleep(0.05))
+    scheduler.cancel_all()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert task.cancelled()
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import sys
+import warnings
+
+from memphis._internal import schemaverse
+from memphis.testing import FakeBroker
+
+ORDER_SCHEMA = {
+    "type": "json",
+    "active_version": {
+        "schema_content": json.dumps({
+            "type": "object",
+            "properties": {"id": {"type": "integer"}},
+            "required": ["id"],
+        }),
+    },
+}
+
+
+def _produce(broker, payloads):
+    async def run():
+        memphis = broker.client()
+        await memphis.connect(host="localhost", username="user", password="pass")
+        producer = await memphis.producer(station_name="orders", producer_name="test")
+        for payload in payloads:
+            await producer.produce(payload)
+        await memphis.close()
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_producer_skips_validation_without_validator_libraries(monkeypatch):
+    # an import of a module set to None in sys.modules raises ImportError
+    monkeypatch.setitem(sys.modules, "fastjsonschema", None)
+    monkeypatch.setitem(sys.modules, "jsonschema", None)
+    monkeypatch.setattr(schemaverse, "_warned_missing", set())
+    broker = FakeBroker()
+    broker.create_station("orders", schema_update=ORDER_SCHEMA)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        _produce(broker, [b'{"id": 1}', b'{"name": "no id"}', b'{"id": 2}'])
+
+    assert broker.payloads("orders") == [b'{"id": 1}', b'{"name": "no id"}', b'{"id": 2}']
+    skipped = [w for w in caught if "skipping schema validation" in str(w.message)]
+    assert len(skipped) == 1
+
+
+def test_schema_is_compiled_on_first_use(monkeypatch):
+    compiled = []
+
+    def compile_validator(schema_update):
+        compiled.append(schema_update["type"])
+        return lambda message: None
+
+    monkeypatch.setattr("memphis._internal.memphis.compile_validator", compile_validator)
+    broker = FakeBroker()
+    broker.create_station("orders", schema_update=ORDER_SCHEMA)
+
+    _produce(broker, [])
+    assert len(compiled) == 0
+    _produce(broker, [b'{"id": 1}', b'{"id": 2}'])
+    assert compiled == ["json"]
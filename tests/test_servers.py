@@ -0,0 +1,42 @@
+import pytest
+
+from memphis._internal import servers
+from memphis._internal.servers import parse_servers, rank_servers
+
+# round trips in seconds, None for unreachable servers
+RTTS = {"near-a": 0.010, "near-b": 0.011, "near-c": 0.012, "far": 0.100, "down": None}
+
+
+@pytest.fixture(name="probes", autouse=True)
+def fake_probes(monkeypatch):
+    async def probe(host, _port, _timeout_sec):
+        return RTTS[host]
+    monkeypatch.setattr(servers, "probe", probe)
+
+
+def _rank(loop, names, spread_key=0):
+    ranked = loop.run_until_complete(rank_servers([(name, 6666) for name in names], spread_key))
+    return [name for name, _ in ranked]
+
+
+def test_parse_servers():
+    assert parse_servers("localhost", 6666) == [("localhost", 6666)]
+    assert parse_servers(["https://a:7000", "b", "[::1]:7001", "::1"], 6666) == \
+        [("a", 7000), ("b", 6666), ("[::1]", 7001), ("::1", 6666)]
+
+
+def test_closest_servers_come_first(loop):
+    assert _rank(loop, ["down", "far", "near-a"]) == ["near-a", "far", "down"]
+
+
+def test_unreachable_servers_keep_their_order(loop):
+    assert _rank(loop, ["down"]) == ["down"]
+    assert _rank(loop, ["down", "down"]) == ["down", "down"]
+
+
+def test_connections_are_spread_over_near_servers(loop):
+    names = ["far", "near-c", "near-a", "near-b"]
+    firsts = [_rank(loop, names, spread_key)[0] for spread_key in range(6)]
+    assert firsts == ["near-a", "near-b", "near-c"] * 2
+    # far servers stay after the rotated near ones
+    assert _rank(loop, names, 4) == ["near-b", "near-c", "near-a", "far"]
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from memphis._internal import MemphisError
+from memphis._internal.producer import Producer
+from memphis._internal.spill import SpillLog
+
+from .helpers import build_sink
+
+
+def test_spill_log_wraps_over_segments(tmp_path):
+    log = SpillLog(str(tmp_path), segment_bytes=64)
+    items = [b"item %d" % i for i in range(20)]
+    for item in items:
+        log.append(item)
+    assert len(os.listdir(tmp_path)) > 1
+
+    drained = []
+    while len(log) > 0:
+        batch = log.read(3)
+        drained.extend(bytes(item) for item in batch)
+        log.commit(len(batch))
+    assert drained == items
+    # drained segments are deleted
+    assert len(os.listdir(tmp_path)) == 0
+
+
+def test_spill_log_is_capped(tmp_path):
+    log = SpillLog(str(tmp_path), segment_bytes=64, max_bytes=128)
+    with pytest.raises(MemphisError, match="is full"):
+        for i in range(100):
+            log.append(b"item %d" % i)
+
+
+def test_spill_log_reopens_unread_items(tmp_path):
+    log = SpillLog(str(tmp_path), segment_bytes=64)
+    for item in [b"a", {"b": 1}, "c", b"d"]:
+        log.append(item)
+    log.commit(1)
+    log.close()
+
+    log = SpillLog(str(tmp_path), segment_bytes=64)
+    assert log.read(10) == [{"b": 1}, "c", bytearray(b"d")]
+
+
+def test_spilled_items_are_drained_in_order_after_reconnect(broker, tmp_path):
+    sink = build_sink(broker, "events", spill_dir=str(tmp_path))
+    sink.write(b"0")
+    broker.disconnect()
+    for i in range(1, 5):
+        sink.write(b"%d" % i)
+    assert broker.payloads("events") == [b"0"]
+
+    broker.reconnect()
+    sink.write(b"5")
+    sink.close()
+    assert broker.payloads("events") == [b"%d" % i for i in range(6)]
+
+
+def test_close_raises_and_keeps_items_it_could_not_publish(broker, tmp_path):
+    sink = build_sink(broker, "events", spill_dir=str(tmp_path), reconnect_timeout_sec=0.2)
+    broker.disconnect()
+    sink.write(b"a")
+    sink.write(b"b")
+    with pytest.raises(MemphisError, match="2 spilled items could not be published"):
+        sink.close()
+
+    # the next sink with the same spill directory publishes them
+    broker.reconnect()
+    sink = build_sink(broker, "events", spill_dir=str(tmp_path))
+    sink.close()
+    assert broker.payloads("events") == [b"a", b"b"]
+
+
+def test_unpublishable_items_are_not_spilled(broker, tmp_path):
+    sink = build_sink(broker, "events", spill_dir=str(tmp_path))
+    broker.disconnect()
+    with pytest.raises(MemphisError, match="type str can not be published"):
+        sink.write("text")
+    broker.reconnect()
+    sink.close()
+
+
+def test_spilled_item_that_can_not_be_published_is_dropped(broker, tmp_path, monkeypatch):
+    produce = Producer.produce
+
+    async def reject_bad(self, message, *args, **kwargs):
+        if bytes(message) == b"bad":
+            raise MemphisError("rejected")
+        return await produce(self, message, *args, **kwargs)
+
+    monkeypatch.setattr(Producer, "produce", reject_bad)
+    sink = build_sink(broker, "events", spill_dir=str(tmp_path))
+    broker.disconnect()
+    for item in [b"a", b"bad", b"b"]:
+        sink.write(item)
+    broker.reconnect()
+    # the write that drains the item fails, and is not published
+    with pytest.raises(MemphisError, match="rejected"):
+        sink.write(b"c")
+    sink.write(b"d")
+    sink.close()
+    assert broker.payloads("events") == [b"a", b"b", b"d"]
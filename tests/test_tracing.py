@@ -0,0 +1,48 @@
+import pytest
+
+from memphis import tracing
+
+from .helpers import build_sink, build_source, read
+
+sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+in_memory = pytest.importorskip("opentelemetry.sdk.trace.export.in_memory_span_exporter")
+span_export = pytest.importorskip("opentelemetry.sdk.trace.export")
+
+
+@pytest.fixture(name="otel_spans")
+def opentelemetry_spans():
+    spans = in_memory.InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(span_export.SimpleSpanProcessor(spans))
+    tracing.set_exporter(tracing.OpenTelemetryExporter(provider))
+    yield spans
+    tracing.set_exporter(None)
+
+
+def test_opentelemetry_spans_keep_their_parents(otel_spans):
+    with tracing.start_span("outer") as outer:
+        with tracing.start_span("inner") as inner:
+            pass
+
+    exported = {span.name: span for span in otel_spans.get_finished_spans()}
+    assert format(exported["outer"].context.span_id, "016x") == outer.span_id
+    assert format(exported["inner"].context.span_id, "016x") == inner.span_id
+    assert exported["inner"].parent.span_id == exported["outer"].context.span_id
+    assert exported["inner"].context.trace_id == exported["outer"].context.trace_id
+
+
+def test_opentelemetry_acks_are_children_of_exported_produce_spans(broker, otel_spans):
+    sink = build_sink(broker, "events")
+    for i in range(3):
+        sink.write(b"m%d" % i)
+    sink.close()
+    source = build_source(broker, "events")
+    read(source, 3)
+    source.next()
+    source.close()
+
+    spans = otel_spans.get_finished_spans()
+    produce_ids = {span.context.span_id for span in spans if span.name == "memphis.produce"}
+    acks = [span for span in spans if span.name == "memphis.ack"]
+    assert len(acks) == 3
+    assert {span.parent.span_id for span in acks} == produce_ids